@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spam_detection.settings')
 
 application = get_asgi_application()
+
+# Shared filter of reported numbers, opened before the first request
+from users import bloom  # noqa: E402
+
+bloom.open_at_startup()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'users.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,17 +78,72 @@ WSGI_APPLICATION = 'spam_detection.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgres selects PostgreSQL (needs psycopg) configured by the
+# other DB_* variables, otherwise the SQLite file next to manage.py is used.
+# Connections are kept open for DB_CONN_MAX_AGE seconds between requests
+def database_settings(environ):
+    conn_max_age = int(environ.get('DB_CONN_MAX_AGE', 60))
+
+    if environ.get('DB_ENGINE', 'sqlite') == 'postgres':
+        database = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': environ.get('DB_NAME', 'spam_detection'),
+            'USER': environ.get('DB_USER', ''),
+            'PASSWORD': environ.get('DB_PASSWORD', ''),
+            'HOST': environ.get('DB_HOST', ''),
+            'PORT': environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': conn_max_age,
+            # Persistent connections are checked before they are reused
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+        # DB_POOL_MAX_SIZE enables psycopg's connection pool instead, shared by
+        # the threads of a worker. Django requires CONN_MAX_AGE = 0 with a pool
+        if environ.get('DB_POOL_MAX_SIZE'):
+            database['CONN_MAX_AGE'] = 0
+            database['OPTIONS']['pool'] = {
+                'min_size': int(environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(environ['DB_POOL_MAX_SIZE']),
+                'timeout': 10,
+            }
+        return {'default': database}
+
+    # The journal mode is stored in the database file, so WAL is opt-in with
+    # DB_SQLITE_JOURNAL_MODE=WAL and the checked in db.sqlite3 keeps SQLite's
+    # rollback journal. WAL lets searches read while a report is written and
+    # then NORMAL only syncs the log at checkpoints (a power loss can drop the
+    # last commits but not corrupt the file), other modes keep FULL.
+    # Reads are served from a memory map of up to DB_SQLITE_MMAP_SIZE bytes
+    journal_mode = environ.get('DB_SQLITE_JOURNAL_MODE', 'DELETE').upper()
+    synchronous = environ.get('DB_SQLITE_SYNCHRONOUS', 'NORMAL' if journal_mode == 'WAL' else 'FULL')
+    return {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': conn_max_age,
+            'OPTIONS': {
+                'init_command': (
+                    f"PRAGMA journal_mode={journal_mode};"
+                    f"PRAGMA synchronous={synchronous};"
+                    f"PRAGMA mmap_size={int(environ.get('DB_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))};"
+                    "PRAGMA temp_store=MEMORY;"
+                ),
+                # Writers take the write lock at BEGIN, so concurrent reports
+                # wait for it instead of failing to upgrade a read lock
+                'transaction_mode': environ.get('DB_SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+                # Seconds a writer waits for the lock before 'database is locked'
+                'timeout': 20,
+            },
+        }
     }
-}
 
-# Redis 
+
+DATABASES = database_settings(os.environ)
+
+# Redis, the backend adds native async methods used by the async views
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "users.cache_backends.AsyncRedisCache",
         "LOCATION": "redis://127.0.0.1:6379/1",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
@@ -94,6 +151,29 @@ CACHES = {
     }
 }
 
+# Password hashing: PASSWORD_HASHER ('pbkdf2', 'argon2' or 'bcrypt') hashes new
+# passwords, the others still verify existing hashes, which are rehashed on
+# the next login. 'argon2' needs argon2-cffi and 'bcrypt' needs bcrypt. The
+# cost settings default to Django's values when None, changing them also
+# rehashes on login. Compare configurations with benchmark_hashers
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+password_hasher_classes = {
+    'pbkdf2': 'users.hashers.PBKDF2PasswordHasher',
+    'argon2': 'users.hashers.Argon2PasswordHasher',
+    'bcrypt': 'users.hashers.BCryptSHA256PasswordHasher',
+}
+PASSWORD_HASHERS = [password_hasher_classes.pop(PASSWORD_HASHER), *password_hasher_classes.values()]
+PASSWORD_PBKDF2_ITERATIONS = None
+PASSWORD_ARGON2_TIME_COST = None
+PASSWORD_ARGON2_MEMORY_COST = None
+PASSWORD_ARGON2_PARALLELISM = None
+PASSWORD_BCRYPT_ROUNDS = None
+# Threads per worker hashing passwords for the async login view
+PASSWORD_HASHING_THREADS = 4
+
+# Logins load the user's API token with the user
+AUTHENTICATION_BACKENDS = ['users.backends.TokenModelBackend']
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -137,19 +217,112 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
+# Phone numbers without a country code are assumed to be national numbers
+PHONE_DEFAULT_COUNTRY_CODE = '91'
+PHONE_NATIONAL_NUMBER_LENGTH = 10
+
+# Number of phone book entries validated and written per batch by the contact sync endpoint
+CONTACT_SYNC_BATCH_SIZE = 500
+
+# Maximum number of phone numbers accepted by one batch spam report
+SPAM_REPORT_BATCH_SIZE = 500
+
+# Number of most saved contact names returned for numbers that are not registered
+CONTACT_TOP_NAMES = 3
+
+# Maximum number of phone numbers identified by one caller-ID batch lookup
+CALLER_ID_BATCH_SIZE = 200
+
+# Name search backend: 'scan', 'trigram', 'postgres' or a dotted class path.
+# None picks 'postgres' on PostgreSQL and the in-repo 'trigram' index elsewhere
+USER_SEARCH_BACKEND = None
+
+# Spam scoring: reports lose half their weight every SPAM_SCORE_HALF_LIFE_DAYS,
+# reporters with more than SPAM_REPORTER_QUOTA reports are down-weighted and a
+# decayed score of SPAM_SCORE_SATURATION means a spam likelihood of 1.0
+SPAM_SCORE_HALF_LIFE_DAYS = 90
+SPAM_REPORTER_QUOTA = 50
+SPAM_SCORE_SATURATION = 10
+
+# Contacts saved under a name containing one of these words are negative
+# labels of their number (users/lexicon.py). Matched as whole words of the
+# casefolded name, compiled once into one automaton however long the list is
+SPAM_NAME_LEXICON = [
+    # English
+    'spam', 'spammer', 'fraud', 'scam', 'scammer', 'fake', 'telemarketer', 'telemarketing', 'robocall',
+    'do not pick', 'dont pick', "don't pick", 'do not answer', 'dont answer', "don't answer",
+    # Hindi and Hinglish
+    'फ्रॉड', 'धोखा', 'धोखेबाज', 'स्पैम', 'फर्जी', 'मत उठाना', 'mat uthana', 'mat uthao', 'farzi', 'dhokha',
+    # Spanish, Portuguese and French
+    'estafa', 'fraude', 'golpe', 'arnaque', 'no contestar', 'não atender',
+]
+
+# Spam propagation over the contact graph (users/graph.py, propagate_spam_scores).
+# Reports and the negative labels of SPAM_NAME_LEXICON seed the scores,
+# SPAM_GRAPH_ALPHA is the share of a score that comes from the numbers saved
+# in the same phone books. SPAM_GRAPH_NAME_PRIOR pseudo-saves keep a single
+# "Spam" contact from flagging a number, and propagated scores below
+# SPAM_GRAPH_MIN_SCORE are dropped
+SPAM_GRAPH_ALPHA = 0.5
+SPAM_GRAPH_NAME_PRIOR = 5
+SPAM_GRAPH_MIN_SCORE = 0.05
+SPAM_GRAPH_TOLERANCE = 1e-4
+SPAM_GRAPH_MAX_ITERATIONS = 50
+
+# Write-behind spam reports (users/report_queue.py): 'redis' appends reports
+# to the SPAM_REPORT_STREAM stream of the default cache's Redis server,
+# 'local' to an in-process queue, drain_spam_reports writes them in batches.
+# None records every report in the request. The local queue is drained by
+# a thread of the web process unless SPAM_REPORT_LOCAL_WORKER is off. A
+# reporter sees their queued report for at most SPAM_REPORT_PENDING_TIMEOUT
+# seconds, and reports a worker left unacknowledged are claimed after
+# SPAM_REPORT_CLAIM_IDLE_MS
+SPAM_REPORT_QUEUE = os.environ.get('SPAM_REPORT_QUEUE') or None
+SPAM_REPORT_STREAM = 'spam-reports'
+SPAM_REPORT_LOCAL_WORKER = True
+SPAM_REPORT_DRAIN_BATCH_SIZE = 500
+SPAM_REPORT_PENDING_TIMEOUT = 3600
+SPAM_REPORT_CLAIM_IDLE_MS = 60_000
+
+# Shared Bloom filter of reported numbers used to skip spam score queries for
+# numbers nobody reported (users/bloom.py). Set a path on a local disk shared
+# by the workers of a host to enable it, the file is built at worker startup
+SPAM_BLOOM_PATH = os.environ.get('SPAM_BLOOM_PATH')
+SPAM_BLOOM_CAPACITY = 10_000_000
+SPAM_BLOOM_ERROR_RATE = 0.001
+
+# Authenticated tokens are cached per worker (LRU) and in the shared cache,
+# see users/authentication.py. A deleted token keeps working on other workers
+# for at most AUTH_TOKEN_LOCAL_TIMEOUT seconds
+AUTH_TOKEN_LRU_SIZE = 10_000
+AUTH_TOKEN_LOCAL_TIMEOUT = 10
+AUTH_TOKEN_CACHE_TIMEOUT = 300
+
+# Per-request query count, DB, cache and serializer timings in a Server-Timing
+# header and as Prometheus metrics on users/internal/metrics/ for INTERNAL_IPS,
+# see users/instrumentation.py. Requests slower than API_SLOW_REQUEST_MS are
+# logged with their SQL
+API_INSTRUMENTATION = os.environ.get('API_INSTRUMENTATION', '') == '1'
+API_SLOW_REQUEST_MS = int(os.environ.get('API_SLOW_REQUEST_MS', 500))
+INTERNAL_IPS = os.environ.get('INTERNAL_IPS', '127.0.0.1').split(',')
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'users.throttling.GCRAThrottle',
     ],
+    # 'user' and 'anon' apply to views without a throttle_scope
     'DEFAULT_THROTTLE_RATES': {
         'anon': '10/m',
-        'user': '20/m'
+        'user': '20/m',
+        'registration': '20/m',
+        'login': '10/m',
+        'caller_id': '600/m',
+        'contact_sync': '6/m',
     }
 }
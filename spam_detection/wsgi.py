@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spam_detection.settings')
 
 application = get_wsgi_application()
+
+# Shared filter of reported numbers, opened before the first request
+from users import bloom  # noqa: E402
+
+bloom.open_at_startup()
@@ -1,7 +1,8 @@
 from django.contrib import admin
-from users.models import CustomUser, RegisteredUserContact, ReportedUserSpam
+from users.models import CustomUser, RegisteredUserContact, ReportedUserSpam, PhoneSpamStats
 
 # Register your models here.
 admin.site.register(CustomUser)
 admin.site.register(RegisteredUserContact)
-admin.site.register(ReportedUserSpam)
\ No newline at end of file
+admin.site.register(ReportedUserSpam)
+admin.site.register(PhoneSpamStats)
\ No newline at end of file
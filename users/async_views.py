@@ -0,0 +1,289 @@
+import hashlib
+import json
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db import IntegrityError
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.authentication import get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from users import authentication, hashers, report_queue, search_cache
+from users.models import ContactNameVote, CustomUser, RegisteredUserContact, PhoneSpamStats
+from users.pagination import InvalidCursor, aestimated_total, akeyset_page, anumbered_page
+from users.phone import phone_key
+from users.throttling import GCRAThrottle
+from users.serializers import ReportedUserSpamSerializer, SearchUserSerializer, UserLoginSerializer
+from users.views import MarkSpamMixin, NameSearchMixin, PhoneSearchMixin, awith_queued_reports, page_cache_suffix, read_page_params
+
+
+##############################################################################
+# Async variants of the login, search and report views
+# Served under the ASGI application (spam_detection/asgi.py), each worker can
+# keep many lookups in flight while they wait on the database or Redis. They
+# return the same responses and share the cache entries of the sync views.
+# DRF views are synchronous, so authentication and throttling are done here
+# with the same token cache, permission classes and throttle rates.
+##############################################################################
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [GCRAThrottle]
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await self.authenticate(request)
+            for permission in [permission() for permission in self.permission_classes]:
+                if not permission.has_permission(request, self):
+                    raise exceptions.NotAuthenticated()
+            await self.check_throttles(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as error:
+            return self.handle_exception(error)
+
+    async def authenticate(self, request):
+        # Same rules and messages as DRF's TokenAuthentication
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != b'token':
+            return AnonymousUser()
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        # Same two cache tiers as CachedTokenAuthentication
+        token = await authentication.tokens.aget(key)
+        if token is not None:
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed('User inactive or deleted.')
+            return token.user
+
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        await authentication.tokens.aset(token)
+        return token.user
+
+    async def check_throttles(self, request):
+        for throttle in [throttle() for throttle in self.throttle_classes]:
+            if not await throttle.aallow_request(request, self):
+                raise exceptions.Throttled(throttle.wait())
+
+    def handle_exception(self, error):
+        response = JsonResponse({"detail": str(error.detail)}, status=error.status_code)
+        if isinstance(error, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response.status_code = status.HTTP_401_UNAUTHORIZED
+            response['WWW-Authenticate'] = 'Token'
+        if getattr(error, 'wait', None):
+            response['Retry-After'] = str(int(error.wait))
+        return response
+
+    def request_data(self, request):
+        if request.content_type == 'application/json':
+            try:
+                return json.loads(request.body or b'{}')
+            except ValueError:
+                raise exceptions.ParseError()
+        return request.POST
+
+
+
+class AsyncUserLoginView(AsyncAPIView):
+    permission_classes = [AllowAny]
+    throttle_scope = 'login'
+
+    async def post(self, request):
+        # Deserialize the data
+        serializer = UserLoginSerializer(data=self.request_data(request))
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        user = await self.authenticate_credentials(
+            serializer.validated_data.get("username"), serializer.validated_data.get("password")
+        )
+        if user is None:
+            return JsonResponse({"message": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
+
+        token = getattr(user, 'auth_token', None)
+        if token is None:
+            token, _ = await Token.objects.aget_or_create(user=user)
+        return JsonResponse({"message": f"token {token.key}"}, status=status.HTTP_201_CREATED)
+
+    async def authenticate_credentials(self, username, password):
+        # TokenModelBackend with the password hashing in the hashing pool
+        try:
+            user = await CustomUser.objects.select_related('auth_token').aget(username=username)
+        except CustomUser.DoesNotExist:
+            await hashers.aharden_runtime(password)
+            return None
+        if await hashers.acheck_password(user, password) and user.is_active:
+            return user
+        return None
+
+
+
+class AsyncMarkPhoneNumberAsSpamView(MarkSpamMixin, AsyncAPIView):
+    async def post(self, request):
+        # Deserialize the data
+        serializer = ReportedUserSpamSerializer(data=self.request_data(request))
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        phone_number = serializer.validated_data.get('phone_number')
+        if report_queue.enabled():
+            report_id = await sync_to_async(self.queue_spam)(phone_number, request.user)
+            if report_id is None:
+                return JsonResponse({
+                    "message": "You have already marked this number as spam."
+                }, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse(self.queued_response_body(phone_number, report_id), status=status.HTTP_202_ACCEPTED)
+
+        # The async ORM has no transactions, the report is recorded in one
+        # thread sensitive call just like the sync view does it
+        try:
+            spam = await sync_to_async(self.record_spam)(phone_number, request.user)
+        except IntegrityError:
+            return JsonResponse({
+                "message": "You have already marked this number as spam."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Invalidate only the cached searches that contain this number
+        await search_cache.ainvalidate([search_cache.phone_tag(spam.phone_key)])
+        return JsonResponse(self.spam_response_body(phone_number, spam), status=status.HTTP_201_CREATED)
+
+
+
+class AsyncSearchUserByUserNameView(NameSearchMixin, AsyncAPIView):
+    async def get(self, request):
+        search_query = request.GET.get('name', '').strip()
+        if not search_query:
+            return JsonResponse({"error": "Name query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            params = read_page_params(request.GET)
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        result_size = params['result_size']
+
+        # Same cache entries as the sync view
+        query_hash = hashlib.md5(search_query.lower().encode()).hexdigest()
+        cache_key = f"user_search_{request.user.id}_{query_hash}_{page_cache_suffix(params)}"
+        cached_results = await search_cache.aget_entry(cache_key, [search_cache.contacts_tag(request.user.id)])
+        if cached_results is not None:
+            return JsonResponse(await awith_queued_reports(request.user, cached_results), status=status.HTTP_200_OK)
+
+        results = self.search_queryset(request.user, search_query)
+
+        if params['pagination'] == 'cursor':
+            try:
+                page, next_cursor = await akeyset_page(results, params['cursor'], result_size, rank_field='rank')
+            except InvalidCursor as error:
+                return JsonResponse({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+            response_body = {
+                "results": self.serialize_page(page),
+                "next_cursor": next_cursor,
+                "results_per_page": result_size
+            }
+            if params['include_total']:
+                response_body["total_results"] = await aestimated_total(f"user_search_total_{query_hash}", results)
+        else:
+            page, page_info = await anumbered_page(results, params['page'], result_size)
+            response_body = {
+                "results": self.serialize_page(page),
+                **page_info,
+                "results_per_page": result_size
+            }
+
+        await search_cache.aset_entry(cache_key, response_body, self.cache_tags(request.user, page), timeout=100)
+        return JsonResponse(await awith_queued_reports(request.user, response_body), status=status.HTTP_200_OK)
+
+
+
+class AsyncSearchUserByPhoneNumberView(PhoneSearchMixin, AsyncAPIView):
+    async def get(self, request):
+        phone_number = request.GET.get('phone_number', '').strip()
+        if not phone_number:
+            return JsonResponse({"error": "Phone number query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            key = phone_key(phone_number)
+            params = read_page_params(request.GET)
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Viewer independent layer shared with the sync view
+        tags = [search_cache.phone_tag(key)]
+        lookup_key = f"user_phone_search_{key}"
+        lookup = await search_cache.aget_entry(lookup_key, tags)
+        if lookup is None:
+            lookup = await self.lookup_registered_user(key)
+            await search_cache.aset_entry(lookup_key, lookup, tags, timeout=600)
+
+        if lookup['user'] is not None:
+            user_data = dict(lookup['user'])
+            # email is displayed if person is a registered user and
+            # user who is searching is in the person’s contact list
+            if await self.is_in_viewer_contacts(request.user, key):
+                user_data["email"] = lookup['email']
+            user_data = (await report_queue.aoverlay(request.user, [user_data]))[0]
+            return JsonResponse(SearchUserSerializer(user_data).data, status=status.HTTP_200_OK)
+
+        page_key = f"user_phone_search_{key}_{page_cache_suffix(params)}"
+        response_body = await search_cache.aget_entry(page_key, tags)
+        if response_body is None:
+            try:
+                response_body = await self.contacts_page(key, params)
+            except InvalidCursor as error:
+                return JsonResponse({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+            await search_cache.aset_entry(page_key, response_body, tags, timeout=100)
+
+        if not response_body:
+            return JsonResponse({"message": "No results found for this phone number."}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse(await awith_queued_reports(request.user, response_body), status=status.HTTP_200_OK)
+
+    async def lookup_registered_user(self, key):
+        user = await CustomUser.objects.filter(phone_key=key).afirst()
+        spam_likelihood = (await PhoneSpamStats.alikelihoods_for([key]))[key] if user else None
+        return self.registered_user_data(user, spam_likelihood)
+
+    async def is_in_viewer_contacts(self, viewer, key):
+        membership_key = f"contact_membership_{viewer.id}_{key}"
+        tags = [search_cache.contacts_tag(viewer.id)]
+        is_contact = await search_cache.aget_entry(membership_key, tags)
+        if is_contact is None:
+            is_contact = await RegisteredUserContact.objects.filter(contact_of=viewer, phone_key=key).aexists()
+            await search_cache.aset_entry(membership_key, is_contact, tags, timeout=600)
+        return is_contact
+
+    async def contacts_page(self, key, params):
+        contacts = RegisteredUserContact.objects.filter(phone_key=key).order_by('id')
+        result_size = params['result_size']
+        if params['pagination'] == 'cursor':
+            page, next_cursor = await akeyset_page(contacts, params['cursor'], result_size)
+            # Only the first page can tell that nobody saved this number
+            if not page and not params['cursor']:
+                return {}
+            page_info = {"next_cursor": next_cursor}
+            if params['include_total']:
+                page_info["total_results"] = await aestimated_total(f"user_phone_search_total_{key}", contacts)
+        else:
+            page, page_info = await anumbered_page(contacts, params['page'], result_size)
+            if page_info['total_results'] == 0:
+                return {}
+
+        spam_likelihood = (await PhoneSpamStats.alikelihoods_for([key]))[key]
+        return {
+            "top_names": await ContactNameVote.atop_names(key),
+            "results": self.serialize_contacts(page, spam_likelihood),
+            **page_info,
+            "results_per_page": result_size
+        }
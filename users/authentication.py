@@ -0,0 +1,121 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from users.models import CustomUser
+
+
+##############################################################################
+# Token authentication without a database query per request
+# Tokens resolved once are kept in a small LRU in every worker and in the
+# shared cache (Redis) for the other workers. Only the user id and the
+# is_active flag are cached, never a pickled user with its password hash,
+# and every request gets its own user instance built from them. The other
+# user fields are deferred, reading one loads the row. Deleting a token (logout or
+# rotation) and saving or deleting its user drop both tiers right away in
+# this worker. Other workers drop their LRU entry after at most
+# AUTH_TOKEN_LOCAL_TIMEOUT seconds, which bounds how long a revoked token
+# keeps working there.
+##############################################################################
+
+def cache_key(token_key):
+    # Only a digest of the token is ever written to the shared cache
+    return f"auth_token_{hashlib.sha256(token_key.encode()).hexdigest()}"
+
+
+def cached_fields(token):
+    return {'user_id': token.user_id, 'is_active': token.user.is_active}
+
+
+def token_from_fields(token_key, fields):
+    # A fresh instance per request, workers never share a user between threads
+    user = CustomUser.from_db(DEFAULT_DB_ALIAS, ['id', 'is_active'], [fields['user_id'], fields['is_active']])
+    token = Token(key=token_key, user_id=fields['user_id'])
+    token.user = user
+    return token
+
+
+class TokenCache:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_local(self, token_key):
+        with self.lock:
+            entry = self.entries.get(token_key)
+            if entry is None:
+                return None
+            fields, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[token_key]
+                return None
+            self.entries.move_to_end(token_key)
+            return fields
+
+    def set_local(self, token_key, fields):
+        with self.lock:
+            self.entries[token_key] = (fields, time.monotonic() + settings.AUTH_TOKEN_LOCAL_TIMEOUT)
+            self.entries.move_to_end(token_key)
+            while len(self.entries) > settings.AUTH_TOKEN_LRU_SIZE:
+                self.entries.popitem(last=False)
+
+    def get(self, token_key):
+        # The cached token with a user of its own, or None
+        fields = self.get_local(token_key)
+        if fields is None:
+            fields = cache.get(cache_key(token_key))
+            if fields is not None:
+                self.set_local(token_key, fields)
+        return None if fields is None else token_from_fields(token_key, fields)
+
+    async def aget(self, token_key):
+        fields = self.get_local(token_key)
+        if fields is None:
+            fields = await cache.aget(cache_key(token_key))
+            if fields is not None:
+                self.set_local(token_key, fields)
+        return None if fields is None else token_from_fields(token_key, fields)
+
+    def set(self, token):
+        # The token's user was loaded by select_related()
+        fields = cached_fields(token)
+        self.set_local(token.key, fields)
+        cache.set(cache_key(token.key), fields, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+    async def aset(self, token):
+        fields = cached_fields(token)
+        self.set_local(token.key, fields)
+        await cache.aset(cache_key(token.key), fields, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+    def invalidate(self, token_keys):
+        token_keys = list(token_keys)
+        with self.lock:
+            for token_key in token_keys:
+                self.entries.pop(token_key, None)
+        cache.delete_many([cache_key(token_key) for token_key in token_keys])
+
+    def clear_local(self):
+        with self.lock:
+            self.entries.clear()
+
+
+tokens = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        token = tokens.get(key)
+        if token is not None:
+            if not token.user.is_active:
+                raise AuthenticationFailed('User inactive or deleted.')
+            return token.user, token
+        # Unknown and inactive tokens fail here and are never cached
+        user, token = super().authenticate_credentials(key)
+        tokens.set(token)
+        return user, token
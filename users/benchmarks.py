@@ -0,0 +1,123 @@
+import asyncio
+import io
+import math
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection
+
+
+##############################################################################
+# Helpers shared by the benchmark management commands
+##############################################################################
+
+FIRST_NAMES = ['aarav', 'vivaan', 'aditya', 'vihaan', 'arjun', 'sai', 'reyansh', 'ayaan', 'krishna', 'ishaan',
+               'ananya', 'diya', 'aadhya', 'saanvi', 'pari', 'anika', 'navya', 'myra', 'sara', 'kiara',
+               'john', 'maria', 'wei', 'fatima', 'olga', 'kenji', 'lucas', 'emma', 'noah', 'zara']
+LAST_NAMES = ['sharma', 'verma', 'gupta', 'singh', 'kumar', 'patel', 'reddy', 'nair', 'iyer', 'mishra',
+              'tomar', 'das', 'khan', 'joshi', 'mehta', 'smith', 'garcia', 'chen', 'ivanova', 'tanaka']
+# Users of generate_synthetic_data, all share one password
+SYNTHETIC_PREFIX = 'synth_'
+SYNTHETIC_PASSWORD = 'synthetic-password'
+# Names hot numbers (call centres, delivery, banks) are saved under
+BUSINESS_NAMES = ['customer care', 'bank helpline', 'pizza delivery', 'courier', 'insurance', 'credit card offers',
+                  'taxi', 'hospital', 'telecom support', 'loan agent']
+
+
+def add_scratch_argument(parser):
+    parser.add_argument(
+        '--scratch', action='store_true', help="Confirm that the configured database is a scratch database."
+    )
+
+
+def require_scratch_database(options):
+    # Commands writing to the configured database only run with --scratch
+    # and never on the checked in db.sqlite3
+    if not options['scratch']:
+        raise CommandError("Writes to the configured database, pass --scratch to run it on a scratch database.")
+    if Path(str(connection.settings_dict['NAME'])) == settings.BASE_DIR / 'db.sqlite3':
+        raise CommandError("Refusing to run on the project database, point DB_NAME at a scratch database.")
+
+
+def zipf_weights(count, exponent=1.0):
+    # Cumulative weights for random.choices(), the k-th item is drawn ~ 1 / k ** exponent
+    weights, total = [], 0.0
+    for rank in range(1, count + 1):
+        total += 1 / rank ** exponent
+        weights.append(total)
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed=None):
+    # Latencies in seconds in, milliseconds out
+    ordered = sorted(latencies)
+    summary = {
+        "count": len(ordered),
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3) if ordered else 0.0,
+        "p50_ms": round(1000 * percentile(ordered, 0.50), 3),
+        "p95_ms": round(1000 * percentile(ordered, 0.95), 3),
+        "p99_ms": round(1000 * percentile(ordered, 0.99), 3),
+    }
+    if elapsed:
+        summary["throughput_per_s"] = round(len(ordered) / elapsed, 1)
+    return summary
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def call_wsgi(handler, environ):
+    # Runs a request through a WSGIHandler like a threaded server, returns the status code
+    status = []
+    environ['wsgi.errors'] = io.StringIO()
+    response = handler(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+    for _ in response:
+        pass
+    # Sends request_finished, which closes or keeps the connection per CONN_MAX_AGE
+    response.close()
+    return int(status[0].split()[0])
+
+
+async def call_asgi(handler, environ):
+    # Same for an ASGIHandler, the request is given as a RequestFactory environ
+    headers = [(b'host', environ.get('HTTP_HOST', 'localhost').encode())]
+    headers += [
+        (name[5:].replace('_', '-').lower().encode(), value.encode())
+        for name, value in environ.items() if name.startswith('HTTP_') and name != 'HTTP_HOST'
+    ]
+    if environ.get('CONTENT_TYPE'):
+        headers.append((b'content-type', environ['CONTENT_TYPE'].encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': environ['REQUEST_METHOD'], 'path': environ['PATH_INFO'], 'root_path': '',
+        'query_string': environ.get('QUERY_STRING', '').encode(), 'headers': headers,
+        'client': (environ.get('REMOTE_ADDR', '127.0.0.1'), 0), 'server': ('localhost', 80),
+    }
+    body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client never disconnects, the handler cancels this wait
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    return status[0]
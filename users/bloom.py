@@ -0,0 +1,262 @@
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+##############################################################################
+# Shared Bloom filter of every reported phone number
+# Most phone lookups are for numbers nobody ever reported. The filter answers
+# "definitely never reported" from memory, so those lookups skip the spam
+# score query. Numbers scored by the contact graph (users/graph.py) count as
+# reported. The bits live in a memory-mapped file, so every worker process
+# on a host shares one copy in the page cache.
+#
+# File layout: a 64 byte header (magic, number of bits, number of hashes and
+# the latest PhoneSpamStats.scored_at already added, in microseconds)
+# followed by the bit array.
+#   - Workers open the file at startup (wsgi.py and asgi.py), or on first use
+#     if that failed. They build it when it is missing and add the numbers
+#     scored after the watermark (catch up).
+#   - New reports set their bits under an exclusive flock.
+#   - Every CATCH_UP_INTERVAL seconds a worker catches up again, numbers
+#     scored on other hosts or by processes without the filter reach it too.
+#     Rows scored up to CATCH_UP_OVERLAP seconds before the watermark are
+#     read again, a transaction committing after a later one is not missed.
+#   - A rebuild writes a new file and renames it into place. Workers notice
+#     the new inode within RELOAD_INTERVAL seconds and map it.
+# False positives only cost the query that would have run anyway, so bits are
+# never cleared. Rebuild with the build_spam_bloom command to drop numbers
+# whose reports were deleted.
+##############################################################################
+
+MAGIC = b'SPAMBLM2'
+HEADER = struct.Struct('<8sQQQ')
+HEADER_SIZE = 64
+RELOAD_INTERVAL = 5.0
+CATCH_UP_INTERVAL = 5.0
+CATCH_UP_OVERLAP = 60.0
+
+
+def optimal_parameters(capacity, error_rate):
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class SharedBloomFilter:
+    def __init__(self, path, capacity, error_rate):
+        self.path = str(path)
+        self.lock_path = f"{self.path}.lock"
+        self.bits, self.hashes = optimal_parameters(capacity, error_rate)
+        self.size = HEADER_SIZE + (self.bits + 7) // 8
+        self.map = None
+        self.inode = None
+        self.checked_at = 0.0
+        self.caught_up_at = 0.0
+
+    def positions(self, key):
+        # Double hashing over one 128 bit digest (Kirsch and Mitzenmacher)
+        first, second = struct.unpack('<QQ', hashlib.blake2b(key.to_bytes(8, 'little'), digest_size=16).digest())
+        second |= 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        self.reload_if_replaced()
+        bitmap = self.map
+        return all(bitmap[HEADER_SIZE + bit // 8] & (1 << (bit % 8)) for bit in self.positions(key))
+
+    @property
+    def watermark(self):
+        return HEADER.unpack_from(self.map, 0)[3]
+
+    def open(self):
+        # Maps the file, building it first if it is missing or was built
+        # with other parameters
+        with self.locked():
+            if not self.is_valid_file():
+                self.build()
+            self.remap()
+
+    def add(self, keys, watermark=None):
+        with self.locked():
+            # Bits set in a replaced file would be lost
+            if os.stat(self.path).st_ino != self.inode:
+                self.remap()
+            self.set_bits(self.map, keys)
+            if watermark is not None and watermark > self.watermark:
+                HEADER.pack_into(self.map, 0, MAGIC, self.bits, self.hashes, watermark)
+
+    def catch_up(self):
+        # Adds the numbers scored since the watermark, in batches
+        from users.models import PhoneSpamStats
+        self.caught_up_at = time.monotonic()
+        since = from_microseconds(max(0, self.watermark - int(CATCH_UP_OVERLAP * 1e6)))
+        rows = PhoneSpamStats.scored().filter(scored_at__gte=since).values_list('scored_at', 'phone_key')
+        keys, watermark = [], 0
+        for scored_at, key in rows.iterator(chunk_size=10000):
+            keys.append(key)
+            watermark = max(watermark, to_microseconds(scored_at))
+            if len(keys) == 10000:
+                self.add(keys)
+                keys = []
+        if keys or watermark:
+            self.add(keys, watermark=watermark)
+
+    def catch_up_due(self):
+        return time.monotonic() - self.caught_up_at >= CATCH_UP_INTERVAL
+
+    def rebuild(self):
+        with self.locked():
+            self.build()
+            self.remap()
+
+    def build(self):
+        # Written next to the target and renamed into place, so readers
+        # always map a complete file
+        from users.models import PhoneSpamStats
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w+b') as handle:
+            handle.truncate(self.size)
+            bitmap = mmap.mmap(handle.fileno(), self.size)
+            watermark = 0
+            rows = PhoneSpamStats.scored().values_list('scored_at', 'phone_key')
+            for scored_at, key in rows.iterator(chunk_size=10000):
+                self.set_bits(bitmap, [key])
+                if scored_at is not None:
+                    watermark = max(watermark, to_microseconds(scored_at))
+            HEADER.pack_into(bitmap, 0, MAGIC, self.bits, self.hashes, watermark)
+            bitmap.flush()
+            bitmap.close()
+        os.replace(temporary_path, self.path)
+
+    def set_bits(self, bitmap, keys):
+        for key in keys:
+            for bit in self.positions(key):
+                bitmap[HEADER_SIZE + bit // 8] |= 1 << (bit % 8)
+
+    def is_valid_file(self):
+        try:
+            with open(self.path, 'rb') as handle:
+                magic, bits, hashes, _ = HEADER.unpack(handle.read(HEADER.size))
+            return (magic, bits, hashes) == (MAGIC, self.bits, self.hashes) and os.path.getsize(self.path) == self.size
+        except (OSError, struct.error):
+            return False
+
+    def remap(self):
+        with open(self.path, 'r+b') as handle:
+            self.map = mmap.mmap(handle.fileno(), self.size)
+            self.inode = os.fstat(handle.fileno()).st_ino
+        self.checked_at = time.monotonic()
+
+    def reload_if_replaced(self):
+        now = time.monotonic()
+        if now - self.checked_at < RELOAD_INTERVAL:
+            return
+        self.checked_at = now
+        try:
+            if os.stat(self.path).st_ino != self.inode:
+                self.remap()
+        except OSError:
+            # Keep answering from the current map until the file is back
+            pass
+
+    def locked(self):
+        return FileLock(self.lock_path)
+
+
+def to_microseconds(moment):
+    return int(moment.timestamp() * 1_000_000)
+
+
+def from_microseconds(microseconds):
+    return datetime.fromtimestamp(microseconds / 1_000_000, timezone.utc)
+
+
+class FileLock:
+    # Exclusive flock on a separate file, so it survives the data file being replaced
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.handle = open(self.path, 'a')
+        fcntl.flock(self.handle, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+
+_filter = None
+_filter_lock = threading.Lock()
+_catch_up_lock = threading.Lock()
+
+
+def loaded_reported_numbers():
+    # The filter if this process already opened it and needs no catch up,
+    # never touches the database. None sends async callers to reported_numbers()
+    if _filter is None or _filter.catch_up_due():
+        return None
+    return _filter
+
+
+def reported_numbers():
+    # Opened at worker startup or else on the first lookup, None when SPAM_BLOOM_PATH is unset
+    global _filter
+    if _filter is None and settings.SPAM_BLOOM_PATH:
+        with _filter_lock:
+            if _filter is None:
+                bloom = SharedBloomFilter(
+                    settings.SPAM_BLOOM_PATH, settings.SPAM_BLOOM_CAPACITY, settings.SPAM_BLOOM_ERROR_RATE
+                )
+                bloom.open()
+                bloom.catch_up()
+                _filter = bloom
+    elif _filter is not None and _filter.catch_up_due() and _catch_up_lock.acquire(blocking=False):
+        # One thread catches up, the others keep answering from the filter
+        try:
+            _filter.catch_up()
+        except DatabaseError:
+            logger.warning("Catching up the reported numbers filter failed", exc_info=True)
+        finally:
+            _catch_up_lock.release()
+    return _filter
+
+
+def open_at_startup():
+    # Opens the filter before the worker serves requests, so no lookup waits
+    # for the build or the catch up. When the database or the file is not
+    # ready yet (e.g. before migrate) the first lookup opens it instead
+    try:
+        reported_numbers()
+    except (DatabaseError, OSError):
+        logger.warning("Opening the reported numbers filter failed, it is opened on first use", exc_info=True)
+
+
+def reset():
+    global _filter
+    _filter = None
+
+
+def might_be_reported(phone_keys, bloom=None):
+    # The keys that may have been reported, all of them without a filter
+    bloom = bloom or reported_numbers()
+    if bloom is None:
+        return list(phone_keys)
+    return [key for key in phone_keys if key in bloom]
+
+
+def add_reported(phone_keys):
+    bloom = reported_numbers()
+    if bloom is not None:
+        bloom.add(phone_keys)
@@ -0,0 +1,124 @@
+import asyncio
+import weakref
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis.cache import RedisCache
+from redis import asyncio as aioredis
+
+
+##############################################################################
+# django-redis cache with native async methods
+# Django's default async cache methods run the blocking client in a thread.
+# This backend answers aget/aset/... from a redis.asyncio client on the same
+# server, with the same key format and serializer as django-redis, so the sync
+# and async views share cached entries, tag versions and throttle state.
+##############################################################################
+
+# Same check as django-redis: only existing keys can be incremented
+INCR_EXISTING = """
+local exists = redis.call('EXISTS', KEYS[1])
+if (exists == 1) then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+else return false end
+"""
+
+# Generic cell rate algorithm (GCRA) of users/throttling.py. The key holds the
+# theoretical arrival time (TAT) of the next request on the server clock. A
+# request is allowed when it is no more than 'tolerance' seconds early, and
+# then moves the TAT one emission interval further. Returns the seconds to
+# wait as a string, Lua would truncate a number to an integer
+GCRA = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1])) or now, now)
+local wait = tat - tolerance - now
+if wait > 0 then return tostring(wait) end
+tat = tat + interval
+redis.call('SET', KEYS[1], string.format('%.6f', tat), 'PX', math.ceil((tat - now) * 1000))
+return '0'
+"""
+
+
+class AsyncRedisCache(RedisCache):
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        # redis.asyncio connections are bound to the event loop that opened them
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._gcra = None
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            location = self._server.split(',')[0] if isinstance(self._server, str) else self._server[0]
+            client = aioredis.Redis.from_url(location)
+            self._async_clients[loop] = client
+        return client
+
+    def _key(self, key, version):
+        return self.client.make_key(key, version=version)
+
+    def _timeout_ms(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else int(timeout * 1000)
+
+    async def aget(self, key, default=None, version=None):
+        value = await self._async_client().get(self._key(key, version))
+        return default if value is None else self.client.decode(value)
+
+    async def aget_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = await self._async_client().mget([self._key(key, version) for key in keys])
+        return {key: self.client.decode(value) for key, value in zip(keys, values) if value is not None}
+
+    async def aset(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, nx=False):
+        client = self._async_client()
+        timeout = self._timeout_ms(timeout)
+        if timeout is not None and timeout <= 0:
+            # Same semantics as django-redis for non positive timeouts
+            if nx:
+                return not await client.exists(self._key(key, version))
+            return bool(await client.delete(self._key(key, version)))
+        return bool(await client.set(self._key(key, version), self.client.encode(value), nx=nx, px=timeout))
+
+    async def aadd(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return await self.aset(key, value, timeout, version=version, nx=True)
+
+    async def aset_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout_ms(timeout)
+        if timeout is not None and timeout <= 0:
+            await self.adelete_many(data, version=version)
+            return []
+        async with self._async_client().pipeline() as pipeline:
+            for key, value in data.items():
+                pipeline.set(self._key(key, version), self.client.encode(value), px=timeout)
+            await pipeline.execute()
+        return []
+
+    async def aincr(self, key, delta=1, version=None):
+        value = await self._async_client().eval(INCR_EXISTING, 1, self._key(key, version), delta)
+        if value is None:
+            raise ValueError(f"Key '{key}' not found")
+        return value
+
+    async def adelete(self, key, version=None):
+        return bool(await self._async_client().delete(self._key(key, version)))
+
+    async def adelete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            await self._async_client().delete(*keys)
+
+    def gcra(self, key, interval, tolerance, version=None):
+        # One EVALSHA per request, the script is only sent when Redis lacks it
+        if self._gcra is None:
+            self._gcra = self.client.get_client(write=True).register_script(GCRA)
+        return float(self._gcra(keys=[self._key(key, version)], args=[interval, tolerance]))
+
+    async def agcra(self, key, interval, tolerance, version=None):
+        script = self._async_client().register_script(GCRA)
+        return float(await script(keys=[self._key(key, version)], args=[interval, tolerance]))
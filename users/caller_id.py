@@ -0,0 +1,75 @@
+from django.db import transaction
+from users.models import CallerIdSummary, ContactNameVote, CustomUser, PhoneSpamStats
+from users.phone import key_to_phone_number
+
+
+##############################################################################
+# Maintenance of the caller-ID summaries (CallerIdSummary)
+# "Who is calling and is it spam?" is answered from one precomputed row per
+# number: the registered username, the contact_name most people saved the
+# number under (the top ContactNameVote) and the spam score. Every write that
+# can change one of them refreshes the rows of the numbers it touched
+##############################################################################
+
+SUMMARY_FIELDS = ['phone_number', 'username', 'top_contact_name', 'contact_count', 'epoch_score']
+BATCH_SIZE = 2000
+
+
+def top_contact_names(rows):
+    # {phone_key: (most saved name, total saves)} from (phone_key, name, saves)
+    # rows with the most saved name of each number first
+    names = {}
+    for key, name, saves in rows:
+        top_name, total = names.get(key, (name, 0))
+        names[key] = (top_name, total + saves)
+    return names
+
+
+def summaries(phone_keys, usernames, contact_names, spam_scores):
+    # Rows of the numbers that have anything to show
+    rows = []
+    for key in phone_keys:
+        top_name, saves = contact_names.get(key, (None, 0))
+        username, score = usernames.get(key), spam_scores.get(key, 0.0)
+        if username is None and top_name is None and not score:
+            continue
+        rows.append(CallerIdSummary(
+            phone_key=key, phone_number=key_to_phone_number(key), username=username,
+            top_contact_name=top_name, contact_count=saves, epoch_score=score,
+        ))
+    return rows
+
+
+def refresh(phone_keys):
+    phone_keys = sorted({key for key in phone_keys if key is not None})
+    for start in range(0, len(phone_keys), BATCH_SIZE):
+        batch = phone_keys[start:start + BATCH_SIZE]
+        usernames = dict(CustomUser.objects.filter(phone_key__in=batch).values_list('phone_key', 'username'))
+        contact_names = top_contact_names(ContactNameVote.ranked(batch).values_list('phone_key', 'name', 'votes'))
+        rows = summaries(batch, usernames, contact_names, PhoneSpamStats.epoch_scores_for(batch))
+        CallerIdSummary.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['phone_key'], update_fields=SUMMARY_FIELDS,
+        )
+        # Numbers whose user, contacts and reports are all gone
+        CallerIdSummary.objects.filter(phone_key__in=batch).exclude(
+            phone_key__in=[row.phone_key for row in rows]
+        ).delete()
+
+
+def refresh_user(user):
+    # The previous number of a user who changed it still carries their username
+    refresh({user.phone_key, *CallerIdSummary.objects.filter(username=user.username).values_list('phone_key', flat=True)})
+
+
+def rebuild():
+    usernames = dict(CustomUser.objects.filter(phone_key__isnull=False).values_list('phone_key', 'username').iterator())
+    contact_names = top_contact_names(
+        ContactNameVote.objects.order_by('phone_key', '-votes', 'name_key').values_list('phone_key', 'name', 'votes').iterator()
+    )
+    spam_scores = dict(PhoneSpamStats.objects.filter(epoch_score__gt=0).values_list('phone_key', 'epoch_score').iterator())
+    with transaction.atomic():
+        CallerIdSummary.objects.all().delete()
+        CallerIdSummary.objects.bulk_create(
+            summaries(usernames.keys() | contact_names.keys() | spam_scores.keys(), usernames, contact_names, spam_scores),
+            batch_size=BATCH_SIZE,
+        )
@@ -0,0 +1,234 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from users import bloom, caller_id, scoring, search_cache, search_index
+from users.models import CallerIdSummary, ContactNameVote, PhoneSpamStats, RegisteredUserContact, SpamGraphChange
+from users.phone import key_to_phone_number
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+
+##############################################################################
+# Spam propagation over the contact graph
+# Phone books link numbers: two numbers saved by the same people are likely
+# of the same kind, and a number many people saved as "Spam" is spam even if
+# nobody reported it. Label spreading on the users x numbers matrix B of
+# saved contacts solves
+#   f = alpha * S f + (1 - alpha) * y,  S = Dn^-1/2 B' Du^-1 B Dn^-1/2
+# where y seeds every number with the larger of its report likelihood and
+# the share of its saves under a spam-like name (its negative labels, see
+# users/lexicon.py), Du are the phone book sizes and Dn the save counts. S
+# is never built, every iteration is two sparse products with B, so hot
+# numbers in thousands of phone books cost one entry per save.
+#
+# What the graph adds beyond the reports is stored in epoch units as
+# PhoneSpamStats.graph_epoch_score and included in epoch_score, so every
+# search, caller-ID and bulk path reads it like a report made at the time
+# of the run, and it decays like one until the next run.
+#
+# Runs are incremental: the writes of reports and contacts mark their
+# numbers in SpamGraphChange, and a run only rescores those numbers and the
+# numbers saved in the same phone books (--hops), with every other number
+# kept at its stored score. Run propagate_spam_scores --full from time to
+# time to carry changes further than --hops and to renormalize phone books
+# that lost contacts.
+##############################################################################
+
+BATCH_SIZE = 2000
+
+
+def batches(keys, size=BATCH_SIZE):
+    keys = list(keys)
+    for start in range(0, len(keys), size):
+        yield keys[start:start + size]
+
+
+def name_seeds(phone_keys=None):
+    # {phone_key: share of saves under a spam-like name}, smoothed with
+    # SPAM_GRAPH_NAME_PRIOR pseudo-saves, numbers without such names are left out
+    labels = {}
+    for batch in [None] if phone_keys is None else batches(phone_keys):
+        stats = PhoneSpamStats.objects.filter(negative_labels__gt=0)
+        stats = stats if batch is None else stats.filter(phone_key__in=batch)
+        labels.update(stats.values_list('phone_key', 'negative_labels').iterator())
+    prior = settings.SPAM_GRAPH_NAME_PRIOR
+    saves = save_counts(labels)
+    return {key: negative_labels / (saves.get(key, 0) + prior) for key, negative_labels in labels.items()}
+
+
+def save_counts(phone_keys):
+    # Number of contacts saving each number, the sum of its name votes
+    counts = {}
+    for batch in batches(phone_keys):
+        counts.update(
+            ContactNameVote.objects.filter(phone_key__in=batch).values('phone_key')
+            .annotate(saves=Sum('votes')).values_list('phone_key', 'saves').order_by()
+        )
+    return counts
+
+
+def stored_scores(phone_keys=None):
+    # {phone_key: (report likelihood, graph_score, graph_epoch_score)}
+    rows = []
+    for batch in [None] if phone_keys is None else batches(phone_keys):
+        stats = PhoneSpamStats.objects.all() if batch is None else PhoneSpamStats.objects.filter(phone_key__in=batch)
+        rows += stats.values_list('phone_key', 'epoch_score', 'graph_score', 'graph_epoch_score')
+    report_likelihoods = scoring.likelihoods([epoch_score - graph_epoch_score for _, epoch_score, _, graph_epoch_score in rows])
+    return {
+        key: (report_likelihood, graph_score, graph_epoch_score)
+        for (key, _, graph_score, graph_epoch_score), report_likelihood in zip(rows, report_likelihoods)
+    }
+
+
+def savers(phone_keys):
+    users = set()
+    for batch in batches(phone_keys):
+        users.update(RegisteredUserContact.objects.filter(phone_key__in=batch).values_list('contact_of_id', flat=True))
+    return users
+
+
+def neighbourhood(phone_keys, hops):
+    # The numbers and everything saved in the same phone books, 'hops' times over
+    region = frontier = set(phone_keys)
+    for _ in range(hops):
+        found = set()
+        for batch in batches(savers(frontier)):
+            found.update(
+                RegisteredUserContact.objects.filter(contact_of_id__in=batch, phone_key__isnull=False)
+                .values_list('phone_key', flat=True)
+            )
+        frontier = found - region
+        region = region | frontier
+    return region
+
+
+def load_graph(users=None):
+    # The saved contacts of these users, or of everybody, as a users x numbers
+    # matrix. Returns the sorted phone keys of its columns and the matrix
+    contacts = RegisteredUserContact.objects.filter(phone_key__isnull=False)
+    user_ids, phone_keys = [], []
+    for batch in [None] if users is None else batches(users):
+        rows = contacts if batch is None else contacts.filter(contact_of_id__in=batch)
+        for user_id, key in rows.values_list('contact_of_id', 'phone_key').iterator(chunk_size=10000):
+            user_ids.append(user_id)
+            phone_keys.append(key)
+    _, user_index = np.unique(np.array(user_ids, dtype=np.int64), return_inverse=True)
+    numbers, number_index = np.unique(np.array(phone_keys, dtype=np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(phone_keys)), (user_index, number_index)),
+        shape=(int(user_index.max(initial=-1)) + 1, len(numbers)),
+    )
+    return numbers, matrix
+
+
+def spread(matrix, number_degrees, seeds, scores, region):
+    # Iterates the numbers in the 'region' mask to a fixed point, the others
+    # keep their scores. Returns the scores and the number of iterations
+    alpha = settings.SPAM_GRAPH_ALPHA
+    user_degrees = np.asarray(matrix.sum(axis=1)).ravel()
+    inverse_users = np.divide(1.0, user_degrees, out=np.zeros_like(user_degrees), where=user_degrees > 0)
+    inverse_numbers = np.divide(1.0, np.sqrt(number_degrees), out=np.zeros_like(number_degrees), where=number_degrees > 0)
+    transposed = matrix.T.tocsr()
+    scores = scores.copy()
+    iteration = 0
+    while iteration < settings.SPAM_GRAPH_MAX_ITERATIONS:
+        iteration += 1
+        neighbours = inverse_numbers * (transposed @ (inverse_users * (matrix @ (inverse_numbers * scores))))
+        updated = alpha * neighbours[region] + (1 - alpha) * seeds[region]
+        change = np.abs(updated - scores[region]).max(initial=0.0)
+        scores[region] = updated
+        if change < settings.SPAM_GRAPH_TOLERANCE:
+            break
+    return scores, iteration
+
+
+def propagate(full=False, hops=1):
+    # Rescores the numbers marked in SpamGraphChange and their neighbourhood,
+    # or every number. Returns (numbers rescored, numbers written, iterations)
+    changes = list(SpamGraphChange.objects.values_list('id', 'phone_key'))
+    if not full:
+        rescored = neighbourhood({key for _, key in changes}, hops)
+        # Hot numbers reach most of the graph, a full run is faster then
+        full = len(rescored) > CallerIdSummary.objects.count() // 2
+    if full:
+        numbers, matrix = load_graph()
+        number_degrees = np.asarray(matrix.sum(axis=0)).ravel()
+        region = np.ones(len(numbers), dtype=bool)
+        stored = stored_scores()
+        # Numbers nobody saves any more lose their graph score
+        rescored = set(stored) | set(numbers.tolist())
+    else:
+        numbers, matrix = load_graph(savers(rescored))
+        region = np.isin(numbers, np.array(sorted(rescored), dtype=np.int64))
+        stored = stored_scores(rescored)
+        # Every saver of a rescored number is loaded, so its column sum is its
+        # save count. The other numbers only count through their stored
+        # scores, the few that have one get their save count looked up
+        number_degrees = np.asarray(matrix.sum(axis=0)).ravel()
+        scored = dict(PhoneSpamStats.objects.filter(graph_score__gt=0).values_list('phone_key', 'graph_score').iterator())
+        boundary = np.flatnonzero(np.isin(numbers, np.array(sorted(scored.keys() - rescored), dtype=np.int64)))
+        boundary_keys = numbers[boundary].tolist()
+        stored.update((key, (0.0, scored[key], 0.0)) for key in boundary_keys)
+        saves = save_counts(boundary_keys)
+        number_degrees[boundary] = [saves.get(key, 0) for key in boundary_keys]
+
+    names = name_seeds(None if full else rescored)
+    number_keys = numbers.tolist()
+    seeds = np.array([max(stored.get(key, (0.0,))[0], names.get(key, 0.0)) for key in number_keys])
+    scores = np.array([stored.get(key, (0.0, 0.0))[1] for key in number_keys])
+    scores, iterations = spread(matrix, number_degrees, seeds, scores, region)
+
+    # Rescored numbers outside the graph have no neighbours to learn from
+    graph_scores = dict.fromkeys(rescored, 0.0)
+    graph_scores.update((key, float(score)) for key, score, in_region in zip(number_keys, scores, region) if in_region)
+    written = write(graph_scores, names, stored)
+    for batch in batches([change_id for change_id, _ in changes]):
+        SpamGraphChange.objects.filter(id__in=batch).delete()
+    return len(rescored), written, iterations
+
+
+def write(graph_scores, names, stored):
+    minimum, tolerance = settings.SPAM_GRAPH_MIN_SCORE, settings.SPAM_GRAPH_TOLERANCE
+    # Likelihood to epoch units at this instant, see scoring.likelihoods()
+    to_epoch = settings.SPAM_SCORE_SATURATION * 2 ** scoring.half_lives_since_epoch(timezone.now())
+    updates = {}
+    for key, score in graph_scores.items():
+        report_likelihood, old_score, old_epoch_score = stored.get(key, (0.0, 0.0, 0.0))
+        score = score if score >= minimum else 0.0
+        added = max(score, names.get(key, 0.0)) - report_likelihood
+        added = added if added >= minimum else 0.0
+        if abs(score - old_score) > tolerance or abs(added - old_epoch_score / to_epoch) > tolerance:
+            updates[key] = (score, added * to_epoch)
+
+    for batch in batches(updates):
+        now = timezone.now()
+        with transaction.atomic():
+            # Locked like record_report(), a concurrent report is not lost
+            current = dict(
+                (key, (epoch_score, graph_epoch_score)) for key, epoch_score, graph_epoch_score in
+                PhoneSpamStats.objects.select_for_update().filter(phone_key__in=batch)
+                .values_list('phone_key', 'epoch_score', 'graph_epoch_score')
+            )
+            rows = []
+            for key in batch:
+                score, graph_epoch_score = updates[key]
+                epoch_score, old_graph_epoch_score = current.get(key, (0.0, 0.0))
+                rows.append(PhoneSpamStats(
+                    phone_key=key, phone_number=key_to_phone_number(key), graph_score=score,
+                    graph_epoch_score=graph_epoch_score,
+                    epoch_score=max(0.0, epoch_score - old_graph_epoch_score + graph_epoch_score), scored_at=now,
+                ))
+            PhoneSpamStats.objects.bulk_create(
+                rows, update_conflicts=True, unique_fields=['phone_key'],
+                update_fields=['graph_score', 'graph_epoch_score', 'epoch_score', 'scored_at'],
+            )
+            search_index.update_spam_scores(batch)
+            caller_id.refresh(batch)
+            bloom.add_reported([key for key in batch if updates[key][1] > 0])
+        search_cache.invalidate([search_cache.phone_tag(key) for key in batch])
+    return len(updates)
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+##############################################################################
+# Password hashers with costs tunable from the settings
+# Same algorithms and encodings as Django's hashers, so existing hashes keep
+# verifying. When the preferred hasher or its cost changes, a password is
+# rehashed on the user's next successful login (Django's must_update).
+# Argon2 needs argon2-cffi and bcrypt needs bcrypt, see PASSWORD_HASHER.
+##############################################################################
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS or super().iterations
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST or super().time_cost
+
+    @property
+    def memory_cost(self):
+        # In KiB
+        return settings.PASSWORD_ARGON2_MEMORY_COST or super().memory_cost
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM or super().parallelism
+
+
+class BCryptSHA256PasswordHasher(hashers.BCryptSHA256PasswordHasher):
+    @property
+    def rounds(self):
+        return settings.PASSWORD_BCRYPT_ROUNDS or super().rounds
+
+
+##############################################################################
+# Hashing off the event loop
+# A hash takes tens to hundreds of milliseconds of CPU. The async views run
+# it in a pool of PASSWORD_HASHING_THREADS threads: the hash functions of
+# hashlib, argon2-cffi and bcrypt release the GIL, so the loop keeps serving
+# other requests and at most that many hashes run at once per worker.
+##############################################################################
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def hashing_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_THREADS, thread_name_prefix='password-hashing'
+                )
+    return _pool
+
+
+async def run_in_pool(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(hashing_pool(), function, *args)
+
+
+async def acheck_password(user, raw_password):
+    # AbstractBaseUser.check_password() with the hashing in the pool
+    is_correct, must_update = await run_in_pool(hashers.verify_password, raw_password, user.password)
+    if is_correct and must_update:
+        user.password = await run_in_pool(hashers.make_password, raw_password)
+        await user.asave(update_fields=['password'])
+    return is_correct
+
+
+async def aharden_runtime(raw_password):
+    # Unknown usernames cost one hash as well, so they cannot be told apart by timing
+    await run_in_pool(hashers.make_password, raw_password)
@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+
+##############################################################################
+# Per-request instrumentation of the API
+# With API_INSTRUMENTATION enabled every request records its query count, DB
+# time, search cache hits and misses and serializer time. They are returned
+# in a Server-Timing header, aggregated into Prometheus histograms served by
+# metrics_view (users/internal/metrics/), and requests slower than API_SLOW_REQUEST_MS are logged with
+# their SQL. The metrics of a request live in a context variable, so they
+# follow the request into sync_to_async threads of the async views.
+# Disabled, the middleware removes itself (MiddlewareNotUsed) and the hooks
+# in the views, serializers and search cache cost one context variable read.
+# Histograms are kept per process, scrape every worker or run one per host.
+##############################################################################
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# SQL statements kept per request for the slow request log
+MAX_LOGGED_QUERIES = 50
+
+current = ContextVar('api_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.sql = []
+
+    def server_timing(self, total):
+        return ", ".join([
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f'serializer;dur={self.serializer_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+
+def record_query(execute, sql, params, many, context):
+    # Execute wrapper installed on every connection while instrumentation is on
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.queries += 1
+        metrics.db_time += elapsed
+        if len(metrics.sql) < MAX_LOGGED_QUERIES:
+            metrics.sql.append((elapsed, sql))
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_cache(result):
+    # Called by users/search_cache.py for every event, stale entries are misses
+    metrics = current.get()
+    if metrics is not None:
+        if result == 'hit':
+            metrics.cache_hits += 1
+        elif result in ('miss', 'stale'):
+            metrics.cache_misses += 1
+
+
+class measure_serializer(ContextDecorator):
+    # Times serialization, nested serializers are only counted once
+    def _recreate_cm(self):
+        # A fresh timer per decorated call, calls can run in parallel threads
+        return type(self)()
+
+    def __enter__(self):
+        self.metrics = current.get()
+        if self.metrics is not None:
+            self.metrics.serializer_depth += 1
+            if self.metrics.serializer_depth == 1:
+                self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            self.metrics.serializer_depth -= 1
+            if self.metrics.serializer_depth == 0:
+                self.metrics.serializer_time += time.perf_counter() - self.started
+        return False
+
+
+class MeasuredSerializerMixin:
+    # Counts validation and representation of a DRF serializer as serializer
+    # time, also when it is the child of a many=True list serializer
+    def run_validation(self, *args, **kwargs):
+        with measure_serializer():
+            return super().run_validation(*args, **kwargs)
+
+    def to_representation(self, *args, **kwargs):
+        with measure_serializer():
+            return super().to_representation(*args, **kwargs)
+
+
+##############################################################################
+# Prometheus histograms and counters aggregated over requests
+##############################################################################
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name, self.help_text, self.buckets = name, help_text, buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts, total = self.series.get(labels, (None, 0.0))
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+        counts[-1] += 1
+        self.series[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.series.items()):
+            label_text = format_labels(labels)
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {counts[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name, self.help_text = name, help_text
+        self.series = {}
+
+    def inc(self, labels, amount):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{{{format_labels(labels)}}} {value}" for labels, value in sorted(self.series.items()))
+        return lines
+
+
+def format_labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+_lock = threading.Lock()
+REQUEST_DURATION = Histogram('api_request_duration_seconds', "Time to answer a request.", DURATION_BUCKETS)
+REQUEST_QUERIES = Histogram('api_request_db_queries', "Database queries per request.", QUERY_BUCKETS)
+REQUEST_DB_DURATION = Histogram('api_request_db_duration_seconds', "Time spent in database queries per request.", DURATION_BUCKETS)
+REQUEST_SERIALIZER_DURATION = Histogram(
+    'api_request_serializer_duration_seconds', "Time spent in serializers per request.", DURATION_BUCKETS
+)
+CACHE_LOOKUPS = Counter('api_search_cache_lookups_total', "Search cache lookups by result.")
+METRICS = (REQUEST_DURATION, REQUEST_QUERIES, REQUEST_DB_DURATION, REQUEST_SERIALIZER_DURATION, CACHE_LOOKUPS)
+
+
+def observe(request, response, metrics, total):
+    match = getattr(request, 'resolver_match', None)
+    endpoint = (('endpoint', match.url_name if match and match.url_name else 'unmatched'),)
+    with _lock:
+        REQUEST_DURATION.observe(endpoint + (('method', request.method), ('status', response.status_code)), total)
+        REQUEST_QUERIES.observe(endpoint, metrics.queries)
+        REQUEST_DB_DURATION.observe(endpoint, metrics.db_time)
+        REQUEST_SERIALIZER_DURATION.observe(endpoint, metrics.serializer_time)
+        CACHE_LOOKUPS.inc(endpoint + (('result', 'hit'),), metrics.cache_hits)
+        CACHE_LOOKUPS.inc(endpoint + (('result', 'miss'),), metrics.cache_misses)
+
+
+def metrics_view(request):
+    # Internal endpoint, only answered for the addresses in INTERNAL_IPS
+    if not settings.API_INSTRUMENTATION or request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise PermissionDenied
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return HttpResponse("\n".join(lines) + "\n", content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+##############################################################################
+# Middleware, placed first so its timing covers the other middleware
+##############################################################################
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.API_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total = time.perf_counter() - metrics.started
+        response['Server-Timing'] = metrics.server_timing(total)
+        observe(request, response, metrics, total)
+        if total * 1000 >= settings.API_SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request %s %s: %.1f ms, %d queries in %.1f ms\n%s",
+                request.method, request.get_full_path(), total * 1000, metrics.queries, metrics.db_time * 1000,
+                "\n".join(f"  {elapsed * 1000:.1f} ms  {sql}" for elapsed, sql in metrics.sql),
+            )
+        return response
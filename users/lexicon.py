@@ -0,0 +1,98 @@
+import unicodedata
+from functools import lru_cache
+from django.conf import settings
+
+
+##############################################################################
+# Spam keyword lexicon for contact names
+# People save spam numbers as "Loan spam", "Don't pick" or "फ्रॉड". The terms
+# of SPAM_NAME_LEXICON are compiled once into an Aho-Corasick automaton, so
+# a name is classified in one pass over its characters however many terms
+# and languages the lexicon has. Terms match whole words of the casefolded,
+# whitespace-collapsed name (ContactNameVote.name_key_for), "fake" flags
+# "Fake bank" but not "Fakeeha". Every contact saved under a matching name
+# is a negative label of its number, counted in PhoneSpamStats.negative_labels
+##############################################################################
+
+def normalize(text):
+    # Casefolded with whitespace collapsed, the ContactNameVote.name_key of a name
+    return ' '.join(text.split()).casefold()
+
+
+def is_word_char(char):
+    # Letters, digits and the combining vowel signs of Indic scripts
+    return char.isalnum() or unicodedata.category(char).startswith('M')
+
+
+class Automaton:
+    def __init__(self, terms):
+        # State 0 is the root, transitions[state] maps a character to the next
+        # state and outputs[state] holds the lengths of the terms ending there
+        self.transitions, self.outputs = [{}], [()]
+        for term in {normalize(term) for term in terms} - {''}:
+            state = 0
+            for char in term:
+                if char not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.outputs.append(())
+                    self.transitions[state][char] = len(self.transitions) - 1
+                state = self.transitions[state][char]
+            self.outputs[state] += (len(term),)
+
+        # Failure links in breadth first order, a state falls back to the
+        # longest proper suffix of its path that is also in the trie
+        self.fail = [0] * len(self.transitions)
+        queue = list(self.transitions[0].values())
+        for state in queue:
+            for char, target in self.transitions[state].items():
+                queue.append(target)
+                fallback = self.fail[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[target] = self.transitions[fallback].get(char, 0)
+                self.outputs[target] += self.outputs[self.fail[target]]
+
+    def is_negative(self, name_key):
+        # Whether a whole word term occurs in a normalized name
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        state = 0
+        for end, char in enumerate(name_key, 1):
+            while state and char not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(char, 0)
+            for length in outputs[state]:
+                start = end - length
+                if (start == 0 or not is_word_char(name_key[start - 1])) and \
+                        (end == len(name_key) or not is_word_char(name_key[end])):
+                    return True
+        return False
+
+
+@lru_cache(maxsize=8)
+def compile_lexicon(terms):
+    return Automaton(terms)
+
+
+def automaton():
+    # Compiled on first use per worker and again only if the lexicon changes
+    return compile_lexicon(tuple(settings.SPAM_NAME_LEXICON))
+
+
+def is_negative(contact_name):
+    return automaton().is_negative(normalize(contact_name))
+
+
+def negative_label_counts(votes):
+    # {phone_key: votes under spam-like names} of (phone_key, name_key, votes)
+    # rows, numbers without such names are left out
+    lexicon = automaton()
+    verdicts = {}
+    counts = {}
+    for key, name_key, count in votes:
+        negative = verdicts.get(name_key)
+        if negative is None:
+            # The same few names ("Spam", "Fraud") recur across thousands of numbers
+            negative = verdicts[name_key] = lexicon.is_negative(name_key)
+        if negative and key is not None:
+            counts[key] = counts.get(key, 0) + count
+    return {key: count for key, count in counts.items() if count}
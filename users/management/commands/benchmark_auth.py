@@ -0,0 +1,63 @@
+import random
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from users import authentication
+from users.authentication import CachedTokenAuthentication
+from users.benchmarks import summarize, timed
+from users.models import CustomUser
+
+
+##########################################################################
+# Benchmarks the authentication overhead per request
+# Compares DRF's TokenAuthentication (one query per request) with the
+# cached authentication served from the worker LRU and from the shared
+# cache alone, as another worker would see it on its first request
+##########################################################################
+class Command(BaseCommand):
+    help = "Report p50/p99 token authentication time and queries per request, uncached and cached."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help="Authenticated requests per mode.")
+        parser.add_argument('--tokens', type=int, default=100, help="Distinct users sending requests.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        users = list(CustomUser.objects.filter(is_active=True)[:options['tokens']])
+        if not users:
+            raise CommandError("No users to authenticate, run it on a populated database.")
+        keys = [Token.objects.get_or_create(user=user)[0].key for user in users]
+
+        rng = random.Random(options['seed'])
+        factory = APIRequestFactory()
+        requests = [
+            Request(factory.get('/', HTTP_AUTHORIZATION=f'Token {rng.choice(keys)}'))
+            for _ in range(options['requests'])
+        ]
+
+        authentication.tokens.invalidate(keys)
+        modes = [
+            ("TokenAuthentication", TokenAuthentication(), None),
+            ("cached, worker LRU", CachedTokenAuthentication(), None),
+            ("cached, shared cache only", CachedTokenAuthentication(), authentication.tokens.clear_local),
+        ]
+        for label, authenticator, before_each in modes:
+            # Warm up the connection, and the caches of the cached modes
+            for request in requests[:len(keys) * 5]:
+                authenticator.authenticate(request)
+
+            def authenticate(request):
+                if before_each is not None:
+                    before_each()
+                authenticator.authenticate(request)
+
+            with CaptureQueriesContext(connection) as queries:
+                stats = summarize([timed(authenticate, request) for request in requests])
+            self.stdout.write(
+                f"{label}: p50 {stats['p50_ms']} ms, p99 {stats['p99_ms']} ms, mean {stats['mean_ms']} ms, "
+                f"{len(queries) / len(requests):.2f} queries/request"
+            )
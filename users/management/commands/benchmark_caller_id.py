@@ -0,0 +1,63 @@
+import random
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory, force_authenticate
+from users.benchmarks import summarize, timed
+from users.models import CallerIdSummary, CustomUser
+from users.views import CallerIdView, SearchUserByPhoneNumberView
+
+
+##########################################################################
+# Benchmarks the caller-ID endpoint against the phone number search
+# Requests go straight to the views, so the numbers are server time without
+# the network. Throttling is disabled and authentication is forced, the
+# phone search runs with the configured cache like it does when served
+##########################################################################
+class Command(BaseCommand):
+    help = "Report p50/p99 latency of single and batch caller-ID lookups."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type=int, default=2000, help="Number of single number lookups.")
+        parser.add_argument('--batch-size', type=int, default=50, help="Numbers per batch lookup.")
+        parser.add_argument('--unknown', type=float, default=0.5, help="Share of lookups for unknown numbers.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        viewer = CustomUser.objects.first()
+        known = list(CallerIdSummary.objects.values_list('phone_number', flat=True)[:10000])
+        if viewer is None or not known:
+            raise CommandError("No users or caller-ID summaries, run rebuild_caller_id on a populated database.")
+
+        rng = random.Random(options['seed'])
+        numbers = [
+            f"+9199{rng.randrange(10 ** 8):08}" if rng.random() < options['unknown'] else rng.choice(known)
+            for _ in range(options['lookups'])
+        ]
+
+        factory = APIRequestFactory()
+        caller_id_view = CallerIdView.as_view(throttle_classes=[])
+        search_view = SearchUserByPhoneNumberView.as_view(throttle_classes=[])
+
+        def lookup(view, request):
+            force_authenticate(request, user=viewer)
+            view(request).render()
+
+        for label, view in (("search-phone", search_view), ("caller-id", caller_id_view)):
+            # Warm up the connection and the code paths
+            for number in numbers[:50]:
+                lookup(view, factory.get('/', {'phone_number': number}))
+            self.report(label, summarize([
+                timed(lookup, view, factory.get('/', {'phone_number': number})) for number in numbers
+            ]))
+
+        size = options['batch_size']
+        batches = [numbers[start:start + size] for start in range(0, len(numbers), size)]
+        self.report(f"caller-id batch of {size}", summarize([
+            timed(lookup, caller_id_view, factory.post('/', {'phone_numbers': batch}, format='json'))
+            for batch in batches
+        ]))
+
+    def report(self, label, stats):
+        self.stdout.write(
+            f"{label}: {stats['count']} requests, p50 {stats['p50_ms']} ms, "
+            f"p99 {stats['p99_ms']} ms, mean {stats['mean_ms']} ms"
+        )
@@ -0,0 +1,125 @@
+import json
+import random
+import threading
+import time
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from users.benchmarks import add_scratch_argument, call_wsgi, require_scratch_database, summarize
+from users.models import CustomUser
+
+
+##########################################################################
+# Concurrent writer/reader benchmark of the configured database profile
+# Writer threads report numbers as spam while reader threads identify and
+# search numbers, all through the WSGI handler in this process, so every
+# request opens or reuses its connection like under a threaded server.
+# Compare profiles by running it once per environment, e.g. the SQLite
+# defaults against the tuned profile on a copy of the database:
+#   DB_SQLITE_MMAP_SIZE=0 DB_SQLITE_TRANSACTION_MODE=DEFERRED DB_CONN_MAX_AGE=0 \\
+#   python manage.py benchmark_database --scratch
+#   DB_SQLITE_JOURNAL_MODE=WAL python manage.py benchmark_database --scratch
+# Needs a 'user' throttle rate high enough for the load, throttled requests
+# are reported separately. Reports and tokens are written, so it only runs
+# with --scratch and never on the checked in db.sqlite3.
+##########################################################################
+class Command(BaseCommand):
+    help = "Report throughput, tail latency and lock errors of concurrent spam reports and searches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help="Threads reporting numbers as spam.")
+        parser.add_argument('--readers', type=int, default=16, help="Threads searching numbers.")
+        parser.add_argument('--duration', type=float, default=15.0, help="Seconds to run.")
+        parser.add_argument('--host', default='localhost', help="Host header, must be in ALLOWED_HOSTS.")
+        parser.add_argument('--seed', type=int, help="Repeat the numbers of an earlier run, reports of a repeated run are rejected.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+        add_scratch_argument(parser)
+
+    def handle(self, *args, **options):
+        require_scratch_database(options)
+        threads = options['writers'] + options['readers']
+        users = list(CustomUser.objects.filter(is_active=True)[:threads])
+        if len(users) < threads:
+            raise CommandError(f"Needs {threads} users, one per thread.")
+        tokens = [Token.objects.get_or_create(user=user)[0].key for user in users]
+        numbers = list(CustomUser.objects.values_list('phone_number', flat=True)[:5000])
+
+        result = {"profile": self.profile()}
+        connection.close()
+
+        handler = WSGIHandler()
+        deadline = time.perf_counter() + options['duration']
+        roles = ['writer'] * options['writers'] + ['reader'] * options['readers']
+        stats = {role: {'latencies': [], 'throttled': 0, 'errors': 0, 'rejected': 0} for role in set(roles)}
+        workers = [
+            threading.Thread(target=self.run, args=(
+                handler, role, token, numbers, random.Random(None if options['seed'] is None else options['seed'] + i), deadline, options['host'], stats[role],
+            ))
+            for i, (role, token) in enumerate(zip(roles, tokens))
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        for role, role_stats in sorted(stats.items()):
+            summary = summarize(role_stats.pop('latencies'), elapsed)
+            summary.update(role_stats)
+            result[role] = summary
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+        self.stdout.write(f"profile: {result['profile']}")
+        for role in ('writer', 'reader'):
+            if role in result:
+                summary = result[role]
+                self.stdout.write(
+                    f"{role}s: {summary.get('throughput_per_s', 0.0)} req/s, p50 {summary['p50_ms']} ms, "
+                    f"p99 {summary['p99_ms']} ms, rejected {summary['rejected']}, "
+                    f"throttled {summary['throttled']}, errors {summary['errors']}"
+                )
+
+    def profile(self):
+        database = settings.DATABASES['default']
+        profile = {"vendor": connection.vendor, "conn_max_age": database.get('CONN_MAX_AGE', 0)}
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                for pragma in ('journal_mode', 'synchronous', 'mmap_size'):
+                    profile[pragma] = cursor.execute(f"PRAGMA {pragma}").fetchone()[0]
+        elif 'pool' in database.get('OPTIONS', {}):
+            profile["pool"] = database['OPTIONS']['pool']
+        return profile
+
+    def run(self, handler, role, token, numbers, rng, deadline, host, stats):
+        factory = RequestFactory(HTTP_HOST=host, HTTP_AUTHORIZATION=f"Token {token}")
+        while time.perf_counter() < deadline:
+            phone_number = rng.choice(numbers)
+            if role == 'writer':
+                # Mostly fresh numbers, some already reported by this user
+                phone_number = f"+9188{rng.randrange(10 ** 8):08}" if rng.random() < 0.9 else phone_number
+                request = factory.post(reverse('mark-spam'), {'phone_number': phone_number}, content_type='application/json')
+            elif rng.random() < 0.5:
+                request = factory.get(reverse('caller-id'), {'phone_number': phone_number})
+            else:
+                request = factory.get(reverse('search-user-by-phone'), {'phone_number': phone_number})
+
+            started = time.perf_counter()
+            status_code = call_wsgi(handler, request.environ)
+            elapsed = time.perf_counter() - started
+
+            if status_code == 429:
+                stats['throttled'] += 1
+            elif status_code >= 500:
+                # 'database is locked' and other server errors
+                stats['errors'] += 1
+            else:
+                if status_code == 400:
+                    stats['rejected'] += 1
+                stats['latencies'].append(elapsed)
@@ -0,0 +1,81 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from users.benchmarks import summarize, timed
+
+# Hasher configurations compared by default: PASSWORD_HASHER and cost settings
+CONFIGURATIONS = [
+    ('pbkdf2 (Django default)', 'pbkdf2', {}),
+    ('pbkdf2 260k iterations', 'pbkdf2', {'PASSWORD_PBKDF2_ITERATIONS': 260_000}),
+    ('argon2 (Django default)', 'argon2', {}),
+    ('argon2 t=1 m=19MiB p=1', 'argon2', {
+        'PASSWORD_ARGON2_TIME_COST': 1, 'PASSWORD_ARGON2_MEMORY_COST': 19_456, 'PASSWORD_ARGON2_PARALLELISM': 1,
+    }),
+    ('bcrypt (Django default)', 'bcrypt', {}),
+    ('bcrypt 10 rounds', 'bcrypt', {'PASSWORD_BCRYPT_ROUNDS': 10}),
+]
+HASHER_CLASSES = {
+    'pbkdf2': 'users.hashers.PBKDF2PasswordHasher',
+    'argon2': 'users.hashers.Argon2PasswordHasher',
+    'bcrypt': 'users.hashers.BCryptSHA256PasswordHasher',
+}
+
+
+##########################################################################
+# Benchmarks the password check of a login for each hasher configuration
+# Logins/sec per core is the rate of password verifications on one thread,
+# the cost of a login is dominated by it. With --threads the checks also run
+# in a thread pool like the async login view does, which shows how far they
+# scale on this machine. Hashers whose library is missing are skipped
+##########################################################################
+class Command(BaseCommand):
+    help = "Report password verifications (logins) per second and core for each hasher configuration."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=50, help="Password checks per configuration.")
+        parser.add_argument('--threads', type=int, default=0, help="Also run the checks in a pool of this many threads.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        results = []
+        for label, name, costs in CONFIGURATIONS:
+            with override_settings(PASSWORD_HASHERS=[HASHER_CLASSES[name]], **costs):
+                hasher = get_hasher()
+                try:
+                    encoded = hasher.encode('correct horse battery staple', hasher.salt())
+                except ValueError as error:
+                    # Raised by the hasher when its library is not installed
+                    self.stderr.write(f"{label}: skipped, {error}")
+                    continue
+                result = self.measure(hasher, encoded, options['checks'], options['threads'])
+            result['configuration'] = label
+            results.append(result)
+            if not options['json']:
+                line = (
+                    f"{label}: {result['logins_per_s_per_core']} logins/s per core, "
+                    f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms"
+                )
+                if options['threads']:
+                    line += f", {result['logins_per_s_pool']} logins/s with {options['threads']} threads"
+                self.stdout.write(line)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    def measure(self, hasher, encoded, checks, threads):
+        def check():
+            if not hasher.verify('correct horse battery staple', encoded):
+                raise AssertionError("Password verification failed.")
+
+        check()
+        stats = summarize([timed(check) for _ in range(checks)])
+        stats['logins_per_s_per_core'] = round(1000 / stats['mean_ms'], 1)
+        if threads:
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                started = time.perf_counter()
+                list(pool.map(lambda _: check(), range(checks)))
+                stats['logins_per_s_pool'] = round(checks / (time.perf_counter() - started), 1)
+        return stats
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlencode, urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from users.benchmarks import summarize
+from users.models import CustomUser
+
+# URL names of the sync view and its async variant per endpoint
+ENDPOINTS = {
+    'phone': ('search-user-by-phone', 'async-search-user-by-phone'),
+    'name': ('search-user-by-name', 'async-search-user-by-name'),
+}
+
+
+##########################################################################
+# Load test of the sync views under WSGI against the async views under ASGI
+# Start both servers on the same database and Redis first, for example
+#   gunicorn spam_detection.wsgi -w 4 -b 127.0.0.1:8000
+#   uvicorn spam_detection.asgi:application --workers 4 --port 8001
+# with a 'user' throttle rate high enough for the load, throttled responses
+# are reported separately and not counted as successful requests.
+##########################################################################
+class Command(BaseCommand):
+    help = "Report requests/sec and tail latency of the sync (WSGI) and async (ASGI) search views."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', default='http://127.0.0.1:8000', help="WSGI server serving the sync views.")
+        parser.add_argument('--async-url', default='http://127.0.0.1:8001', help="ASGI server serving the async views.")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200, 1000], help="Concurrent clients.")
+        parser.add_argument('--duration', type=float, default=15.0, help="Seconds per run.")
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='phone')
+        parser.add_argument('--username', help="User whose token is sent, defaults to the first user.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.filter(**({'username': options['username']} if options['username'] else {})).first()
+        if user is None:
+            raise CommandError("No user to authenticate the load test with.")
+        token, _ = Token.objects.get_or_create(user=user)
+
+        rng = random.Random(options['seed'])
+        if options['endpoint'] == 'phone':
+            numbers = list(CustomUser.objects.values_list('phone_number', flat=True)[:5000])
+            queries = [{'phone_number': rng.choice(numbers)} for _ in range(1000)]
+        else:
+            names = list(CustomUser.objects.values_list('username', flat=True)[:5000])
+            queries = [{'name': name[:rng.randint(3, 6)]} for name in rng.sample(names, min(1000, len(names)))]
+
+        sync_name, async_name = ENDPOINTS[options['endpoint']]
+        targets = [('sync', options['sync_url'], reverse(sync_name)), ('async', options['async_url'], reverse(async_name))]
+
+        results = []
+        for concurrency in options['concurrency']:
+            for mode, base_url, path in targets:
+                paths = [f"{path}?{urlencode(query)}" for query in queries]
+                result = asyncio.run(self.run(base_url, paths, token.key, concurrency, options['duration']))
+                result.update(mode=mode, concurrency=concurrency)
+                results.append(result)
+                if not options['json']:
+                    self.stdout.write(
+                        f"{mode:>5} c={concurrency:<5} {result.get('throughput_per_s', 0.0)} req/s, "
+                        f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+                        f"throttled {result['throttled']}, errors {result['errors']}"
+                    )
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+    async def run(self, base_url, paths, token, concurrency, duration):
+        url = urlsplit(base_url)
+        latencies = []
+        counts = {'throttled': 0, 'errors': 0}
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*[
+            self.client(url, paths[i % len(paths):] + paths[:i % len(paths)], token, deadline, latencies, counts)
+            for i in range(concurrency)
+        ])
+        result = summarize(latencies, time.perf_counter() - started)
+        result.update(counts)
+        return result
+
+    async def client(self, url, paths, token, deadline, latencies, counts):
+        # One keep-alive connection per client, reopened after errors
+        connection = None
+        index = 0
+        while time.perf_counter() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            try:
+                if connection is None:
+                    connection = await asyncio.open_connection(url.hostname, url.port or 80)
+                started = time.perf_counter()
+                status, keep_alive = await self.request(*connection, url.netloc, path, token)
+                elapsed = time.perf_counter() - started
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                counts['errors'] += 1
+                connection = self.close(connection)
+                await asyncio.sleep(0.01)
+                continue
+
+            if status == 429:
+                counts['throttled'] += 1
+            elif status >= 500:
+                counts['errors'] += 1
+            else:
+                latencies.append(elapsed)
+            if not keep_alive:
+                connection = self.close(connection)
+        self.close(connection)
+
+    async def request(self, reader, writer, host, path, token):
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAuthorization: Token {token}\r\n\r\n".encode()
+        )
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            while size := int((await reader.readline()).strip(), 16):
+                await reader.readexactly(size + 2)
+            await reader.readline()
+        else:
+            await reader.readexactly(int(headers.get('content-length', 0)))
+        return status, headers.get('connection') != 'close'
+
+    def close(self, connection):
+        if connection is not None:
+            connection[1].close()
+        return None
@@ -0,0 +1,108 @@
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from users.benchmarks import FIRST_NAMES, LAST_NAMES, add_scratch_argument, require_scratch_database, summarize, timed
+from users import search_index
+from users.models import CustomUser, NameTrigram, SearchEntry
+from users.search_backends import BACKENDS
+
+SYNTHETIC_PREFIX = 'bench_'
+
+
+##########################################################################
+# Benchmarks the name search backends on a large synthetic user table
+# Inserts the synthetic users and rebuilds the search tables of the
+# configured database, so it only runs with --scratch and never on the
+# checked in db.sqlite3, e.g.
+#   DB_NAME=/tmp/bench.sqlite3 python manage.py migrate
+#   DB_NAME=/tmp/bench.sqlite3 python manage.py benchmark_search --scratch
+# The synthetic users are removed again unless --keep is set
+##########################################################################
+class Command(BaseCommand):
+    help = "Report p50/p99 name search latency of each search backend on synthetic users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000, help="Number of synthetic users.")
+        parser.add_argument('--queries', type=int, default=200, help="Number of searches per backend.")
+        parser.add_argument('--result-size', type=int, default=20, help="Results per page.")
+        parser.add_argument('--backends', nargs='+', choices=sorted(BACKENDS), help="Backends to compare.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic users afterwards.")
+        add_scratch_argument(parser)
+
+    def handle(self, *args, **options):
+        require_scratch_database(options)
+
+        backends = options['backends'] or [
+            name for name in BACKENDS if name != 'postgres' or connection.vendor == 'postgresql'
+        ]
+        if 'postgres' in backends and connection.vendor != 'postgresql':
+            raise CommandError("The 'postgres' backend needs a PostgreSQL database.")
+
+        rng = random.Random(options['seed'])
+        if not CustomUser.objects.filter(username__startswith=SYNTHETIC_PREFIX).exists():
+            self.generate_users(options['users'], rng)
+        usernames = list(
+            CustomUser.objects.filter(username__startswith=SYNTHETIC_PREFIX)
+            .values_list('username', flat=True)[:10000]
+        )
+        queries = [self.make_query(rng.choice(usernames), rng) for _ in range(options['queries'])]
+
+        try:
+            self.stdout.write(f"Search table built in {timed(search_index.rebuild):.1f}s")
+            for name in backends:
+                backend = BACKENDS[name]()
+                if backend.maintains_index:
+                    with transaction.atomic():
+                        elapsed = timed(backend.rebuild)
+                    self.stdout.write(f"{name}: index built in {elapsed:.1f}s")
+
+                latencies = [timed(self.search_page, backend, query, options['result_size']) for query in queries]
+                stats = summarize(latencies)
+                self.stdout.write(
+                    f"{name}: {stats['count']} queries, p50 {stats['p50_ms']} ms, "
+                    f"p99 {stats['p99_ms']} ms, mean {stats['mean_ms']} ms"
+                )
+        finally:
+            if not options['keep']:
+                self.remove_users()
+
+    def generate_users(self, count, rng, batch_size=10000):
+        started = time.perf_counter()
+        for start in range(0, count, batch_size):
+            CustomUser.objects.bulk_create([
+                CustomUser(
+                    username=f"{SYNTHETIC_PREFIX}{rng.choice(FIRST_NAMES)}_{rng.choice(LAST_NAMES)}_{i:x}",
+                    phone_number=f"+9170{i:08}",
+                    phone_key=int(f"9170{i:08}"),
+                    password='!',
+                )
+                for i in range(start, min(start + batch_size, count))
+            ])
+        self.stdout.write(f"Generated {count} users in {time.perf_counter() - started:.1f}s")
+
+    def make_query(self, username, rng):
+        name = username[len(SYNTHETIC_PREFIX):]
+        length = rng.randint(3, 6)
+        # Half of the queries are prefixes, half substrings from anywhere in the name
+        start = 0 if rng.random() < 0.5 else rng.randint(0, max(0, len(name) - length))
+        return name[start:start + length]
+
+    def search_page(self, backend, query, result_size):
+        results = backend.search(SearchEntry.objects.all(), 'name', query)
+        page = Paginator(results, result_size).get_page(1)
+        list(page)
+
+    def remove_users(self):
+        # Raw deletes, row by row signal handling would take hours for a million users
+        user_table = CustomUser._meta.db_table
+        entry_table = SearchEntry._meta.db_table
+        synthetic_entries = f"SELECT id FROM {entry_table} WHERE source = %s AND name LIKE %s"
+        params = [search_index.SOURCE_USER, f"{SYNTHETIC_PREFIX}%"]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {NameTrigram._meta.db_table} WHERE entry_id IN ({synthetic_entries})", params)
+            cursor.execute(f"DELETE FROM {entry_table} WHERE id IN ({synthetic_entries})", params)
+            cursor.execute(f"DELETE FROM {user_table} WHERE username LIKE %s", [f"{SYNTHETIC_PREFIX}%"])
+        self.stdout.write("Removed the synthetic users.")
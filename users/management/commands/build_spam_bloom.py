@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from users.bloom import SharedBloomFilter, from_microseconds
+
+
+##########################################################################
+# Rebuilds the shared Bloom filter of reported numbers from PhoneSpamStats
+# Running workers map the new file within a few seconds. Bits are never
+# cleared otherwise, so run it after deleting reports or raising capacity
+##########################################################################
+class Command(BaseCommand):
+    help = "Rebuild the shared Bloom filter of reported phone numbers."
+
+    def handle(self, *args, **options):
+        if not settings.SPAM_BLOOM_PATH:
+            raise CommandError("SPAM_BLOOM_PATH is not set, the Bloom filter is disabled.")
+
+        bloom = SharedBloomFilter(
+            settings.SPAM_BLOOM_PATH, settings.SPAM_BLOOM_CAPACITY, settings.SPAM_BLOOM_ERROR_RATE
+        )
+        bloom.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {settings.SPAM_BLOOM_PATH}: {bloom.bits} bits, {bloom.hashes} hashes, "
+            f"{bloom.size / 2 ** 20:.1f} MB, numbers scored up to {from_microseconds(bloom.watermark).isoformat()}."
+        ))
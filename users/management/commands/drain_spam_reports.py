@@ -0,0 +1,44 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from users import report_queue
+
+
+##########################################################################
+# Writes the spam reports queued by the mark spam views in write-behind
+# mode (SPAM_REPORT_QUEUE, see users/report_queue.py) to the database.
+# Runs until stopped, one process or more per Redis stream, or with
+# --once until the queue is empty, e.g. from cron. The local queue lives in
+# the web process and is drained there, here --once only drains the queue
+# of this process, which tests use with SPAM_REPORT_LOCAL_WORKER off
+##########################################################################
+class Command(BaseCommand):
+    help = "Write queued spam reports to the database in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SPAM_REPORT_DRAIN_BATCH_SIZE,
+                            help="Number of queued reports written per transaction.")
+        parser.add_argument('--block-ms', type=int, default=1000,
+                            help="Milliseconds to wait for new reports when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Stop when the queue is empty.")
+
+    def handle(self, *args, **options):
+        if not settings.SPAM_REPORT_QUEUE:
+            raise CommandError("SPAM_REPORT_QUEUE is not set, spam reports are written by the views.")
+
+        read = written = 0
+        started = time.perf_counter()
+        while True:
+            batch_read, batch_written = report_queue.drain(
+                options['batch_size'], 0 if options['once'] else options['block_ms']
+            )
+            read += batch_read
+            written += batch_written
+            if batch_read == 0 and options['once']:
+                break
+            if batch_read and options['verbosity'] > 1:
+                self.stdout.write(f"Wrote {batch_written} of {batch_read} queued reports.")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} new spam reports of {read} queued in {time.perf_counter() - started:.1f}s."
+        ))
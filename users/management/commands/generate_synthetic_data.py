@@ -0,0 +1,175 @@
+import math
+import random
+import time
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+from users.benchmarks import (
+    BUSINESS_NAMES, FIRST_NAMES, LAST_NAMES, SYNTHETIC_PASSWORD, SYNTHETIC_PREFIX, add_scratch_argument,
+    require_scratch_database, zipf_weights,
+)
+from users.models import ContactSyncState, CustomUser, RegisteredUserContact, ReportedUserSpam
+
+
+##########################################################################
+# Generates a synthetic dataset at realistic scale for the benchmarks
+#   - users with Indian mobile numbers (+916...), all with the password
+#     SYNTHETIC_PASSWORD so the login endpoints can be measured
+#   - a log-normal number of contacts per user (mean --contacts), mostly
+#     other users under variants of their name, some unregistered numbers
+#     and --hot-share of them one of --hot-numbers call centre numbers
+#     shared by thousands of phone books, drawn Zipf-distributed
+#   - spam reports, mostly against the hot numbers and a small pool of
+#     spam numbers, again Zipf-distributed
+# Rows are written with bulk_create, which skips the model signals, so the
+# search index, spam stats, contact name votes and caller-ID summaries are
+# rebuilt afterwards. The same --seed generates the same dataset.
+# Writes to the configured database, so it only runs with --scratch and
+# never on the checked in db.sqlite3.
+##########################################################################
+class Command(BaseCommand):
+    help = "Generate synthetic users, contacts and spam reports for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000, help="Number of synthetic users.")
+        parser.add_argument('--contacts', type=int, default=50, help="Mean number of contacts per user.")
+        parser.add_argument('--reports', type=int, default=20_000, help="Number of spam reports.")
+        parser.add_argument('--hot-numbers', type=int, default=100, help="Numbers shared by many phone books.")
+        parser.add_argument('--hot-share', type=float, default=0.05, help="Fraction of contacts that are hot numbers.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000, help="Number of rows written per bulk insert.")
+        parser.add_argument('--clear', action='store_true', help="Remove an earlier synthetic dataset first.")
+        add_scratch_argument(parser)
+
+    def handle(self, *args, **options):
+        require_scratch_database(options)
+        if CustomUser.objects.filter(username__startswith=SYNTHETIC_PREFIX).exists():
+            if not options['clear']:
+                raise CommandError("A synthetic dataset exists already, pass --clear to replace it.")
+            self.remove()
+
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        names = self.generate_users(options['users'], rng, options['batch_size'])
+        user_ids = list(
+            CustomUser.objects.filter(username__startswith=SYNTHETIC_PREFIX).order_by('phone_key').values_list('id', flat=True)
+        )
+        contact_count = self.generate_contacts(user_ids, names, rng, options)
+        report_count = self.generate_reports(user_ids, rng, options)
+        self.stdout.write(
+            f"Generated {len(user_ids)} users, {contact_count} contacts and {report_count} spam reports "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+        started = time.perf_counter()
+        # Spam stats first, the search entries copy their scores and the contact
+        # name votes rebuild the caller-ID summaries from them
+        call_command('rebuild_spam_stats', batch_size=options['batch_size'], stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('rebuild_contact_name_votes', batch_size=options['batch_size'], stdout=self.stdout)
+        if settings.SPAM_BLOOM_PATH:
+            call_command('build_spam_bloom', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the derived tables in {time.perf_counter() - started:.1f}s"))
+
+    def generate_users(self, count, rng, batch_size):
+        # The i-th user has the number +916<i>, returns the (first, last) name of every user
+        password = make_password(SYNTHETIC_PASSWORD)
+        names = [(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)) for _ in range(count)]
+        for start in range(0, count, batch_size):
+            CustomUser.objects.bulk_create([
+                CustomUser(
+                    username=f"{SYNTHETIC_PREFIX}{first}_{last}_{i:x}",
+                    phone_number=f"+{self.user_key(i)}",
+                    phone_key=self.user_key(i),
+                    email=f"{first}.{last}.{i:x}@example.com" if rng.random() < 0.5 else None,
+                    password=password,
+                )
+                for i, (first, last) in enumerate(names[start:start + batch_size], start)
+            ])
+        return names
+
+    def generate_contacts(self, user_ids, names, rng, options):
+        hot_weights = zipf_weights(options['hot_numbers'])
+        # Friends are drawn with a mild skew, popular users are in more phone books
+        friend_weights = zipf_weights(len(user_ids), 0.5)
+        unknown_pool = max(1000, len(user_ids) * options['contacts'] // 3)
+        mean = max(options['contacts'], 1)
+        created = 0
+        batch = []
+        for owner_index, owner_id in enumerate(user_ids):
+            size = min(int(rng.lognormvariate(math.log(mean) - 0.5, 1.0)), 20 * mean)
+            saved = set()
+            for _ in range(size):
+                draw = rng.random()
+                if draw < options['hot_share']:
+                    hot = rng.choices(range(options['hot_numbers']), cum_weights=hot_weights)[0]
+                    key, name = self.hot_key(hot), self.hot_name(hot, rng)
+                elif draw < 0.6:
+                    friend = rng.choices(range(len(user_ids)), cum_weights=friend_weights)[0]
+                    if friend == owner_index:
+                        continue
+                    key, name = self.user_key(friend), self.friend_name(*names[friend], rng)
+                else:
+                    key = 917_000_000_000 + rng.randrange(unknown_pool)
+                    name = f"{rng.choice(FIRST_NAMES).title()} {rng.choice(LAST_NAMES).title()}"
+                if key in saved:
+                    continue
+                saved.add(key)
+                batch.append(RegisteredUserContact(
+                    contact_name=name, phone_number=f"+{key}", phone_key=key, contact_of_id=owner_id,
+                ))
+            if len(batch) >= options['batch_size']:
+                RegisteredUserContact.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        RegisteredUserContact.objects.bulk_create(batch)
+        return created + len(batch)
+
+    def generate_reports(self, user_ids, rng, options):
+        spam_pool = [self.hot_key(hot) for hot in range(options['hot_numbers'])]
+        spam_pool += [918_000_000_000 + rng.randrange(10 ** 9) for _ in range(max(100, options['reports'] // 20))]
+        spam_weights = zipf_weights(len(spam_pool))
+        reported = set()
+        # Popular spam numbers run out of distinct reporters, bound the retries
+        for _ in range(options['reports'] * 3):
+            if len(reported) == options['reports']:
+                break
+            key = rng.choices(spam_pool, cum_weights=spam_weights)[0]
+            reported.add((key, rng.choice(user_ids)))
+        reports = sorted(reported)
+        for start in range(0, len(reports), options['batch_size']):
+            ReportedUserSpam.objects.bulk_create([
+                ReportedUserSpam(phone_number=f"+{key}", phone_key=key, marked_by_id=user_id)
+                for key, user_id in reports[start:start + options['batch_size']]
+            ])
+        return len(reports)
+
+    def user_key(self, index):
+        return 916_000_000_000 + index
+
+    def hot_key(self, index):
+        return 918_000_000_000 + index
+
+    def hot_name(self, index, rng):
+        # Everybody saves a call centre a little differently
+        business = BUSINESS_NAMES[index % len(BUSINESS_NAMES)]
+        return rng.choice([business.title(), business, business.upper(), f"{business.title()} {index}"])
+
+    def friend_name(self, first, last, rng):
+        return rng.choice([f"{first.title()} {last.title()}", first.title(), f"{first.title()} {last[0].upper()}", f"{first} office"])
+
+    def remove(self):
+        # Raw deletes, the ORM would collect every cascaded row in memory first
+        synthetic_users = f"SELECT id FROM {CustomUser._meta.db_table} WHERE username LIKE %s"
+        params = [f"{SYNTHETIC_PREFIX}%"]
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model, column in (
+                (RegisteredUserContact, 'contact_of_id'), (ReportedUserSpam, 'marked_by_id'),
+                (ContactSyncState, 'user_id'), (Token, 'user_id'),
+            ):
+                cursor.execute(f"DELETE FROM {model._meta.db_table} WHERE {column} IN ({synthetic_users})", params)
+            cursor.execute(f"DELETE FROM {CustomUser._meta.db_table} WHERE username LIKE %s", params)
+        self.stdout.write("Removed the synthetic dataset.")
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from users import graph
+
+
+##########################################################################
+# Propagates spam scores over the contact graph, see users/graph.py
+# By default only the numbers whose contacts or reports changed since the
+# last run and their neighbourhood are rescored, e.g. every few minutes
+# from cron. Run it with --full nightly and after bulk imports
+##########################################################################
+class Command(BaseCommand):
+    help = "Score numbers from the phone books they are saved in and the names they are saved under."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rescore every number instead of the changed ones.")
+        parser.add_argument('--hops', type=int, default=1,
+                            help="Phone book hops around changed numbers that are rescored as well.")
+
+    def handle(self, *args, **options):
+        if graph.sparse is None:
+            raise CommandError("propagate_spam_scores needs SciPy, install it with 'pip install scipy'.")
+
+        started = time.perf_counter()
+        rescored, written, iterations = graph.propagate(full=options['full'], hops=options['hops'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rescored {rescored} numbers in {iterations} iterations, {written} changed, "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from users import caller_id
+from users.models import CallerIdSummary
+
+
+##########################################################################
+# Rebuilds the caller-ID summaries from users, contacts and spam stats
+# Needed after bulk imports that bypass the model signals
+##########################################################################
+class Command(BaseCommand):
+    help = "Rebuild the precomputed caller-ID summary of every known phone number."
+
+    def handle(self, *args, **options):
+        caller_id.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt caller-ID summaries for {CallerIdSummary.objects.count()} phone numbers."
+        ))
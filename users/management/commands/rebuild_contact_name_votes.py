@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from users import caller_id
+from users.models import ContactNameVote, PhoneSpamStats, RegisteredUserContact
+
+
+##########################################################################
+# Recounts the contact name votes of every number from RegisteredUserContact
+# Needed after bulk imports that bypass the model signals. The negative
+# labels of the spam stats are recounted from the votes, and the caller-ID
+# summaries read their top names from them and are rebuilt as well
+##########################################################################
+class Command(BaseCommand):
+    help = "Recount how many contacts saved each number under each name."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Number of rows written per bulk insert.")
+
+    def handle(self, *args, **options):
+        contacts = (
+            RegisteredUserContact.objects.filter(phone_key__isnull=False)
+            .order_by('phone_key', 'id')
+            .values_list('phone_key', 'contact_name')
+            .iterator(chunk_size=options['batch_size'])
+        )
+        # Swap the whole table in one transaction so lookups never observe
+        # a half-counted number
+        with transaction.atomic():
+            ContactNameVote.objects.all().delete()
+            created = ContactNameVote.objects.bulk_create(
+                (
+                    ContactNameVote(phone_key=key, name_key=name_key, name=name, votes=votes)
+                    for key, name_key, name, votes in ContactNameVote.tally(contacts)
+                ),
+                batch_size=options['batch_size'],
+            )
+            negative = PhoneSpamStats.recount_negative_labels(options['batch_size'])
+        caller_id.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Counted {len(created)} names of saved numbers, {negative} numbers saved under spam-like names."
+        ))
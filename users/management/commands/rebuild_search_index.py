@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from users import search_index
+from users.search_backends import get_search_backend
+
+
+##########################################################################
+# Rebuilds the name search table and the index of the search backend
+# Needed after bulk imports that bypass the model signals
+##########################################################################
+class Command(BaseCommand):
+    help = "Rebuild the name search table and the index of the configured search backend."
+
+    def handle(self, *args, **options):
+        search_index.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the search table with {type(get_search_backend()).__name__}."
+        ))
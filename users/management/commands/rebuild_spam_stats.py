@@ -0,0 +1,91 @@
+from itertools import chain
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from users import scoring, spam_copies
+from users.models import PhoneSpamStats, ReportedUserSpam
+
+
+##########################################################################
+# Rebuilds the PhoneSpamStats aggregate table from ReportedUserSpam
+# Use after bulk imports or whenever the counters are suspected to drift.
+# The copies of the scores in the search entries, caller-ID summaries and
+# Bloom filter are refreshed for every number that had or has a score
+##########################################################################
+class Command(BaseCommand):
+    help = "Rebuild the per-number spam counters from the ReportedUserSpam table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of rows written per bulk insert.")
+
+    def handle(self, *args, **options):
+        aggregates = (
+            ReportedUserSpam.objects.filter(phone_key__isnull=False)
+            .values('phone_key')
+            .annotate(
+                phone_number=Max('phone_number'),
+                report_count=Count('id'),
+                distinct_reporters=Count('marked_by', distinct=True),
+                first_reported_at=Min('created_at'),
+                last_reported_at=Max('created_at'),
+            )
+            .order_by()
+        )
+        reporter_counts = dict(
+            ReportedUserSpam.objects.values('marked_by')
+            .annotate(reports=Count('id'))
+            .values_list('marked_by', 'reports')
+            .order_by()
+        )
+        epoch_scores = scoring.epoch_scores(
+            ReportedUserSpam.objects.filter(phone_key__isnull=False)
+            .values_list('phone_key', 'marked_by', 'created_at')
+            .iterator(chunk_size=options['batch_size']),
+            reporter_counts,
+        )
+
+        # Swap the whole table in one transaction so searches never observe
+        # a half-built aggregate. The contact graph scores and the negative
+        # labels are not derived from the reports and are carried over
+        self.now = timezone.now()
+        with transaction.atomic():
+            carried = {
+                key: (phone_number, graph_score, graph_epoch_score, negative_labels)
+                for key, phone_number, graph_score, graph_epoch_score, negative_labels in
+                PhoneSpamStats.objects.filter(Q(graph_score__gt=0) | Q(graph_epoch_score__gt=0) | ~Q(negative_labels=0))
+                .values_list('phone_key', 'phone_number', 'graph_score', 'graph_epoch_score', 'negative_labels').iterator()
+            }
+            previous_keys = list(PhoneSpamStats.objects.values_list('phone_key', flat=True).iterator())
+            PhoneSpamStats.objects.all().delete()
+            created = PhoneSpamStats.objects.bulk_create(
+                chain(
+                    (self.stats(row, epoch_scores[row['phone_key']], carried.pop(row['phone_key'], None)) for row in aggregates.iterator()),
+                    # Numbers without reports, pop() above left them over
+                    self.unreported(carried),
+                ),
+                batch_size=options['batch_size'],
+            )
+            spam_copies.refresh(previous_keys + [stats.phone_key for stats in created])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt spam stats for {len(created)} phone numbers."
+        ))
+
+    def stats(self, row, epoch_score, carried):
+        if carried is None:
+            return PhoneSpamStats(epoch_score=epoch_score, scored_at=self.now, **row)
+        _, graph_score, graph_epoch_score, negative_labels = carried
+        return PhoneSpamStats(
+            epoch_score=epoch_score + graph_epoch_score, graph_score=graph_score, graph_epoch_score=graph_epoch_score,
+            negative_labels=negative_labels, scored_at=self.now, **row
+        )
+
+    def unreported(self, carried):
+        for key, (phone_number, graph_score, graph_epoch_score, negative_labels) in carried.items():
+            yield PhoneSpamStats(
+                phone_key=key, phone_number=phone_number, graph_score=graph_score,
+                graph_epoch_score=graph_epoch_score, epoch_score=graph_epoch_score, negative_labels=negative_labels,
+                scored_at=self.now if graph_epoch_score > 0 else None,
+            )
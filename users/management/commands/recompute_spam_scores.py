@@ -0,0 +1,180 @@
+import resource
+import time
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef
+from users import scoring, spam_copies
+from users.models import PhoneSpamStats, ReportedUserSpam
+from users.phone import key_to_phone_number
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+##########################################################################
+# Recomputes every spam aggregate and decayed score from ReportedUserSpam
+# Reports are streamed in phone_key order into NumPy arrays one chunk at a
+# time, so memory is bounded by the chunk size and the reporter table, not
+# by the number of reports. Unlike the incremental updates, every report is
+# weighted with its reporter's current report count. A report recorded while
+# a batch of its number is being written can be lost, run it off-peak.
+##########################################################################
+class Command(BaseCommand):
+    help = "Recompute report counts and decayed spam scores of all numbers with NumPy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100_000, help="Reports read per chunk.")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Numbers written per bulk update.")
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError("recompute_spam_scores needs NumPy, install it with 'pip install numpy'.")
+
+        started = time.perf_counter()
+        self.reporter_ids, self.reporter_weights = self.load_reporter_weights()
+        self.epoch_ts = scoring.SCORE_EPOCH.timestamp()
+        self.half_life = settings.SPAM_SCORE_HALF_LIFE_DAYS * 86400
+        self.batch_size = options['batch_size']
+
+        reports = numbers = 0
+        for keys, counts, scores, first_ts, last_ts in self.aggregate_chunks(options['chunk_size']):
+            self.write(keys, counts, scores, first_ts, last_ts)
+            reports += int(counts.sum())
+            numbers += len(keys)
+
+        # Numbers whose reports were all deleted keep no score
+        cleared = PhoneSpamStats.objects.filter(
+            ~Exists(ReportedUserSpam.objects.filter(phone_key=OuterRef('phone_key'))), report_count__gt=0
+        )
+        cleared_keys = list(cleared.values_list('phone_key', flat=True))
+        with transaction.atomic():
+            PhoneSpamStats.objects.filter(phone_key__in=cleared_keys).update(
+                report_count=0, distinct_reporters=0, epoch_score=F('graph_epoch_score')
+            )
+            spam_copies.refresh(cleared_keys)
+
+        elapsed = time.perf_counter() - started
+        # ru_maxrss is in kilobytes on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {reports} reports of {numbers} numbers in {elapsed:.1f}s "
+            f"({reports / elapsed if elapsed else 0:.0f} reports/s, {numbers / elapsed if elapsed else 0:.0f} numbers/s, "
+            f"peak memory {peak_mb:.0f} MB)"
+        ))
+
+    def load_reporter_weights(self):
+        # One GROUP BY over the reporters, kept as sorted arrays for searchsorted
+        rows = (
+            ReportedUserSpam.objects.values('marked_by')
+            .annotate(reports=Count('id'))
+            .values_list('marked_by', 'reports')
+            .order_by('marked_by')
+        )
+        ids, counts = [], []
+        for reporter_id, count in rows.iterator():
+            ids.append(reporter_id)
+            counts.append(count)
+        # A sentinel at the end keeps every searchsorted position in range
+        ids = np.array(ids + [np.iinfo(np.int64).max], dtype=np.int64)
+        counts = np.array(counts + [1], dtype=np.float64)
+        # Vectorized scoring.reporter_weight()
+        quota = settings.SPAM_REPORTER_QUOTA
+        weights = np.sqrt(quota / np.maximum(counts, quota))
+        return ids, weights
+
+    def aggregate_chunks(self, chunk_size):
+        rows = (
+            ReportedUserSpam.objects.filter(phone_key__isnull=False)
+            .order_by('phone_key')
+            .values_list('phone_key', 'marked_by', 'created_at')
+            .iterator(chunk_size=chunk_size)
+        )
+        carry = None
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                carry = yield from self.aggregate(chunk, carry, final=False)
+                chunk = []
+        yield from self.aggregate(chunk, carry, final=True)
+
+    def aggregate(self, chunk, carry, final):
+        count = len(chunk)
+        keys = np.fromiter((row[0] for row in chunk), dtype=np.int64, count=count)
+        reporters = np.fromiter((row[1] for row in chunk), dtype=np.int64, count=count)
+        timestamps = np.fromiter((row[2].timestamp() for row in chunk), dtype=np.float64, count=count)
+        if carry is not None:
+            keys, reporters, timestamps = (np.concatenate(pair) for pair in zip(carry, (keys, reporters, timestamps)))
+        if not len(keys):
+            return None
+
+        if not final:
+            # The reports of the last number may continue in the next chunk
+            split = np.searchsorted(keys, keys[-1])
+            if split == 0:
+                return keys, reporters, timestamps
+            carry = keys[split:], reporters[split:], timestamps[split:]
+            keys, reporters, timestamps = keys[:split], reporters[:split], timestamps[:split]
+
+        # Reporters who made their first report after the weights were loaded count fully
+        positions = np.searchsorted(self.reporter_ids, reporters)
+        weights = np.where(self.reporter_ids[positions] == reporters, self.reporter_weights[positions], 1.0)
+        contributions = weights * np.exp2((timestamps - self.epoch_ts) / self.half_life)
+
+        # Rows are sorted by key, so every number is one contiguous segment
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        counts = np.diff(np.r_[starts, len(keys)])
+        # Whole microseconds, so first and last report times are written back exactly
+        microseconds = np.rint(timestamps * 1e6).astype(np.int64)
+        yield (
+            keys[starts],
+            counts,
+            np.add.reduceat(contributions, starts),
+            np.minimum.reduceat(microseconds, starts),
+            np.maximum.reduceat(microseconds, starts),
+        )
+        return None if final else carry
+
+    def to_datetime(self, microseconds):
+        return UNIX_EPOCH + timedelta(microseconds=int(microseconds))
+
+    def write(self, keys, counts, scores, first_ts, last_ts):
+        for start in range(0, len(keys), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            batch_keys = [int(key) for key in keys[batch]]
+            # One report per reporter and number, so reports are distinct reporters.
+            # Upserts instead of bulk_update(), whose CASE per row and field makes
+            # every batch quadratic. Only the contact graph part of the existing
+            # scores is read, it is kept
+            now = datetime.now(timezone.utc)
+            with transaction.atomic():
+                graph_scores = dict(
+                    PhoneSpamStats.objects.filter(phone_key__in=batch_keys, graph_epoch_score__gt=0)
+                                          .values_list('phone_key', 'graph_epoch_score')
+                )
+                PhoneSpamStats.objects.bulk_create(
+                    [
+                        PhoneSpamStats(
+                            phone_key=key, phone_number=key_to_phone_number(key),
+                            report_count=int(count), distinct_reporters=int(count),
+                            epoch_score=float(score) + graph_scores.get(key, 0.0),
+                            first_reported_at=self.to_datetime(first), last_reported_at=self.to_datetime(last),
+                            scored_at=now,
+                        )
+                        for key, count, score, first, last in zip(
+                            batch_keys, counts[batch], scores[batch], first_ts[batch], last_ts[batch]
+                        )
+                    ],
+                    update_conflicts=True,
+                    unique_fields=['phone_key'],
+                    update_fields=[
+                        'report_count', 'distinct_reporters', 'epoch_score', 'first_reported_at', 'last_reported_at', 'scored_at',
+                    ],
+                )
+                spam_copies.refresh(batch_keys)
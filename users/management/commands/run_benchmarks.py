@@ -0,0 +1,241 @@
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from users import urls
+from users.benchmarks import (
+    FIRST_NAMES, SYNTHETIC_PASSWORD, SYNTHETIC_PREFIX, add_scratch_argument, call_asgi, call_wsgi,
+    require_scratch_database, summarize,
+)
+from users.models import CallerIdSummary, CustomUser, RegisteredUserContact, ReportedUserSpam
+from users.throttling import GCRAThrottle
+
+# Users whose tokens authenticate the read requests
+READ_USERS = 20
+
+
+##########################################################################
+# Benchmarks every endpoint of users/urls.py and reports JSON
+# Meant for the dataset of generate_synthetic_data on a scratch database,
+# both only run with --scratch and never on the checked in db.sqlite3:
+#   export DB_NAME=/tmp/bench.sqlite3 && python manage.py migrate
+#   python manage.py generate_synthetic_data --users 100000 --scratch
+#   python manage.py run_benchmarks --scratch --output before.json
+#   (change the code)
+#   python manage.py run_benchmarks --scratch --baseline before.json
+# Every endpoint gets --warmup unmeasured and --requests measured requests
+# from one client through the WSGI handler in this process, the async/
+# endpoints through the ASGI handler, so throughput is 1 / mean latency of
+# one client. Reads are drawn with --seed and repeat across runs, writes
+# (registrations, reports, contacts) use fresh numbers so a repeated run
+# is not rejected. Throttling is switched off unless --throttled is set.
+##########################################################################
+class Command(BaseCommand):
+    help = "Report throughput and p50/p95/p99 latency of every users endpoint as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=20, help="Unmeasured requests per endpoint.")
+        parser.add_argument('--endpoints', nargs='+', help="URL names to run, defaults to all of users/urls.py.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--host', default='localhost', help="Host header, must be in ALLOWED_HOSTS.")
+        parser.add_argument('--throttled', action='store_true', help="Keep the configured throttle rates.")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+        parser.add_argument('--baseline', help="JSON results of an earlier run to compare with.")
+        add_scratch_argument(parser)
+
+    def handle(self, *args, **options):
+        require_scratch_database(options)
+        endpoints = options['endpoints'] or [pattern.name for pattern in urls.urlpatterns]
+        missing = [name for name in endpoints if not hasattr(self, f"request_{name.replace('-', '_')}")]
+        if missing:
+            raise CommandError(f"No benchmark request for: {', '.join(missing)}")
+
+        users = list(CustomUser.objects.filter(username__startswith=SYNTHETIC_PREFIX, is_active=True).order_by('id')[:1000])
+        if len(users) < READ_USERS * 2:
+            raise CommandError("Needs the users of generate_synthetic_data, run it first.")
+        self.readers = users[:READ_USERS]
+        # Logouts and full syncs change a user's tokens and phone book, they get users of their own
+        self.writers = users[READ_USERS:]
+        self.tokens = {user.pk: Token.objects.get_or_create(user=user)[0].key for user in self.readers}
+        self.numbers = self.phone_numbers()
+        self.rng = random.Random(options['seed'])
+        # Unseeded, writes must not repeat the numbers of earlier runs
+        self.fresh = random.Random()
+        self.factory = RequestFactory(HTTP_HOST=options['host'])
+
+        result = {"commit": self.commit(), "profile": self.profile(), "dataset": self.dataset(), "endpoints": {}}
+        if not options['throttled']:
+            # Rates of None switch GCRAThrottle off for every scope
+            GCRAThrottle.THROTTLE_RATES = dict.fromkeys(GCRAThrottle.THROTTLE_RATES)
+        connection.close()
+
+        wsgi, asgi = WSGIHandler(), ASGIHandler()
+        for name in endpoints:
+            build = getattr(self, f"request_{name.replace('-', '_')}")
+            if name.startswith('async-'):
+                latencies, statuses = asyncio.run(self.arun(asgi, build, name, options))
+            else:
+                latencies, statuses = self.run(wsgi, build, name, options)
+            summary = summarize(latencies, sum(latencies))
+            summary["statuses"] = dict(sorted(Counter(statuses).items()))
+            result["endpoints"][name] = summary
+            self.stderr.write(
+                f"{name}: {summary['throughput_per_s']} req/s, p50 {summary['p50_ms']} ms, "
+                f"p99 {summary['p99_ms']} ms, statuses {summary['statuses']}"
+            )
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                self.compare(json.load(baseline), result)
+        output = json.dumps(result, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def run(self, handler, build, name, options):
+        latencies, statuses = [], []
+        for index in range(options['warmup'] + options['requests']):
+            environ = build(name).environ
+            started = time.perf_counter()
+            status_code = call_wsgi(handler, environ)
+            if index >= options['warmup']:
+                latencies.append(time.perf_counter() - started)
+                statuses.append(status_code)
+        return latencies, statuses
+
+    async def arun(self, handler, build, name, options):
+        latencies, statuses = [], []
+        for index in range(options['warmup'] + options['requests']):
+            environ = build(name).environ
+            started = time.perf_counter()
+            status_code = await call_asgi(handler, environ)
+            if index >= options['warmup']:
+                latencies.append(time.perf_counter() - started)
+                statuses.append(status_code)
+        return latencies, statuses
+
+    def phone_numbers(self):
+        # Numbers people look up: hot numbers, registered users and numbers only saved as contacts
+        summaries = CallerIdSummary.objects.values_list('phone_number', flat=True)
+        numbers = list(summaries.order_by('-contact_count')[:100])
+        numbers += CustomUser.objects.filter(username__startswith=SYNTHETIC_PREFIX).values_list('phone_number', flat=True)[:2000]
+        numbers += summaries.filter(username__isnull=True).order_by('phone_key')[:2000]
+        return numbers
+
+    def authorized(self):
+        return {'HTTP_AUTHORIZATION': f"Token {self.tokens[self.rng.choice(self.readers).pk]}"}
+
+    def writer_token(self):
+        user = self.rng.choice(self.writers)
+        return {'HTTP_AUTHORIZATION': f"Token {Token.objects.get_or_create(user=user)[0].key}"}
+
+    def fresh_number(self):
+        return f"+9189{self.fresh.randrange(10 ** 8):08}"
+
+    def post(self, name, data, headers):
+        return self.factory.post(reverse(name), data, content_type='application/json', **headers)
+
+    def request_user_register(self, name):
+        number = self.fresh_number()
+        return self.post(name, {
+            'username': f"{SYNTHETIC_PREFIX}registered_{number[1:]}", 'password': SYNTHETIC_PASSWORD, 'phone_number': number,
+        }, {})
+
+    def request_user_login(self, name):
+        return self.post(name, {'username': self.rng.choice(self.readers).username, 'password': SYNTHETIC_PASSWORD}, {})
+
+    request_async_user_login = request_user_login
+
+    def request_user_logout(self, name):
+        return self.post(name, {}, self.writer_token())
+
+    def request_mark_spam(self, name):
+        # Mostly new reports, some numbers the reader may have reported before (400)
+        number = self.fresh_number() if self.rng.random() < 0.9 else self.rng.choice(self.numbers)
+        return self.post(name, {'phone_number': number}, self.authorized())
+
+    request_async_mark_spam = request_mark_spam
+
+    def request_mark_spam_batch(self, name):
+        return self.post(name, {'phone_numbers': [self.fresh_number() for _ in range(50)]}, self.authorized())
+
+    def request_search_user_by_name(self, name):
+        query = self.rng.choice(FIRST_NAMES)[:self.rng.randint(3, 6)]
+        return self.factory.get(reverse(name), {'name': query}, **self.authorized())
+
+    request_async_search_user_by_name = request_search_user_by_name
+
+    def request_search_user_by_phone(self, name):
+        return self.factory.get(reverse(name), {'phone_number': self.rng.choice(self.numbers)}, **self.authorized())
+
+    request_async_search_user_by_phone = request_search_user_by_phone
+    request_caller_id = request_search_user_by_phone
+
+    def request_create_contact(self, name):
+        contact = {'contact_name': f"{self.rng.choice(FIRST_NAMES).title()} mobile", 'phone_number': self.rng.choice(self.numbers)}
+        return self.post(name, contact, self.authorized())
+
+    def request_sync_contacts(self, name):
+        # A full sync of a 200 entry phone book
+        contacts = [
+            {'contact_name': f"{self.rng.choice(FIRST_NAMES).title()} {index}", 'phone_number': self.rng.choice(self.numbers)}
+            for index in range(200)
+        ]
+        return self.post(name, contacts, self.writer_token())
+
+    def request_internal_metrics(self, name):
+        # 403 unless API_INSTRUMENTATION is on and 127.0.0.1 is in INTERNAL_IPS
+        return self.factory.get(reverse(name), REMOTE_ADDR='127.0.0.1')
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def profile(self):
+        return {
+            "vendor": connection.vendor,
+            "cache": settings.CACHES['default']['BACKEND'],
+            "instrumentation": settings.API_INSTRUMENTATION,
+            "debug": settings.DEBUG,
+        }
+
+    def dataset(self):
+        return {
+            "users": CustomUser.objects.count(),
+            "contacts": RegisteredUserContact.objects.count(),
+            "spam_reports": ReportedUserSpam.objects.count(),
+            "caller_id_summaries": CallerIdSummary.objects.count(),
+        }
+
+    def compare(self, baseline, result):
+        self.stderr.write(f"Compared with {baseline.get('commit')}:")
+        for name, summary in result["endpoints"].items():
+            before = baseline.get("endpoints", {}).get(name)
+            if not before:
+                continue
+            changes = {
+                key: round(100 * (summary[key] - before[key]) / before[key], 1) if before[key] else None
+                for key in ('throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms')
+            }
+            summary["change_percent"] = changes
+            self.stderr.write(
+                f"{name}: throughput {changes['throughput_per_s']:+}%, p50 {changes['p50_ms']:+}%, p99 {changes['p99_ms']:+}%"
+                if None not in changes.values() else f"{name}: no baseline latency"
+            )
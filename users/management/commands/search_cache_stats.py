@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from users import search_cache
+
+
+##########################################################################
+# Prints the hit/miss/invalidation counters of the search response cache
+# Counters are shared by all workers through the cache backend, each worker
+# adds its own every search_cache.METRICS_FLUSH_INTERVAL seconds
+##########################################################################
+class Command(BaseCommand):
+    help = "Show hit, miss and invalidation counts of the search response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        metrics = search_cache.metrics()
+        for name in search_cache.METRIC_NAMES:
+            self.stdout.write(f"{name}: {metrics[name]}")
+        self.stdout.write(f"hit_rate: {metrics['hit_rate']:.2%}")
+
+        if options['reset']:
+            search_cache.reset_metrics()
+            self.stdout.write(self.style.SUCCESS("Search cache counters reset."))
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:54
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def backfill_phone_spam_stats(apps, schema_editor):
+    ReportedUserSpam = apps.get_model('users', 'ReportedUserSpam')
+    PhoneSpamStats = apps.get_model('users', 'PhoneSpamStats')
+    aggregates = (
+        ReportedUserSpam.objects.values('phone_number')
+        .annotate(
+            report_count=Count('id'),
+            distinct_reporters=Count('marked_by', distinct=True),
+            first_reported_at=Min('created_at'),
+            last_reported_at=Max('created_at'),
+        )
+        .order_by()
+    )
+    PhoneSpamStats.objects.bulk_create(
+        [PhoneSpamStats(**row) for row in aggregates], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_alter_customuser_phone_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhoneSpamStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=15, unique=True)),
+                ('report_count', models.PositiveIntegerField(default=0)),
+                ('distinct_reporters', models.PositiveIntegerField(default=0)),
+                ('first_reported_at', models.DateTimeField(blank=True, null=True)),
+                ('last_reported_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'phone spam stats',
+            },
+        ),
+        migrations.RunPython(backfill_phone_spam_stats, migrations.RunPython.noop),
+    ]
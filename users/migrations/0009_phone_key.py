@@ -0,0 +1,53 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_phonespamstats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='phone_number',
+            field=models.CharField(max_length=16, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='registeredusercontact',
+            name='phone_number',
+            field=models.CharField(max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='reporteduserspam',
+            name='phone_number',
+            field=models.CharField(max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='phonespamstats',
+            name='phone_number',
+            field=models.CharField(max_length=16),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='phone_key',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='registeredusercontact',
+            name='phone_key',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='reporteduserspam',
+            name='phone_key',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='phonespamstats',
+            name='phone_key',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
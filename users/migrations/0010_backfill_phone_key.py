@@ -0,0 +1,95 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:21
+
+import re
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Max, Min
+
+
+# Frozen copy of users.phone.normalize_phone_number as of this migration, so
+# later changes to the normalization do not change what it backfills
+SEPARATORS = re.compile(r'[\s\-.()/]')
+MIN_DIGITS = 8
+MAX_DIGITS = 15
+
+
+class InvalidPhoneNumber(ValueError):
+    pass
+
+
+def normalize_phone_number(raw):
+    country_code = settings.PHONE_DEFAULT_COUNTRY_CODE
+    national_length = settings.PHONE_NATIONAL_NUMBER_LENGTH
+
+    number = SEPARATORS.sub('', str(raw))
+    if number.startswith('+'):
+        digits = number[1:]
+    elif number.startswith('00'):
+        digits = number[2:]
+    elif number.startswith('0') and len(number) == national_length + 1:
+        digits = country_code + number[1:]
+    elif len(number) == national_length:
+        digits = country_code + number
+    else:
+        digits = number
+
+    if not digits.isdigit() or not MIN_DIGITS <= len(digits) <= MAX_DIGITS:
+        raise InvalidPhoneNumber(raw)
+    return f"+{digits}"
+
+
+def normalize_rows(model, unique=False):
+    seen_keys = set()
+    rows = []
+    for row in model.objects.only('id', 'phone_number').order_by('id').iterator():
+        try:
+            phone_number = normalize_phone_number(row.phone_number)
+        except InvalidPhoneNumber:
+            # Leave numbers we cannot parse untouched, they just are not searchable by key
+            continue
+        key = int(phone_number[1:])
+        if unique and key in seen_keys:
+            # Two accounts wrote the same number differently, the oldest keeps it
+            continue
+        seen_keys.add(key)
+        row.phone_number = phone_number
+        row.phone_key = key
+        rows.append(row)
+    model.objects.bulk_update(rows, ['phone_number', 'phone_key'], batch_size=1000)
+
+
+def backfill_phone_keys(apps, schema_editor):
+    normalize_rows(apps.get_model('users', 'CustomUser'), unique=True)
+    normalize_rows(apps.get_model('users', 'RegisteredUserContact'))
+    normalize_rows(apps.get_model('users', 'ReportedUserSpam'))
+
+    # Numbers that were written differently collapse into one aggregate row
+    ReportedUserSpam = apps.get_model('users', 'ReportedUserSpam')
+    PhoneSpamStats = apps.get_model('users', 'PhoneSpamStats')
+    aggregates = (
+        ReportedUserSpam.objects.filter(phone_key__isnull=False)
+        .values('phone_key')
+        .annotate(
+            phone_number=Max('phone_number'),
+            report_count=Count('id'),
+            distinct_reporters=Count('marked_by', distinct=True),
+            first_reported_at=Min('created_at'),
+            last_reported_at=Max('created_at'),
+        )
+        .order_by()
+    )
+    PhoneSpamStats.objects.all().delete()
+    PhoneSpamStats.objects.bulk_create(
+        [PhoneSpamStats(**row) for row in aggregates], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_phone_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_phone_keys, migrations.RunPython.noop),
+    ]
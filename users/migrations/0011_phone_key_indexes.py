@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_backfill_phone_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='phone_key',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='phonespamstats',
+            name='phone_key',
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='registeredusercontact',
+            index=models.Index(fields=['contact_of', 'phone_key'], name='users_regis_contact_c6c79e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reporteduserspam',
+            index=models.Index(fields=['phone_key', 'marked_by'], name='users_repor_phone_k_140cea_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-18 15:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_phone_key_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='contact_sync_state', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:05
+
+from django.db import migrations
+from django.db.models import Count, Max, Min
+
+
+def deduplicate_spam_reports(apps, schema_editor):
+    ReportedUserSpam = apps.get_model('users', 'ReportedUserSpam')
+    PhoneSpamStats = apps.get_model('users', 'PhoneSpamStats')
+
+    # Keep the oldest report of every (number, reporter) pair
+    duplicates = (
+        ReportedUserSpam.objects.filter(phone_key__isnull=False)
+        .values('phone_key', 'marked_by')
+        .annotate(first_id=Min('id'), reports=Count('id'))
+        .filter(reports__gt=1)
+        .order_by()
+    )
+    affected_keys = set()
+    for row in duplicates:
+        ReportedUserSpam.objects.filter(
+            phone_key=row['phone_key'], marked_by=row['marked_by']
+        ).exclude(id=row['first_id']).delete()
+        affected_keys.add(row['phone_key'])
+
+    aggregates = (
+        ReportedUserSpam.objects.filter(phone_key__in=affected_keys)
+        .values('phone_key')
+        .annotate(
+            report_count=Count('id'),
+            distinct_reporters=Count('marked_by', distinct=True),
+            first_reported_at=Min('created_at'),
+            last_reported_at=Max('created_at'),
+        )
+        .order_by()
+    )
+    for row in aggregates:
+        PhoneSpamStats.objects.filter(phone_key=row.pop('phone_key')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_contactsyncstate'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_spam_reports, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_deduplicate_spam_reports'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reporteduserspam',
+            name='users_repor_phone_k_140cea_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='reporteduserspam',
+            constraint=models.UniqueConstraint(fields=('phone_key', 'marked_by'), name='unique_spam_report_per_user'),
+        ),
+    ]
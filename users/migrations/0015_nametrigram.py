@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_unique_spam_report_per_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NameTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('source', models.CharField(choices=[('user', 'Registered user'), ('contact', 'Contact')], max_length=7)),
+                ('object_id', models.PositiveBigIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['object_id', 'source'], name='users_namet_object__7dd7eb_idx')],
+                'constraints': [models.UniqueConstraint(fields=('trigram', 'source', 'object_id'), name='unique_name_trigram')],
+            },
+        ),
+    ]
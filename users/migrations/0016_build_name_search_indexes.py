@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:41
+
+from django.db import migrations
+
+
+def trigrams(text):
+    text = text.casefold()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def build_name_trigrams(apps, schema_editor):
+    NameTrigram = apps.get_model('users', 'NameTrigram')
+    for source, model_name, field in (
+        ('user', 'CustomUser', 'username'),
+        ('contact', 'RegisteredUserContact', 'contact_name'),
+    ):
+        model = apps.get_model('users', model_name)
+        NameTrigram.objects.bulk_create(
+            (
+                NameTrigram(trigram=gram, source=source, object_id=object_id)
+                for object_id, name in model.objects.values_list('id', field).iterator()
+                for gram in trigrams(name)
+            ),
+            batch_size=5000,
+        )
+
+
+# Django compiles icontains to UPPER("column"::text) LIKE UPPER(...), the
+# expression indexes below let Postgres answer it from pg_trgm
+POSTGRES_TRIGRAM_INDEXES = [
+    ('users_customuser_username_trgm', 'users_customuser', 'username'),
+    ('users_contact_name_trgm', 'users_registeredusercontact', 'contact_name'),
+]
+
+
+def create_postgres_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index_name, table, column in POSTGRES_TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} ON {table} '
+            f'USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_postgres_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name, table, column in POSTGRES_TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_nametrigram'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_name_trigrams, migrations.RunPython.noop),
+        migrations.RunPython(create_postgres_trigram_indexes, drop_postgres_trigram_indexes),
+    ]
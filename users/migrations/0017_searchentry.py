@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_build_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('user', 'Registered user'), ('contact', 'Contact')], max_length=7)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('phone_number', models.CharField(max_length=16)),
+                ('phone_key', models.BigIntegerField(blank=True, db_index=True, null=True)),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('spam_score', models.FloatField(default=0.0)),
+            ],
+            options={
+                'verbose_name_plural': 'search entries',
+                'constraints': [models.UniqueConstraint(fields=('source', 'object_id'), name='unique_search_entry_source')],
+            },
+        ),
+        # The trigram postings now point at search entries, the old postings
+        # are dropped and rebuilt by the next migration
+        migrations.DeleteModel(
+            name='NameTrigram',
+        ),
+        migrations.CreateModel(
+            name='NameTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='users.searchentry')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('trigram', 'entry'), name='unique_name_trigram')],
+            },
+        ),
+    ]
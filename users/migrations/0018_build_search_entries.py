@@ -0,0 +1,88 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:11
+
+from django.db import migrations
+
+
+def trigrams(text):
+    text = text.casefold()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def build_search_entries(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    RegisteredUserContact = apps.get_model('users', 'RegisteredUserContact')
+    PhoneSpamStats = apps.get_model('users', 'PhoneSpamStats')
+    SearchEntry = apps.get_model('users', 'SearchEntry')
+    NameTrigram = apps.get_model('users', 'NameTrigram')
+
+    spam_scores = {
+        key: round(min(1.0, report_count / 10), 2)
+        for key, report_count in PhoneSpamStats.objects.values_list('phone_key', 'report_count')
+    }
+    SearchEntry.objects.bulk_create(
+        (
+            SearchEntry(
+                source='user', object_id=user.id, name=user.username, phone_number=user.phone_number,
+                phone_key=user.phone_key, email=user.email, spam_score=spam_scores.get(user.phone_key, 0.0),
+            )
+            for user in CustomUser.objects.iterator()
+        ),
+        batch_size=5000,
+    )
+    SearchEntry.objects.bulk_create(
+        (
+            SearchEntry(
+                source='contact', object_id=contact.id, name=contact.contact_name,
+                phone_number=contact.phone_number, phone_key=contact.phone_key,
+                spam_score=spam_scores.get(contact.phone_key, 0.0),
+            )
+            for contact in RegisteredUserContact.objects.iterator()
+        ),
+        batch_size=5000,
+    )
+    NameTrigram.objects.bulk_create(
+        (
+            NameTrigram(trigram=gram, entry_id=entry_id)
+            for entry_id, name in SearchEntry.objects.values_list('id', 'name').iterator()
+            for gram in trigrams(name)
+        ),
+        batch_size=5000,
+    )
+
+
+def swap_postgres_trigram_indexes(apps, schema_editor):
+    # Name search now reads SearchEntry, move the pg_trgm index there
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS users_customuser_username_trgm')
+    schema_editor.execute('DROP INDEX IF EXISTS users_contact_name_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS users_searchentry_name_trgm ON users_searchentry '
+        'USING gin (UPPER(name::text) gin_trgm_ops)'
+    )
+
+
+def restore_postgres_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS users_searchentry_name_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS users_customuser_username_trgm ON users_customuser '
+        'USING gin (UPPER(username::text) gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS users_contact_name_trgm ON users_registeredusercontact '
+        'USING gin (UPPER(contact_name::text) gin_trgm_ops)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_searchentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_search_entries, migrations.RunPython.noop),
+        migrations.RunPython(swap_postgres_trigram_indexes, restore_postgres_trigram_indexes),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:02
+
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Frozen copy of the users.scoring functions as of this migration
+SCORE_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def report_score(reported_at, weight):
+    half_life = settings.SPAM_SCORE_HALF_LIFE_DAYS * 86400
+    return weight * 2 ** ((reported_at - SCORE_EPOCH).total_seconds() / half_life)
+
+
+def reporter_weight(report_count):
+    quota = settings.SPAM_REPORTER_QUOTA
+    if report_count <= quota:
+        return 1.0
+    return (quota / report_count) ** 0.5
+
+
+def epoch_scores(reports, reporter_counts):
+    scores = {}
+    for key, reporter_id, reported_at in reports:
+        weight = reporter_weight(reporter_counts.get(reporter_id, 1))
+        scores[key] = scores.get(key, 0.0) + report_score(reported_at, weight)
+    return scores
+
+
+def compute_epoch_scores(apps, schema_editor):
+    PhoneSpamStats = apps.get_model('users', 'PhoneSpamStats')
+    ReportedUserSpam = apps.get_model('users', 'ReportedUserSpam')
+    SearchEntry = apps.get_model('users', 'SearchEntry')
+
+    reporter_counts = dict(
+        ReportedUserSpam.objects.values('marked_by').annotate(reports=Count('id'))
+                                .values_list('marked_by', 'reports').order_by()
+    )
+    scores = epoch_scores(
+        ReportedUserSpam.objects.filter(phone_key__isnull=False)
+                                .values_list('phone_key', 'marked_by', 'created_at').iterator(),
+        reporter_counts,
+    )
+    stats = list(PhoneSpamStats.objects.all())
+    for row in stats:
+        row.epoch_score = scores.get(row.phone_key, 0.0)
+    PhoneSpamStats.objects.bulk_update(stats, ['epoch_score'], batch_size=1000)
+
+    entries = list(SearchEntry.objects.filter(phone_key__in=list(scores)))
+    for entry in entries:
+        entry.epoch_score = scores[entry.phone_key]
+    SearchEntry.objects.bulk_update(entries, ['epoch_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0018_build_search_entries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='phonespamstats',
+            name='epoch_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RenameField(
+            model_name='searchentry',
+            old_name='spam_score',
+            new_name='epoch_score',
+        ),
+        migrations.RunPython(compute_epoch_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:11
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Frozen copies of users.caller_id.top_contact_names and summaries as of this
+# migration, working on the historical models
+def top_contact_names(rows):
+    names = {}
+    for key, name, saves in rows:
+        top_name, total = names.get(key, (name, 0))
+        names[key] = (top_name, total + saves)
+    return names
+
+
+def summaries(model, phone_keys, usernames, contact_names, spam_scores):
+    rows = []
+    for key in phone_keys:
+        top_name, saves = contact_names.get(key, (None, 0))
+        username, score = usernames.get(key), spam_scores.get(key, 0.0)
+        if username is None and top_name is None and not score:
+            continue
+        rows.append(model(
+            phone_key=key, phone_number=f"+{key}", username=username,
+            top_contact_name=top_name, contact_count=saves, epoch_score=score,
+        ))
+    return rows
+
+
+def build_summaries(apps, schema_editor):
+    CallerIdSummary = apps.get_model('users', 'CallerIdSummary')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    PhoneSpamStats = apps.get_model('users', 'PhoneSpamStats')
+    RegisteredUserContact = apps.get_model('users', 'RegisteredUserContact')
+
+    usernames = dict(CustomUser.objects.filter(phone_key__isnull=False).values_list('phone_key', 'username'))
+    contact_names = top_contact_names(
+        RegisteredUserContact.objects.filter(phone_key__isnull=False)
+                                     .values('phone_key', 'contact_name')
+                                     .annotate(saves=Count('id'))
+                                     .order_by('phone_key', '-saves', 'contact_name')
+                                     .values_list('phone_key', 'contact_name', 'saves')
+                                     .iterator()
+    )
+    spam_scores = dict(PhoneSpamStats.objects.filter(epoch_score__gt=0).values_list('phone_key', 'epoch_score'))
+    CallerIdSummary.objects.bulk_create(
+        summaries(
+            CallerIdSummary, usernames.keys() | contact_names.keys() | spam_scores.keys(),
+            usernames, contact_names, spam_scores,
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0019_epoch_spam_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallerIdSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_key', models.BigIntegerField(unique=True)),
+                ('phone_number', models.CharField(max_length=16)),
+                ('username', models.CharField(blank=True, max_length=150, null=True)),
+                ('top_contact_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('contact_count', models.PositiveIntegerField(default=0)),
+                ('epoch_score', models.FloatField(default=0.0)),
+            ],
+            options={
+                'verbose_name_plural': 'caller id summaries',
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+# Frozen copies of ContactNameVote.name_key_for and ContactNameVote.tally as
+# of this migration
+def name_key_for(contact_name):
+    return ' '.join(contact_name.split()).casefold()
+
+
+def tally(contacts):
+    current_key, names = None, {}
+    for key, name in contacts:
+        if key != current_key:
+            yield from ((current_key, name_key, *vote) for name_key, vote in names.items())
+            current_key, names = key, {}
+        vote = names.setdefault(name_key_for(name), [name, 0])
+        vote[1] += 1
+    yield from ((current_key, name_key, *vote) for name_key, vote in names.items())
+
+
+def count_votes(apps, schema_editor):
+    ContactNameVote = apps.get_model('users', 'ContactNameVote')
+    RegisteredUserContact = apps.get_model('users', 'RegisteredUserContact')
+
+    contacts = (
+        RegisteredUserContact.objects.filter(phone_key__isnull=False)
+                                     .order_by('phone_key', 'id')
+                                     .values_list('phone_key', 'contact_name')
+                                     .iterator()
+    )
+    ContactNameVote.objects.bulk_create(
+        (
+            ContactNameVote(phone_key=key, name_key=name_key, name=name, votes=votes)
+            for key, name_key, name, votes in tally(contacts)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0020_caller_id_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactNameVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_key', models.BigIntegerField()),
+                ('name_key', models.CharField(max_length=255)),
+                ('name', models.CharField(max_length=255)),
+                ('votes', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['phone_key', '-votes', 'name_key'], name='contact_name_vote_rank')],
+                'constraints': [models.UniqueConstraint(fields=('phone_key', 'name_key'), name='unique_contact_name_vote')],
+            },
+        ),
+        migrations.RunPython(count_votes, migrations.RunPython.noop),
+    ]
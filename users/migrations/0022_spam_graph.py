@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_contact_name_votes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpamGraphChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_key', models.BigIntegerField(unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='phonespamstats',
+            name='graph_epoch_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='phonespamstats',
+            name='graph_score',
+            field=models.FloatField(default=0.0),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-18 23:02
+
+import unicodedata
+from django.db import migrations, models
+
+
+# Frozen copy of SPAM_NAME_LEXICON and of the whole word matching of
+# users.lexicon as of this migration, a plain search instead of the automaton
+LEXICON = [
+    'spam', 'spammer', 'fraud', 'scam', 'scammer', 'fake', 'telemarketer', 'telemarketing', 'robocall',
+    'do not pick', 'dont pick', "don't pick", 'do not answer', 'dont answer', "don't answer",
+    'फ्रॉड', 'धोखा', 'धोखेबाज', 'स्पैम', 'फर्जी', 'मत उठाना', 'mat uthana', 'mat uthao', 'farzi', 'dhokha',
+    'estafa', 'fraude', 'golpe', 'arnaque', 'no contestar', 'não atender',
+]
+TERMS = {' '.join(term.split()).casefold() for term in LEXICON}
+
+
+def is_word_char(char):
+    return char.isalnum() or unicodedata.category(char).startswith('M')
+
+
+def is_negative(name_key):
+    for term in TERMS:
+        start = name_key.find(term)
+        while start != -1:
+            end = start + len(term)
+            if (start == 0 or not is_word_char(name_key[start - 1])) and \
+                    (end == len(name_key) or not is_word_char(name_key[end])):
+                return True
+            start = name_key.find(term, start + 1)
+    return False
+
+
+def count_negative_labels(apps, schema_editor):
+    ContactNameVote = apps.get_model('users', 'ContactNameVote')
+    PhoneSpamStats = apps.get_model('users', 'PhoneSpamStats')
+    counts = {}
+    for key, name_key, votes in ContactNameVote.objects.values_list('phone_key', 'name_key', 'votes').iterator():
+        if votes and is_negative(name_key):
+            counts[key] = counts.get(key, 0) + votes
+    PhoneSpamStats.objects.bulk_create(
+        [PhoneSpamStats(phone_key=key, phone_number=f"+{key}", negative_labels=count) for key, count in counts.items() if count],
+        update_conflicts=True,
+        unique_fields=['phone_key'],
+        update_fields=['negative_labels'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0022_spam_graph'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='phonespamstats',
+            name='negative_labels',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_negative_labels, migrations.RunPython.noop),
+    ]
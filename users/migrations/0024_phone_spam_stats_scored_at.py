@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-19 09:12
+
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils import timezone
+
+
+def stamp_scored_numbers(apps, schema_editor):
+    PhoneSpamStats = apps.get_model('users', 'PhoneSpamStats')
+    PhoneSpamStats.objects.filter(Q(report_count__gt=0) | Q(graph_epoch_score__gt=0)).update(scored_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0023_negative_labels'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='phonespamstats',
+            name='scored_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(stamp_scored_numbers, migrations.RunPython.noop),
+    ]
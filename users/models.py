@@ -1,14 +1,36 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import AbstractUser
+from django.core import signing
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
+from users import bloom, lexicon, scoring
+from users.phone import key_to_phone_number, phone_key_or_none
+
+
+##############################################################################
+# Stores phone_number in E.164 form and keeps the numeric phone_key in sync
+# bulk_create/update bypass save(), callers of those must set phone_key
+##############################################################################
+class PhoneKeyMixin:
+    def save(self, *args, **kwargs):
+        self.phone_key = phone_key_or_none(self.phone_number)
+        if self.phone_key is not None:
+            self.phone_number = key_to_phone_number(self.phone_key)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_key'}
+        super().save(*args, **kwargs)
 
 
 ##############################################################################
 # CustomUser model that extends the AbstractUser
 # Adds phone_number field as unique identifier along with an optional 'email'
 ##############################################################################
-class CustomUser(AbstractUser):
-    phone_number = models.CharField(max_length=15, unique=True)
+class CustomUser(PhoneKeyMixin, AbstractUser):
+    phone_number = models.CharField(max_length=16, unique=True)
+    phone_key = models.BigIntegerField(unique=True, blank=True, null=True, editable=False)
     email = models.EmailField(blank=True, null=True) # optional field
 
     REQUIRED_FIELDS = ['phone_number'] 
@@ -22,13 +44,20 @@ class CustomUser(AbstractUser):
 # RegisteredUserContact model that links a registered user to their contacts
 # Stores information about contacts including contact name, phone number, and email
 ###################################################################################
-class RegisteredUserContact(models.Model):
+class RegisteredUserContact(PhoneKeyMixin, models.Model):
     id = models.AutoField(primary_key=True)
     contact_name = models.CharField(max_length=255)
-    phone_number = models.CharField(max_length=15)
+    phone_number = models.CharField(max_length=16)
+    phone_key = models.BigIntegerField(db_index=True, blank=True, null=True, editable=False)
     email = models.EmailField(blank=True, null=True) # optional
     contact_of = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Contact membership checks of the searching user
+            models.Index(fields=['contact_of', 'phone_key']),
+        ]
+
     def __str__(self):
         return f"{self.contact_name} - {self.phone_number}"    
 
@@ -37,12 +66,426 @@ class RegisteredUserContact(models.Model):
 # ReportedUserSpam model to track phone numbers marked as spam by users
 # Stores the phone number and the user who reported phonenumber as spam
 ########################################################################
-class ReportedUserSpam(models.Model):
+class ReportedUserSpam(PhoneKeyMixin, models.Model):
     id = models.AutoField(primary_key=True)
-    phone_number = models.CharField(max_length=15)
+    phone_number = models.CharField(max_length=16)
+    phone_key = models.BigIntegerField(db_index=True, blank=True, null=True, editable=False)
     marked_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # A user can report a number only once, also under concurrent requests
+            models.UniqueConstraint(fields=['phone_key', 'marked_by'], name='unique_spam_report_per_user'),
+        ]
+
     def __str__(self):
         return f"{self.phone_number} marked as spam by {self.marked_by.username}"
     
+
+
+##############################################################################
+# ContactSyncState model tracking the phone book sync version of each user
+# The version is handed to clients as a signed sync token; a delta sync is
+# only accepted when the client's token matches the current version
+##############################################################################
+class ContactSyncState(models.Model):
+    TOKEN_SALT = 'users.contact-sync'
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='contact_sync_state')
+    version = models.PositiveIntegerField(default=0)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user} contacts synced at version {self.version}"
+
+    @property
+    def sync_token(self):
+        return signing.dumps({'user': self.user_id, 'version': self.version}, salt=self.TOKEN_SALT)
+
+    def matches_token(self, token):
+        try:
+            payload = signing.loads(token, salt=self.TOKEN_SALT)
+        except signing.BadSignature:
+            return False
+        return payload == {'user': self.user_id, 'version': self.version}
+
+
+##############################################################################
+# SearchEntry model, the precomputed table behind name search
+# One row per registered user and per saved contact with everything a search
+# result needs (name, normalized number, spam score), kept up to date by
+# signals on CustomUser and RegisteredUserContact and by spam reports
+##############################################################################
+class SearchEntry(models.Model):
+    SOURCE_CHOICES = [
+        ('user', 'Registered user'),
+        ('contact', 'Contact'),
+    ]
+
+    source = models.CharField(max_length=7, choices=SOURCE_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    name = models.CharField(max_length=255)
+    phone_number = models.CharField(max_length=16)
+    phone_key = models.BigIntegerField(db_index=True, blank=True, null=True)
+    # Only set for registered users, shown to viewers who saved their number
+    email = models.EmailField(blank=True, null=True)
+    # Copy of PhoneSpamStats.epoch_score, turned into a likelihood when read
+    epoch_score = models.FloatField(default=0.0)
+
+    class Meta:
+        verbose_name_plural = 'search entries'
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'object_id'], name='unique_search_entry_source'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} - {self.phone_number} ({self.source})"
+
+
+##############################################################################
+# NameTrigram model, the inverted index of the trigram search backend
+# One row per distinct trigram of a search entry name
+##############################################################################
+class NameTrigram(models.Model):
+    trigram = models.CharField(max_length=3)
+    entry = models.ForeignKey(SearchEntry, on_delete=models.CASCADE, related_name='trigrams')
+
+    class Meta:
+        constraints = [
+            # Also the covering index used to look up the postings of a trigram
+            models.UniqueConstraint(fields=['trigram', 'entry'], name='unique_name_trigram'),
+        ]
+
+    def __str__(self):
+        return f"'{self.trigram}' in {self.entry_id}"
+
+
+##############################################################################
+# PhoneSpamStats model holding a maintained spam aggregate per phone number
+# Updated together with every ReportedUserSpam insert so searches can read
+# the report count and the decayed spam score (see users/scoring.py) with one
+# indexed lookup instead of a COUNT(*) per result
+##############################################################################
+class PhoneSpamStats(models.Model):
+    phone_key = models.BigIntegerField(unique=True)
+    phone_number = models.CharField(max_length=16)
+    report_count = models.PositiveIntegerField(default=0)
+    distinct_reporters = models.PositiveIntegerField(default=0)
+    # Sum of the report weights scaled to scoring.SCORE_EPOCH, plus graph_epoch_score
+    epoch_score = models.FloatField(default=0.0)
+    # Likelihood propagated over the contact graph and the part of epoch_score
+    # it adds beyond the reports, written by users/graph.py
+    graph_score = models.FloatField(default=0.0)
+    graph_epoch_score = models.FloatField(default=0.0)
+    # Contacts saving this number under a name of SPAM_NAME_LEXICON, kept up
+    # to date by ContactNameVote.apply()
+    negative_labels = models.IntegerField(default=0)
+    first_reported_at = models.DateTimeField(blank=True, null=True)
+    last_reported_at = models.DateTimeField(blank=True, null=True)
+    # Last time reports or the contact graph set the score, workers add the
+    # numbers scored since their last look to their Bloom filter
+    scored_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'phone spam stats'
+
+    def __str__(self):
+        return f"{self.phone_number} reported {self.report_count} times"
+
+    @property
+    def spam_likelihood(self):
+        return scoring.likelihood(self.epoch_score)
+
+    @classmethod
+    def record_report(cls, spam):
+        # Must run inside the transaction that inserted 'spam' so the
+        # aggregate never drifts from the ReportedUserSpam table. The weight
+        # uses the reporter's count at report time, recompute_spam_scores
+        # reweights older reports of reporters that became prolific later
+        reporter_reports = ReportedUserSpam.objects.filter(marked_by_id=spam.marked_by_id).count()
+        score = scoring.report_score(spam.created_at, scoring.reporter_weight(reporter_reports))
+        stats, created = cls.objects.select_for_update().get_or_create(
+            phone_key=spam.phone_key,
+            defaults={
+                'phone_number': spam.phone_number,
+                'report_count': 1,
+                'distinct_reporters': 1,
+                'epoch_score': score,
+                'first_reported_at': spam.created_at,
+                'last_reported_at': spam.created_at,
+                'scored_at': timezone.now(),
+            }
+        )
+        if not created:
+            # Each user can report a number only once, so every new report
+            # is also a new distinct reporter
+            cls.objects.filter(pk=stats.pk).update(
+                report_count=models.F('report_count') + 1,
+                distinct_reporters=models.F('distinct_reporters') + 1,
+                epoch_score=models.F('epoch_score') + score,
+                # Rows created by the contact graph or the negative labels
+                # get their first report here
+                first_reported_at=Coalesce('first_reported_at', models.Value(spam.created_at)),
+                last_reported_at=spam.created_at,
+                scored_at=timezone.now(),
+            )
+        SpamGraphChange.mark([spam.phone_key])
+        # Set before the commit, until then the filter can only err towards a query
+        bloom.add_reported([spam.phone_key])
+
+    @classmethod
+    def refresh_for(cls, phone_keys):
+        # Recompute the counters of these numbers from ReportedUserSpam, used
+        # by bulk inserts where it is unknown which rows were actually new
+        phone_keys = set(phone_keys)
+        aggregates = (
+            ReportedUserSpam.objects.filter(phone_key__in=phone_keys)
+            .values('phone_key')
+            .annotate(
+                phone_number=models.Max('phone_number'),
+                report_count=models.Count('id'),
+                distinct_reporters=models.Count('marked_by', distinct=True),
+                first_reported_at=models.Min('created_at'),
+                last_reported_at=models.Max('created_at'),
+            )
+            .order_by()
+        )
+        reports = list(
+            ReportedUserSpam.objects.filter(phone_key__in=phone_keys)
+                                    .values_list('phone_key', 'marked_by', 'created_at')
+        )
+        reporter_counts = dict(
+            ReportedUserSpam.objects.filter(marked_by__in={reporter for _, reporter, _ in reports})
+                                    .values('marked_by')
+                                    .annotate(reports=models.Count('id'))
+                                    .values_list('marked_by', 'reports')
+                                    .order_by()
+        )
+        scores = scoring.epoch_scores(reports, reporter_counts)
+        # The graph part of the score is kept, it is not derived from the reports
+        graph_scores = dict(cls.objects.filter(phone_key__in=phone_keys).values_list('phone_key', 'graph_epoch_score'))
+        now = timezone.now()
+        cls.objects.bulk_create(
+            [
+                cls(epoch_score=scores.get(row['phone_key'], 0.0) + graph_scores.get(row['phone_key'], 0.0), scored_at=now, **row)
+                for row in aggregates
+            ],
+            update_conflicts=True,
+            unique_fields=['phone_key'],
+            update_fields=[
+                'phone_number', 'report_count', 'distinct_reporters', 'epoch_score',
+                'first_reported_at', 'last_reported_at', 'scored_at',
+            ],
+        )
+        SpamGraphChange.mark(scores)
+        bloom.add_reported(list(scores))
+
+    @classmethod
+    def add_negative_labels(cls, deltas):
+        # 'deltas' maps phone_key to a change in negative labels, applied with
+        # F() like the name votes so concurrent contact writes add up
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        cls.objects.bulk_create(
+            [cls(phone_key=key, phone_number=key_to_phone_number(key)) for key, delta in deltas.items() if delta > 0],
+            ignore_conflicts=True,
+        )
+        by_delta = {}
+        for key, delta in deltas.items():
+            by_delta.setdefault(delta, []).append(key)
+        for delta, keys in by_delta.items():
+            cls.objects.filter(phone_key__in=keys).update(negative_labels=models.F('negative_labels') + delta)
+
+    @classmethod
+    def recount_negative_labels(cls, batch_size=5000):
+        # Recounts every number from the name votes, after bulk imports
+        counts = lexicon.negative_label_counts(
+            ContactNameVote.objects.values_list('phone_key', 'name_key', 'votes').iterator(chunk_size=batch_size)
+        )
+        cls.objects.exclude(negative_labels=0).update(negative_labels=0)
+        cls.objects.bulk_create(
+            [cls(phone_key=key, phone_number=key_to_phone_number(key), negative_labels=count) for key, count in counts.items()],
+            update_conflicts=True, unique_fields=['phone_key'], update_fields=['negative_labels'], batch_size=batch_size,
+        )
+        return len(counts)
+
+    @classmethod
+    def scored(cls):
+        # Numbers with reports or a score from the contact graph
+        return cls.objects.filter(models.Q(report_count__gt=0) | models.Q(graph_epoch_score__gt=0))
+
+    @classmethod
+    def epoch_scores_for(cls, phone_keys):
+        # One bulk IN query for a whole page of results, numbers the Bloom
+        # filter has never seen are left out and a page of only such numbers
+        # runs no query at all
+        reported = bloom.might_be_reported(set(phone_keys))
+        if not reported:
+            return {}
+        return dict(
+            cls.objects.filter(phone_key__in=reported)
+                       .values_list('phone_key', 'epoch_score')
+        )
+
+    @classmethod
+    def likelihoods_for(cls, phone_keys):
+        phone_keys = list(phone_keys)
+        scores = cls.epoch_scores_for(phone_keys)
+        return dict(zip(phone_keys, scoring.likelihoods([scores.get(key, 0.0) for key in phone_keys])))
+
+    @classmethod
+    async def alikelihoods_for(cls, phone_keys):
+        phone_keys = list(phone_keys)
+        # Opening the filter queries the database, it happens once per worker
+        reported_numbers = bloom.loaded_reported_numbers()
+        if reported_numbers is None and settings.SPAM_BLOOM_PATH:
+            reported_numbers = await sync_to_async(bloom.reported_numbers)()
+        reported = bloom.might_be_reported(set(phone_keys), reported_numbers)
+        scores = {}
+        if reported:
+            scores = {
+                key: score
+                async for key, score in cls.objects.filter(phone_key__in=reported)
+                                                   .values_list('phone_key', 'epoch_score')
+            }
+        return dict(zip(phone_keys, scoring.likelihoods([scores.get(key, 0.0) for key in phone_keys])))
+
+
+##############################################################################
+# ContactNameVote model, how many people saved a number under each name
+# Every saved contact is one vote for its contact_name, counted by a
+# casefolded key so "Raj Plumber" and "raj  plumber" add up. Maintained
+# incrementally on contact writes, so the top names of a number saved by
+# thousands of people are one indexed read instead of a scan of its contacts
+##############################################################################
+class ContactNameVote(models.Model):
+    phone_key = models.BigIntegerField()
+    name_key = models.CharField(max_length=255)
+    # Spelling of the first contact that voted for this name
+    name = models.CharField(max_length=255)
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['phone_key', 'name_key'], name='unique_contact_name_vote'),
+        ]
+        indexes = [
+            # Top names of a number in vote order
+            models.Index(fields=['phone_key', '-votes', 'name_key'], name='contact_name_vote_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} for {self.phone_key} ({self.votes} votes)"
+
+    @staticmethod
+    def name_key_for(contact_name):
+        return lexicon.normalize(contact_name)
+
+    @classmethod
+    def ranked(cls, phone_keys):
+        return cls.objects.filter(phone_key__in=phone_keys).order_by('phone_key', '-votes', 'name_key')
+
+    @classmethod
+    def apply(cls, deltas):
+        # 'deltas' maps (phone_key, contact_name) to a change in votes. Rows are
+        # created empty first and then incremented with F(), so concurrent
+        # writers never lose a vote. Run it in the transaction of the contact write
+        merged = {}
+        for (key, name), delta in deltas.items():
+            if key is not None:
+                spelling, total = merged.get((key, cls.name_key_for(name)), (name, 0))
+                merged[key, cls.name_key_for(name)] = (spelling, total + delta)
+        deltas = {pair: change for pair, change in merged.items() if change[1]}
+        if not deltas:
+            return
+        PhoneSpamStats.add_negative_labels(
+            lexicon.negative_label_counts((key, name_key, delta) for (key, name_key), (_, delta) in deltas.items())
+        )
+        cls.objects.bulk_create(
+            [cls(phone_key=key, name_key=name_key, name=name) for (key, name_key), (name, delta) in deltas.items() if delta > 0],
+            ignore_conflicts=True,
+        )
+        by_delta = {}
+        rows = cls.objects.filter(
+            phone_key__in={key for key, _ in deltas}, name_key__in={name_key for _, name_key in deltas}
+        ).values_list('id', 'phone_key', 'name_key')
+        for row_id, key, name_key in rows:
+            if (key, name_key) in deltas:
+                by_delta.setdefault(deltas[key, name_key][1], []).append(row_id)
+        for delta, row_ids in by_delta.items():
+            cls.objects.filter(id__in=row_ids).update(votes=models.F('votes') + delta)
+        # Names nobody uses for the number any more
+        cls.objects.filter(id__in=[row_id for row_ids in by_delta.values() for row_id in row_ids], votes__lte=0).delete()
+        SpamGraphChange.mark(key for key, _ in deltas)
+
+    @classmethod
+    def tally(cls, contacts):
+        # Votes of (phone_key, contact_name) rows ordered by phone_key, yields
+        # (phone_key, name_key, first spelling, votes) one number at a time
+        current_key, names = None, {}
+        for key, name in contacts:
+            if key != current_key:
+                yield from ((current_key, name_key, *vote) for name_key, vote in names.items())
+                current_key, names = key, {}
+            vote = names.setdefault(cls.name_key_for(name), [name, 0])
+            vote[1] += 1
+        yield from ((current_key, name_key, *vote) for name_key, vote in names.items())
+
+    @classmethod
+    def top_names(cls, phone_key, count=None):
+        rows = cls.ranked([phone_key]).values_list('name', 'votes')[:count or settings.CONTACT_TOP_NAMES]
+        return [{"name": name, "count": votes} for name, votes in rows]
+
+    @classmethod
+    async def atop_names(cls, phone_key, count=None):
+        rows = cls.ranked([phone_key]).values_list('name', 'votes')[:count or settings.CONTACT_TOP_NAMES]
+        return [{"name": name, "count": votes} async for name, votes in rows]
+
+
+##############################################################################
+# SpamGraphChange model, numbers whose contacts, contact names or reports
+# changed since the last run of propagate_spam_scores. The job rescores the
+# contact graph around them and deletes the rows it handled
+##############################################################################
+class SpamGraphChange(models.Model):
+    phone_key = models.BigIntegerField(unique=True)
+
+    def __str__(self):
+        return f"{self.phone_key} changed"
+
+    @classmethod
+    def mark(cls, phone_keys):
+        cls.objects.bulk_create(
+            [cls(phone_key=key) for key in set(phone_keys) if key is not None], ignore_conflicts=True
+        )
+
+
+##############################################################################
+# CallerIdSummary model, the precomputed answer of the caller-ID endpoint
+# One row per number that has a registered user, a saved contact or a spam
+# report, so identifying an incoming call is one unique index lookup.
+# Maintained by users/caller_id.py from the signals and the spam writes
+##############################################################################
+class CallerIdSummary(models.Model):
+    phone_key = models.BigIntegerField(unique=True)
+    phone_number = models.CharField(max_length=16)
+    # Username of the registered user with this number
+    username = models.CharField(max_length=150, blank=True, null=True)
+    # contact_name most people saved this number under, ties go to the lowest name
+    top_contact_name = models.CharField(max_length=255, blank=True, null=True)
+    contact_count = models.PositiveIntegerField(default=0)
+    # Copy of PhoneSpamStats.epoch_score, turned into a likelihood when read
+    epoch_score = models.FloatField(default=0.0)
+
+    class Meta:
+        verbose_name_plural = 'caller id summaries'
+
+    def __str__(self):
+        return f"{self.phone_number} - {self.name}"
+
+    @property
+    def name(self):
+        # A registered user named themselves, otherwise the crowd's choice
+        return self.username or self.top_contact_name
@@ -0,0 +1,97 @@
+import math
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+
+##############################################################################
+# Keyset (cursor) pagination for the search endpoints
+# A cursor holds the (rank, id) of the last row of the previous page, so the
+# next page is an indexed range scan that costs the same at any depth, and no
+# COUNT(*) is run unless the client explicitly asks for the total.
+##############################################################################
+
+CURSOR_SALT = 'users.search-cursor'
+TOTAL_ESTIMATE_TIMEOUT = 300
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(rank, last_id):
+    return signing.dumps([rank, last_id], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    try:
+        rank, last_id = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidCursor("'cursor' is invalid.")
+    return rank, last_id
+
+
+def _after_cursor(queryset, cursor, rank_field):
+    if cursor:
+        rank, last_id = decode_cursor(cursor)
+        if rank_field is None:
+            queryset = queryset.filter(id__gt=last_id)
+        else:
+            queryset = queryset.filter(
+                Q(**{f"{rank_field}__gt": rank}) | Q(**{rank_field: rank, "id__gt": last_id})
+            )
+    return queryset
+
+
+def _split_page(rows, result_size, rank_field):
+    next_cursor = None
+    if len(rows) > result_size:
+        rows = rows[:result_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, rank_field) if rank_field else 0, last.id)
+    return rows, next_cursor
+
+
+def keyset_page(queryset, cursor, result_size, rank_field=None):
+    # 'queryset' must be ordered by (rank_field, id), or by id without a rank.
+    # One extra row tells whether there is a next page without counting
+    queryset = _after_cursor(queryset, cursor, rank_field)
+    return _split_page(list(queryset[:result_size + 1]), result_size, rank_field)
+
+
+async def akeyset_page(queryset, cursor, result_size, rank_field=None):
+    queryset = _after_cursor(queryset, cursor, rank_field)
+    return _split_page([row async for row in queryset[:result_size + 1]], result_size, rank_field)
+
+
+async def anumbered_page(queryset, page_number, result_size):
+    # Same page selection as Paginator.get_page(), which has no async API:
+    # invalid numbers give the first page and out of range numbers the last
+    total = await queryset.acount()
+    total_pages = max(1, math.ceil(total / result_size))
+    try:
+        number = int(page_number)
+    except (TypeError, ValueError):
+        number = 1
+    if not 1 <= number <= total_pages:
+        number = total_pages
+    offset = (number - 1) * result_size
+    rows = [row async for row in queryset[offset:offset + result_size]]
+    return rows, {"current_page": number, "total_pages": total_pages, "total_results": total}
+
+
+def estimated_total(key, queryset):
+    # Totals are only an estimate in cursor mode, refreshed every few minutes
+    total = cache.get(key)
+    if total is None:
+        total = queryset.count()
+        cache.set(key, total, timeout=TOTAL_ESTIMATE_TIMEOUT)
+    return total
+
+
+async def aestimated_total(key, queryset):
+    total = await cache.aget(key)
+    if total is None:
+        total = await queryset.acount()
+        await cache.aset(key, total, timeout=TOTAL_ESTIMATE_TIMEOUT)
+    return total
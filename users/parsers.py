@@ -0,0 +1,31 @@
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+################################################################################
+# Parser for newline delimited JSON (one object per line)
+# Returns a generator so large uploads are decoded line by line while the view
+# consumes them, instead of building the whole document in memory first
+################################################################################
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        request = parser_context.get('request')
+        encoding = getattr(request, 'encoding', None) or settings.DEFAULT_CHARSET
+        if stream is None:
+            return iter(())
+        return self.iter_lines(stream, encoding)
+
+    def iter_lines(self, stream, encoding):
+        for line_number, line in enumerate(stream, start=1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                raise ParseError(f"NDJSON parse error on line {line_number} - {exc}")
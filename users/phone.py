@@ -0,0 +1,61 @@
+import re
+from django.conf import settings
+
+
+##############################################################################
+# Phone number normalization
+# Every phone number is stored in E.164 form ('+' followed by up to 15 digits)
+# together with a numeric key (the same digits as a BigInteger) that is used
+# for all indexed lookups, so "+91 98765-43210", "098765 43210" and
+# "9876543210" all resolve to the same row.
+##############################################################################
+
+# Characters people commonly use to format numbers
+SEPARATORS = re.compile(r'[\s\-.()/]')
+MIN_DIGITS = 8
+MAX_DIGITS = 15
+
+
+class InvalidPhoneNumber(ValueError):
+    pass
+
+
+def normalize_phone_number(raw):
+    country_code = settings.PHONE_DEFAULT_COUNTRY_CODE
+    national_length = settings.PHONE_NATIONAL_NUMBER_LENGTH
+
+    number = SEPARATORS.sub('', str(raw))
+    if number.startswith('+'):
+        digits = number[1:]
+    elif number.startswith('00'):
+        # International call prefix
+        digits = number[2:]
+    elif number.startswith('0') and len(number) == national_length + 1:
+        # National trunk prefix
+        digits = country_code + number[1:]
+    elif len(number) == national_length:
+        digits = country_code + number
+    else:
+        digits = number
+
+    if not digits.isdigit():
+        raise InvalidPhoneNumber(f"'{raw}' is not a valid phone number.")
+    if not MIN_DIGITS <= len(digits) <= MAX_DIGITS:
+        raise InvalidPhoneNumber(f"'{raw}' must have between {MIN_DIGITS} and {MAX_DIGITS} digits.")
+    return f"+{digits}"
+
+
+def phone_key(raw):
+    # Country codes never start with 0, so the E.164 digits fit a BigInteger losslessly
+    return int(normalize_phone_number(raw)[1:])
+
+
+def phone_key_or_none(raw):
+    try:
+        return phone_key(raw)
+    except InvalidPhoneNumber:
+        return None
+
+
+def key_to_phone_number(key):
+    return f"+{key}"
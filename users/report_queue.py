@@ -0,0 +1,319 @@
+import itertools
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.utils import timezone as django_timezone
+from users import caller_id, scoring, search_cache, search_index
+from users.models import PhoneSpamStats, ReportedUserSpam
+from users.phone import phone_key_or_none
+
+logger = logging.getLogger(__name__)
+
+
+##############################################################################
+# Write-behind queue of spam reports
+# During robocall waves thousands of users report the same number within
+# seconds and every synchronous report waits for the database write lock.
+# With SPAM_REPORT_QUEUE set, the mark spam views only append the report to
+# a queue and answer 202 with its id, drain_spam_reports inserts the queued
+# reports in batches: one bulk insert and one counter update per number and
+# batch instead of one transaction per report.
+#   'redis'  a Redis stream read through a consumer group, so several
+#            workers share the load and unacknowledged reports of a crashed
+#            worker are delivered again
+#   'local'  an in-process queue drained by a background thread of the same
+#            process, for tests and single process setups. Other processes
+#            cannot see it and reports still queued at exit are lost
+# Until a report is drained, a marker in the cache makes it visible to its
+# reporter (read-your-writes): reporting the number again is rejected, and
+# the search and caller-ID results the reporter gets count the report in
+# the number's spam likelihood.
+##############################################################################
+
+def pending_key(user_id, key):
+    return f"spam_report_pending_{user_id}_{key}"
+
+
+class LocalReportQueue:
+    # Append-only list of entries, read in order until acknowledged. The
+    # first append starts the thread draining it unless SPAM_REPORT_LOCAL_WORKER
+    # is off, tests then drain it with drain_spam_reports --once
+    def __init__(self):
+        self.entries = {}
+        self.sequence = itertools.count(1)
+        self.appended = threading.Condition()
+        self.worker = None
+        self.stopped = False
+
+    def append_many(self, entries):
+        with self.appended:
+            entry_ids = []
+            for fields in entries:
+                entry_id = f"{int(time.time() * 1000)}-{next(self.sequence)}"
+                self.entries[entry_id] = dict(fields)
+                entry_ids.append(entry_id)
+            self.appended.notify_all()
+            if self.worker is None and settings.SPAM_REPORT_LOCAL_WORKER:
+                self.worker = threading.Thread(target=self.work, name='spam-report-drain', daemon=True)
+                self.worker.start()
+        return entry_ids
+
+    def read(self, count, block_ms=0):
+        with self.appended:
+            if not self.entries and block_ms and not self.stopped:
+                self.appended.wait(block_ms / 1000)
+            if self.stopped:
+                return []
+            return list(itertools.islice(self.entries.items(), count))
+
+    def ack(self, entry_ids):
+        with self.appended:
+            for entry_id in entry_ids:
+                self.entries.pop(entry_id, None)
+
+    def stop(self):
+        with self.appended:
+            self.stopped = True
+            self.appended.notify_all()
+
+    def work(self):
+        try:
+            while not self.stopped:
+                try:
+                    drain(settings.SPAM_REPORT_DRAIN_BATCH_SIZE, 1000, queue=self)
+                except Exception:
+                    # The entries stay queued and are retried
+                    logger.exception("Writing queued spam reports failed")
+                    connection.close()
+                    time.sleep(1)
+        finally:
+            connection.close()
+
+
+class RedisStreamReportQueue:
+    # Entries are read through a consumer group: read() first hands out the
+    # entries this worker read but did not acknowledge before a restart, then
+    # claims the ones other workers left pending for SPAM_REPORT_CLAIM_IDLE_MS,
+    # then waits for new ones
+    def __init__(self):
+        self.stream = settings.SPAM_REPORT_STREAM
+        self.group = f"{self.stream}-workers"
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.group_ready = False
+
+    @property
+    def client(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+
+    def append_many(self, entries):
+        pipeline = self.client.pipeline(transaction=False)
+        for fields in entries:
+            pipeline.xadd(self.stream, fields)
+        return [entry_id.decode() for entry_id in pipeline.execute()]
+
+    def read(self, count, block_ms=0):
+        client = self.client
+        if not self.group_ready:
+            try:
+                client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+            except Exception as error:
+                if 'BUSYGROUP' not in str(error):
+                    raise
+            self.group_ready = True
+
+        entries = self.entries(client.xreadgroup(self.group, self.consumer, {self.stream: '0'}, count=count))
+        if not entries:
+            _, claimed, *_ = client.xautoclaim(
+                self.stream, self.group, self.consumer, settings.SPAM_REPORT_CLAIM_IDLE_MS, count=count
+            )
+            entries = self.entries([(self.stream, claimed)])
+        if not entries:
+            entries = self.entries(client.xreadgroup(
+                self.group, self.consumer, {self.stream: '>'}, count=count, block=block_ms or None
+            ))
+        return entries
+
+    def ack(self, entry_ids):
+        if entry_ids:
+            pipeline = self.client.pipeline()
+            pipeline.xack(self.stream, self.group, *entry_ids)
+            pipeline.xdel(self.stream, *entry_ids)
+            pipeline.execute()
+
+    def entries(self, response):
+        return [
+            (entry_id.decode(), self.decode(fields))
+            for _, stream_entries in response or []
+            for entry_id, fields in stream_entries
+            if fields
+        ]
+
+    def decode(self, fields):
+        return {name.decode(): value.decode() for name, value in fields.items()}
+
+
+QUEUES = {
+    'redis': RedisStreamReportQueue,
+    'local': LocalReportQueue,
+}
+_queues = {}
+
+
+def enabled():
+    return bool(settings.SPAM_REPORT_QUEUE)
+
+
+def get_queue():
+    # One queue per worker and configured kind, the local queue is shared
+    # by the views and drain_spam_reports in the same process
+    name = settings.SPAM_REPORT_QUEUE
+    if name not in _queues:
+        _queues[name] = QUEUES[name]()
+    return _queues[name]
+
+
+def reset_queues(setting, **kwargs):
+    # Tests switching the queue settings get a fresh local queue
+    if setting.startswith('SPAM_REPORT_'):
+        for queue in _queues.values():
+            if isinstance(queue, LocalReportQueue):
+                queue.stop()
+        _queues.clear()
+
+
+setting_changed.connect(reset_queues)
+
+
+def enqueue(user, numbers):
+    # Queues reports of {phone_key: phone_number} and returns their ids by
+    # phone_key. The markers are set first, a worker draining a report right
+    # after the append must find its marker to clear it
+    markers = [pending_key(user.id, key) for key in numbers]
+    cache.set_many(dict.fromkeys(markers, django_timezone.now().timestamp()), timeout=settings.SPAM_REPORT_PENDING_TIMEOUT)
+    try:
+        report_ids = get_queue().append_many([
+            {'user_id': str(user.id), 'phone_number': phone_number, 'phone_key': str(key)}
+            for key, phone_number in numbers.items()
+        ])
+    except Exception:
+        cache.delete_many(markers)
+        raise
+    return dict(zip(numbers, report_ids))
+
+
+def pending_keys(user, keys):
+    # The numbers among 'keys' the user reported and that are still queued
+    markers = cache.get_many([pending_key(user.id, key) for key in keys])
+    return {key for key in keys if pending_key(user.id, key) in markers}
+
+
+def scores_from_markers(user, keys, markers):
+    # {phone_key: epoch score} of the user's reports still in the queue,
+    # weighted like a report of an ordinary reporter
+    return {
+        key: scoring.report_score(datetime.fromtimestamp(markers[pending_key(user.id, key)], timezone.utc))
+        for key in keys if pending_key(user.id, key) in markers
+    }
+
+
+def pending_scores(user, keys):
+    if not enabled() or not keys:
+        return {}
+    return scores_from_markers(user, keys, cache.get_many([pending_key(user.id, key) for key in keys]))
+
+
+async def apending_scores(user, keys):
+    if not enabled() or not keys:
+        return {}
+    return scores_from_markers(user, keys, await cache.aget_many([pending_key(user.id, key) for key in keys]))
+
+
+def add_pending(results, scores):
+    # Copies of the result dicts, cached ones are shared, with the queued
+    # reports added to their spam_likelihood. Likelihoods are linear in the
+    # score below saturation, so adding them matches a drained report
+    if not scores:
+        return results
+    overlaid = []
+    for result in results:
+        key = phone_key_or_none(result.get('phone_number') or '')
+        if key in scores and result.get('spam_likelihood') is not None:
+            result = dict(result, spam_likelihood=round(min(1.0, result['spam_likelihood'] + scoring.likelihood(scores[key])), 2))
+        overlaid.append(result)
+    return overlaid
+
+
+def result_keys(results):
+    return {phone_key_or_none(result.get('phone_number') or '') for result in results} - {None}
+
+
+def overlay(user, results):
+    # The search results the user gets, with their queued reports counted
+    if not enabled():
+        return results
+    return add_pending(results, pending_scores(user, result_keys(results)))
+
+
+async def aoverlay(user, results):
+    if not enabled():
+        return results
+    return add_pending(results, await apending_scores(user, result_keys(results)))
+
+
+def clear_pending(entries):
+    cache.delete_many([pending_key(fields['user_id'], fields['phone_key']) for _, fields in entries])
+
+
+def write_reports(entries):
+    # Inserts a batch of queued reports, returns the number of new reports.
+    # Entries delivered again after a crash and reports the user made
+    # meanwhile through the synchronous views are dropped as duplicates
+    reports = {}
+    for _, fields in entries:
+        reports[int(fields['user_id']), int(fields['phone_key'])] = fields['phone_number']
+    keys = {key for _, key in reports}
+    with transaction.atomic():
+        existing = set(
+            ReportedUserSpam.objects.filter(phone_key__in=keys, marked_by__in={user_id for user_id, _ in reports})
+                                    .values_list('marked_by', 'phone_key')
+        )
+        new_reports = [
+            ReportedUserSpam(phone_number=phone_number, phone_key=key, marked_by_id=user_id)
+            for (user_id, key), phone_number in reports.items() if (user_id, key) not in existing
+        ]
+        ReportedUserSpam.objects.bulk_create(new_reports, ignore_conflicts=True)
+        # Rows skipped on conflict are unknown, the reports now in the table
+        # tell which of the batch were inserted
+        inserted = set(
+            ReportedUserSpam.objects.filter(phone_key__in=keys, marked_by__in={user_id for user_id, _ in reports})
+                                    .values_list('marked_by', 'phone_key')
+        ) & {(report.marked_by_id, report.phone_key) for report in new_reports}
+        new_keys = list({key for _, key in inserted})
+        # One recount per number however many reports it got in the batch
+        PhoneSpamStats.refresh_for(new_keys)
+        search_index.update_spam_scores(new_keys)
+        caller_id.refresh(new_keys)
+
+    search_cache.invalidate([search_cache.phone_tag(key) for key in new_keys])
+    clear_pending(entries)
+    return len(inserted)
+
+
+def drain(batch_size, block_ms=0, queue=None):
+    # Writes one batch of the queue, returns (entries read, new reports)
+    queue = queue or get_queue()
+    entries = queue.read(batch_size, block_ms)
+    if not entries:
+        return 0, 0
+    written = write_reports(entries)
+    # Acknowledged after the commit, a crash in between delivers them again
+    queue.ack([entry_id for entry_id, _ in entries])
+    return len(entries), written
@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+from django.conf import settings
+from django.utils import timezone as django_timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+##############################################################################
+# Time-decayed, reporter-weighted spam scores
+# Every report contributes weight * 2 ** (-age / half life). Instead of the
+# decayed value, each number stores its "epoch score": the same sum with every
+# report scaled to SCORE_EPOCH, i.e. weight * 2 ** (reported_at - epoch) / half
+# life. Decay then becomes one common factor, so a new report is a plain
+# F() addition and reading a score at any instant is a single multiplication.
+# Reporters who report unusually many numbers get a smaller weight.
+##############################################################################
+
+# Fixed reference instant of the stored scores, changing it requires
+# recomputing every epoch score
+SCORE_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def half_lives_since_epoch(moment):
+    half_life = settings.SPAM_SCORE_HALF_LIFE_DAYS * 86400
+    return (moment - SCORE_EPOCH).total_seconds() / half_life
+
+
+def reporter_weight(report_count):
+    # Reporters within the quota count fully, beyond it the weight falls with
+    # the square root of how far over the quota they are
+    quota = settings.SPAM_REPORTER_QUOTA
+    if report_count <= quota:
+        return 1.0
+    return (quota / report_count) ** 0.5
+
+
+def report_score(reported_at, weight=1.0):
+    # Contribution of one report to the epoch score of its number
+    return weight * 2 ** half_lives_since_epoch(reported_at)
+
+
+def epoch_scores(reports, reporter_counts):
+    # 'reports' yields (phone_key, reporter id, reported_at) rows and
+    # 'reporter_counts' maps reporter ids to their total number of reports
+    scores = {}
+    for key, reporter_id, reported_at in reports:
+        weight = reporter_weight(reporter_counts.get(reporter_id, 1))
+        scores[key] = scores.get(key, 0.0) + report_score(reported_at, weight)
+    return scores
+
+
+def likelihoods(scores, now=None):
+    # Batch API: the decay factor is computed once for the whole page or
+    # contact list, every score is then a multiplication. Likelihood grows
+    # linearly with the decayed score and saturates at SPAM_SCORE_SATURATION,
+    # so fresh reports from ordinary reporters count like before. The batch
+    # is one NumPy expression, the loop is the fallback without NumPy
+    factor = 2 ** -half_lives_since_epoch(now or django_timezone.now()) / settings.SPAM_SCORE_SATURATION
+    if np is not None:
+        return np.round(np.minimum(np.asarray(scores, dtype=float) * factor, 1.0), 2).tolist()
+    return [round(min(1.0, score * factor), 2) for score in scores]
+
+
+def likelihood(score, now=None):
+    return likelihoods([score], now)[0]
@@ -0,0 +1,130 @@
+from functools import lru_cache
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models import Case, Count, IntegerField, Value, When
+from django.utils.module_loading import import_string
+from users.models import NameTrigram, SearchEntry
+
+
+##############################################################################
+# Pluggable name search backends
+# Every backend narrows a SearchEntry queryset to the rows whose name contains
+# the query and ranks the names that start with it first. They only differ in
+# how the matching rows are found:
+#   ScanSearchBackend             plain icontains scan, no index to maintain
+#   TrigramIndexSearchBackend     in-repo trigram inverted index (NameTrigram)
+#   PostgresTrigramSearchBackend  ILIKE served by pg_trgm GIN indexes
+##############################################################################
+
+def trigrams(text):
+    text = text.casefold()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ScanSearchBackend:
+    # Backends with an index of their own must be told about name changes
+    maintains_index = False
+
+    def search(self, queryset, field, query):
+        return self.rank(self.candidates(queryset, field, query), field, query)
+
+    def candidates(self, queryset, field, query):
+        return queryset.filter(**{f"{field}__icontains": query})
+
+    def rank(self, queryset, field, query):
+        return queryset.annotate(
+            match_rank=Case(
+                When(**{f"{field}__istartswith": query}, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('match_rank', 'id')
+
+    def index(self, names):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class PostgresTrigramSearchBackend(ScanSearchBackend):
+    # Django compiles icontains/istartswith to UPPER(...) LIKE UPPER(...), which
+    # Postgres answers from the gin_trgm_ops indexes created by the migrations
+    pass
+
+
+class TrigramIndexSearchBackend(ScanSearchBackend):
+    maintains_index = True
+    batch_size = 5000
+
+    def candidates(self, queryset, field, query):
+        grams = trigrams(query)
+        if not grams:
+            # Queries shorter than a trigram cannot use the index
+            return super().candidates(queryset, field, query)
+
+        # Entries containing every trigram of the query, verified with icontains
+        # because the trigrams may appear in a different order
+        matching_ids = (
+            NameTrigram.objects.filter(trigram__in=grams)
+            .values('entry')
+            .annotate(hits=Count('trigram'))
+            .filter(hits=len(grams))
+            .values('entry')
+        )
+        return queryset.filter(pk__in=matching_ids, **{f"{field}__icontains": query})
+
+    def index(self, names):
+        # 'names' maps search entry ids to their current name, deleted
+        # entries lose their postings through the foreign key cascade
+        NameTrigram.objects.filter(entry__in=list(names)).delete()
+        self.add(names)
+
+    def rebuild(self):
+        NameTrigram.objects.all().delete()
+        names = {}
+        for entry_id, name in SearchEntry.objects.values_list('id', 'name').iterator(chunk_size=self.batch_size):
+            names[entry_id] = name
+            if len(names) == self.batch_size:
+                self.add(names)
+                names = {}
+        self.add(names)
+
+    def add(self, names):
+        # Insert without clearing existing postings
+        NameTrigram.objects.bulk_create(
+            [
+                NameTrigram(trigram=gram, entry_id=entry_id)
+                for entry_id, name in names.items()
+                for gram in trigrams(name)
+            ],
+            batch_size=self.batch_size,
+        )
+
+
+BACKENDS = {
+    'scan': ScanSearchBackend,
+    'trigram': TrigramIndexSearchBackend,
+    'postgres': PostgresTrigramSearchBackend,
+}
+
+
+@lru_cache(maxsize=None)
+def get_search_backend(name=None):
+    # USER_SEARCH_BACKEND may name a backend above or a dotted class path,
+    # by default Postgres uses pg_trgm and every other database the trigram index
+    name = name or settings.USER_SEARCH_BACKEND
+    if name is None:
+        name = 'postgres' if connection.vendor == 'postgresql' else 'trigram'
+    backend_class = BACKENDS[name] if name in BACKENDS else import_string(name)
+    return backend_class()
+
+
+def reset_search_backend(setting, **kwargs):
+    # Tests overriding the backend or the database get a fresh instance
+    if setting in ('USER_SEARCH_BACKEND', 'DATABASES'):
+        get_search_backend.cache_clear()
+
+
+setting_changed.connect(reset_search_backend)
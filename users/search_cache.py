@@ -0,0 +1,217 @@
+import threading
+import time
+import uuid
+from collections import Counter
+from django.core.cache import cache
+from users import instrumentation
+
+
+##############################################################################
+# Tag-versioned cache for the search endpoints
+# Every cached response is stored together with the versions of the tags it
+# depends on (the phone numbers it contains, the viewer's contact list).
+# Invalidating a tag only replaces its version, so a spam report makes the
+# entries mentioning that number stale without touching any other key.
+# Hit/miss counters are batched per process and flushed every
+# METRICS_FLUSH_INTERVAL seconds, reads don't pay for a shared INCR.
+# The 'a' prefixed functions are the same operations for the async views,
+# they go through the cache backend's async methods.
+##############################################################################
+
+TAG_VERSION_PREFIX = 'search_tag_version'
+METRICS_PREFIX = 'search_cache_metrics'
+METRIC_NAMES = ('hit', 'miss', 'stale', 'invalidation')
+METRICS_FLUSH_INTERVAL = 10
+
+_pending_metrics = Counter()
+_metrics_lock = threading.Lock()
+_metrics_flushed_at = time.monotonic()
+
+
+def phone_tag(phone_number):
+    return f"phone:{phone_number}"
+
+
+def contacts_tag(user_id):
+    return f"contacts:{user_id}"
+
+
+def _version_key(tag):
+    return f"{TAG_VERSION_PREFIX}:{tag}"
+
+
+def _tag_versions(tags):
+    # Missing versions are created with a fresh random value: an evicted
+    # version key is never read as a version, so entries tagged before the
+    # eviction no longer match and an entry is never tagged with None
+    keys = [_version_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            # add() keeps a version a concurrent writer created first
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+        versions.update(cache.get_many(missing))
+    return {tag: versions.get(_version_key(tag)) for tag in tags}
+
+
+def _take_due_metrics():
+    # Events are counted per process and added to the shared counters at
+    # most every METRICS_FLUSH_INTERVAL seconds instead of one INCR per read
+    if time.monotonic() - _metrics_flushed_at < METRICS_FLUSH_INTERVAL:
+        return {}
+    return _take_metrics()
+
+
+def _take_metrics():
+    global _metrics_flushed_at
+    with _metrics_lock:
+        pending = {metric: amount for metric, amount in _pending_metrics.items() if amount}
+        _pending_metrics.clear()
+        _metrics_flushed_at = time.monotonic()
+    return pending
+
+
+def _add_metrics(pending):
+    for metric, amount in pending.items():
+        key = f"{METRICS_PREFIX}:{metric}"
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            # First event for this metric, a concurrent add is harmless
+            if not cache.add(key, amount, timeout=None):
+                cache.incr(key, amount)
+
+
+def _record(metric, amount=1):
+    instrumentation.record_cache(metric)
+    with _metrics_lock:
+        _pending_metrics[metric] += amount
+    _add_metrics(_take_due_metrics())
+
+
+def flush_metrics():
+    _add_metrics(_take_metrics())
+
+
+async def _atag_versions(tags):
+    keys = [_version_key(tag) for tag in tags]
+    versions = await cache.aget_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            await cache.aadd(key, uuid.uuid4().hex, timeout=None)
+        versions.update(await cache.aget_many(missing))
+    return {tag: versions.get(_version_key(tag)) for tag in tags}
+
+
+async def _aadd_metrics(pending):
+    for metric, amount in pending.items():
+        key = f"{METRICS_PREFIX}:{metric}"
+        try:
+            await cache.aincr(key, amount)
+        except ValueError:
+            if not await cache.aadd(key, amount, timeout=None):
+                await cache.aincr(key, amount)
+
+
+async def _arecord(metric, amount=1):
+    instrumentation.record_cache(metric)
+    with _metrics_lock:
+        _pending_metrics[metric] += amount
+    await _aadd_metrics(_take_due_metrics())
+
+
+def _check_entry(entry, versions):
+    # A missing version was evicted or never created, the entry can't be
+    # current either way so it is not recreated on reads
+    if entry is None:
+        return 'miss'
+    if any(versions[tag] != version for tag, version in entry['tags'].items()):
+        # One of the tags was invalidated after this entry was written
+        return 'stale'
+    return 'hit'
+
+
+def get_entry(key, tags=()):
+    # 'tags' are the tags the caller already knows the entry has, their
+    # versions are read in the same round trip as the entry. Tags only the
+    # entry knows (the numbers on a results page) take a second one
+    version_keys = {_version_key(tag): tag for tag in tags}
+    values = cache.get_many([key, *version_keys])
+    entry = values.get(key)
+    if entry is not None:
+        unknown = {_version_key(tag): tag for tag in entry['tags'] if _version_key(tag) not in version_keys}
+        if unknown:
+            values.update(cache.get_many(list(unknown)))
+            version_keys.update(unknown)
+
+    result = _check_entry(entry, {tag: values.get(version_key) for version_key, tag in version_keys.items()})
+    _record(result)
+    return entry['data'] if result == 'hit' else None
+
+
+async def aget_entry(key, tags=()):
+    version_keys = {_version_key(tag): tag for tag in tags}
+    values = await cache.aget_many([key, *version_keys])
+    entry = values.get(key)
+    if entry is not None:
+        unknown = {_version_key(tag): tag for tag in entry['tags'] if _version_key(tag) not in version_keys}
+        if unknown:
+            values.update(await cache.aget_many(list(unknown)))
+            version_keys.update(unknown)
+
+    result = _check_entry(entry, {tag: values.get(version_key) for version_key, tag in version_keys.items()})
+    await _arecord(result)
+    return entry['data'] if result == 'hit' else None
+
+
+def set_entry(key, data, tags, timeout):
+    # Versions are read after the response was computed, an invalidation
+    # racing with this write can keep a stale entry alive for at most 'timeout'
+    tags = list(dict.fromkeys(tags))
+    versions = _tag_versions(tags)
+    # A version evicted again right after it was created, not cached
+    if None not in versions.values():
+        cache.set(key, {'data': data, 'tags': versions}, timeout=timeout)
+
+
+async def aset_entry(key, data, tags, timeout):
+    tags = list(dict.fromkeys(tags))
+    versions = await _atag_versions(tags)
+    if None not in versions.values():
+        await cache.aset(key, {'data': data, 'tags': versions}, timeout=timeout)
+
+
+def invalidate(tags):
+    tags = list(dict.fromkeys(tags))
+    if not tags:
+        return
+    # Random versions instead of counters, so an evicted version key can never
+    # be bumped back to a value that an old entry was tagged with
+    cache.set_many({_version_key(tag): uuid.uuid4().hex for tag in tags}, timeout=None)
+    _record('invalidation', len(tags))
+
+
+async def ainvalidate(tags):
+    tags = list(dict.fromkeys(tags))
+    if not tags:
+        return
+    await cache.aset_many({_version_key(tag): uuid.uuid4().hex for tag in tags}, timeout=None)
+    await _arecord('invalidation', len(tags))
+
+
+def metrics():
+    # Only this process' pending events are flushed, other workers' events
+    # show up within METRICS_FLUSH_INTERVAL
+    flush_metrics()
+    values = cache.get_many([f"{METRICS_PREFIX}:{name}" for name in METRIC_NAMES])
+    counts = {name: values.get(f"{METRICS_PREFIX}:{name}", 0) for name in METRIC_NAMES}
+    lookups = counts['hit'] + counts['miss'] + counts['stale']
+    counts['hit_rate'] = round(counts['hit'] / lookups, 4) if lookups else 0.0
+    return counts
+
+
+def reset_metrics():
+    _take_metrics()
+    cache.delete_many([f"{METRICS_PREFIX}:{name}" for name in METRIC_NAMES])
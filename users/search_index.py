@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from users.models import CustomUser, PhoneSpamStats, RegisteredUserContact, SearchEntry
+from users.search_backends import get_search_backend
+
+
+##############################################################################
+# Maintenance of the unified name search table (SearchEntry)
+# Registered users and saved contacts are flattened into one indexed table so
+# name search is a single lookup instead of a union over both models
+##############################################################################
+
+SOURCE_USER = 'user'
+SOURCE_CONTACT = 'contact'
+ENTRY_FIELDS = ['name', 'phone_number', 'phone_key', 'email', 'epoch_score']
+BATCH_SIZE = 5000
+
+
+def user_entry(user, spam_scores):
+    return SearchEntry(
+        source=SOURCE_USER, object_id=user.id, name=user.username,
+        phone_number=user.phone_number, phone_key=user.phone_key, email=user.email,
+        epoch_score=spam_scores.get(user.phone_key, 0.0),
+    )
+
+
+def contact_entry(contact, spam_scores):
+    return SearchEntry(
+        source=SOURCE_CONTACT, object_id=contact.id, name=contact.contact_name,
+        phone_number=contact.phone_number, phone_key=contact.phone_key,
+        epoch_score=spam_scores.get(contact.phone_key, 0.0),
+    )
+
+
+def index_users(users):
+    spam_scores = PhoneSpamStats.epoch_scores_for([user.phone_key for user in users])
+    upsert(SOURCE_USER, [user_entry(user, spam_scores) for user in users])
+
+
+def index_contacts(contacts):
+    spam_scores = PhoneSpamStats.epoch_scores_for([contact.phone_key for contact in contacts])
+    upsert(SOURCE_CONTACT, [contact_entry(contact, spam_scores) for contact in contacts])
+
+
+def upsert(source, entries):
+    if not entries:
+        return
+    SearchEntry.objects.bulk_create(
+        entries, update_conflicts=True, unique_fields=['source', 'object_id'], update_fields=ENTRY_FIELDS,
+    )
+    backend = get_search_backend()
+    if backend.maintains_index:
+        # Upserted rows do not get their ids back on every database
+        backend.index(dict(
+            SearchEntry.objects.filter(source=source, object_id__in=[entry.object_id for entry in entries])
+                               .values_list('id', 'name')
+        ))
+
+
+def remove(source, object_ids):
+    SearchEntry.objects.filter(source=source, object_id__in=object_ids).delete()
+
+
+def update_spam_scores(phone_keys):
+    # One UPDATE copying the current scores through an indexed subquery
+    SearchEntry.objects.filter(phone_key__in=list(phone_keys)).update(
+        epoch_score=Coalesce(
+            Subquery(PhoneSpamStats.objects.filter(phone_key=OuterRef('phone_key')).values('epoch_score')[:1]),
+            Value(0.0),
+        )
+    )
+
+
+def rebuild():
+    with transaction.atomic():
+        SearchEntry.objects.all().delete()
+        spam_scores = dict(PhoneSpamStats.objects.values_list('phone_key', 'epoch_score').iterator())
+        for model, make_entry in ((CustomUser, user_entry), (RegisteredUserContact, contact_entry)):
+            batch = []
+            for row in model.objects.iterator(chunk_size=BATCH_SIZE):
+                batch.append(make_entry(row, spam_scores))
+                if len(batch) == BATCH_SIZE:
+                    SearchEntry.objects.bulk_create(batch)
+                    batch = []
+            SearchEntry.objects.bulk_create(batch)
+        get_search_backend().rebuild()
@@ -1,12 +1,37 @@
+from django.conf import settings
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 from users.models import CustomUser, RegisteredUserContact, ReportedUserSpam
+from users.instrumentation import MeasuredSerializerMixin
+from users.phone import InvalidPhoneNumber, normalize_phone_number
+
+
+###################################################################
+# Phone number field that accepts any common formatting and stores
+# the canonical E.164 form used for all lookups
+###################################################################
+class PhoneNumberField(serializers.CharField):
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            return normalize_phone_number(value)
+        except InvalidPhoneNumber as error:
+            raise serializers.ValidationError(str(error))
+
 
 ######################################
 # Serializer for user registration
 # Handles validation and user creation
 ######################################
-class UserRegistrationSerializer(serializers.ModelSerializer):
+class UserRegistrationSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=8)
+    phone_number = PhoneNumberField(
+        max_length=32,
+        validators=[UniqueValidator(
+            queryset=CustomUser.objects.all(),
+            message="custom user with this phone number already exists.",
+        )],
+    )
 
     class Meta:
         model = CustomUser
@@ -26,7 +51,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 # Serializer for user login 
 # Handles validation of username and password
 #############################################  
-class UserLoginSerializer(serializers.ModelSerializer):
+class UserLoginSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     username = serializers.CharField(max_length=255)
     password = serializers.CharField(write_only=True, min_length=8)
 
@@ -41,31 +66,73 @@ class UserLoginSerializer(serializers.ModelSerializer):
 # Serializer for RegisteredUserContact model
 # Handles validation and serialization of user contact details  
 ##############################################################  
-class RegisteredUserContactSerializer(serializers.ModelSerializer):
+class RegisteredUserContactSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     contact_of = serializers.PrimaryKeyRelatedField(queryset=CustomUser.objects.all())
+    phone_number = PhoneNumberField(max_length=32)
     
     class Meta:
         model = RegisteredUserContact 
         fields = ["contact_name", "phone_number", "email", "contact_of"]
 
 
+#####################################################################
+# Serializer for one entry of a bulk phone book sync
+# 'add' creates or updates the contact, 'remove' deletes it by number
+#####################################################################
+class ContactSyncItemSerializer(MeasuredSerializerMixin, serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'remove'], default='add')
+    contact_name = serializers.CharField(max_length=255, required=False)
+    phone_number = PhoneNumberField(max_length=32)
+    email = serializers.EmailField(required=False, allow_null=True, allow_blank=True)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and not attrs.get('contact_name'):
+            raise serializers.ValidationError({"contact_name": "This field is required."})
+        return attrs
+
+
 ###########################################################################
 # Serializer for ReportedUserSpam model
 # Handles validation and serialization for reporting a phone number as spam
 ###########################################################################
-class ReportedUserSpamSerializer(serializers.ModelSerializer):
+class ReportedUserSpamSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
+    phone_number = PhoneNumberField(max_length=32)
+
     class Meta:
         model = ReportedUserSpam 
         fields = ["phone_number", "marked_by", "created_at"]
         read_only_fields = ["marked_by", "created_at"]
 
 
+##################################################################
+# Serializer for reporting many phone numbers as spam in one request
+# Numbers are normalized one by one so invalid ones do not fail the batch
+##################################################################
+class SpamReportBatchSerializer(MeasuredSerializerMixin, serializers.Serializer):
+    phone_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=32),
+        allow_empty=False,
+        max_length=settings.SPAM_REPORT_BATCH_SIZE,
+    )
+
+
+############################################################
+# Serializer for caller-ID lookups of a call log
+############################################################
+class CallerIdBatchSerializer(MeasuredSerializerMixin, serializers.Serializer):
+    phone_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=32),
+        allow_empty=False,
+        max_length=settings.CALLER_ID_BATCH_SIZE,
+    )
+
+
 ############################################################
 # Serializer for user search using username and phonenumber
 ############################################################
-class SearchUserSerializer(serializers.ModelSerializer):
+class SearchUserSerializer(MeasuredSerializerMixin, serializers.ModelSerializer):
     username = serializers.CharField(max_length=255)
-    phone_number = serializers.CharField(max_length=15)
+    phone_number = serializers.CharField(max_length=16)
     spam_likelihood = serializers.FloatField()
     email = serializers.EmailField(required=False)
 
@@ -0,0 +1,86 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from users import authentication, caller_id, search_cache, search_index
+from users.models import ContactNameVote, CustomUser, RegisteredUserContact
+
+
+############################################################################
+# Keep the name search table, the contact name votes, the caller-ID
+# summaries and the cached phone searches in sync with users and contacts
+# Bulk writes bypass these signals and update the tables themselves
+############################################################################
+def search_fields_changed(update_fields, fields):
+    # Saves limited to other fields (e.g. last_login on login) keep the entry as is
+    return update_fields is None or not fields.isdisjoint(update_fields)
+
+
+@receiver(pre_save, sender=CustomUser)
+def remember_user_number(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The number cached phone searches may still show this user under
+    instance.previous_phone_key = None
+    if not raw and instance.pk is not None and search_fields_changed(update_fields, {'phone_number'}):
+        instance.previous_phone_key = CustomUser.objects.filter(pk=instance.pk).values_list('phone_key', flat=True).first()
+
+
+@receiver(post_save, sender=CustomUser)
+def index_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and search_fields_changed(update_fields, {'username', 'phone_number', 'email'}):
+        search_index.index_users([instance])
+        caller_id.refresh_user(instance)
+        # A new user also replaces cached searches that found the number unregistered
+        changed_keys = {instance.phone_key, getattr(instance, 'previous_phone_key', None)} - {None}
+        search_cache.invalidate([search_cache.phone_tag(key) for key in changed_keys])
+
+
+@receiver(post_delete, sender=CustomUser)
+def unindex_user(sender, instance, **kwargs):
+    search_index.remove(search_index.SOURCE_USER, [instance.id])
+    caller_id.refresh([instance.phone_key])
+    search_cache.invalidate([search_cache.phone_tag(instance.phone_key)])
+
+
+@receiver(pre_save, sender=RegisteredUserContact)
+def remember_contact_vote(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The number and name an edited contact voted for until now
+    instance.previous_vote = None
+    if not raw and instance.pk is not None and search_fields_changed(update_fields, {'contact_name', 'phone_number'}):
+        instance.previous_vote = (
+            RegisteredUserContact.objects.filter(pk=instance.pk).values_list('phone_key', 'contact_name').first()
+        )
+
+
+@receiver(post_save, sender=RegisteredUserContact)
+def index_contact(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and search_fields_changed(update_fields, {'contact_name', 'phone_number'}):
+        search_index.index_contacts([instance])
+        deltas = {(instance.phone_key, instance.contact_name): 1}
+        changed_keys = [instance.phone_key]
+        previous_vote = getattr(instance, 'previous_vote', None)
+        if previous_vote is not None:
+            deltas[previous_vote] = deltas.get(previous_vote, 0) - 1
+            changed_keys.append(previous_vote[0])
+        ContactNameVote.apply(deltas)
+        caller_id.refresh(changed_keys)
+
+
+@receiver(post_delete, sender=RegisteredUserContact)
+def unindex_contact(sender, instance, **kwargs):
+    search_index.remove(search_index.SOURCE_CONTACT, [instance.id])
+    ContactNameVote.apply({(instance.phone_key, instance.contact_name): -1})
+    caller_id.refresh([instance.phone_key])
+
+
+############################################################################
+# Drop cached tokens as soon as they are deleted (logout, rotation) or their
+# user changes, e.g. is deactivated
+############################################################################
+@receiver(post_save, sender=CustomUser)
+def invalidate_user_tokens(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and search_fields_changed(update_fields, {'is_active', 'username', 'phone_number', 'email'}):
+        authentication.tokens.invalidate(Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    authentication.tokens.invalidate([instance.key])
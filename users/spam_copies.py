@@ -0,0 +1,19 @@
+from users import bloom, caller_id, search_index
+
+BATCH_SIZE = 2000
+
+
+##############################################################################
+# Copies of PhoneSpamStats.epoch_score
+# The search entries and caller-ID summaries store the score of their number
+# and the Bloom filter the numbers that have one. Bulk writes of the spam
+# stats refresh all three for the numbers they touched. The filter goes
+# first, the caller-ID refresh reads the scores through it
+##############################################################################
+def refresh(phone_keys):
+    phone_keys = sorted({key for key in phone_keys if key is not None})
+    for start in range(0, len(phone_keys), BATCH_SIZE):
+        batch = phone_keys[start:start + BATCH_SIZE]
+        bloom.add_reported(batch)
+        search_index.update_spam_scores(batch)
+        caller_id.refresh(batch)
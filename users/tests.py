@@ -1,3 +1,1175 @@
-from django.test import TestCase
+import importlib
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase, APITransactionTestCase
+from spam_detection import asgi, wsgi
+from spam_detection.settings import database_settings
+from users import authentication, bloom, graph, lexicon, report_queue, scoring, search_cache, urls
+from users.management.commands import recompute_spam_scores
+from users.models import CallerIdSummary, ContactNameVote, CustomUser, RegisteredUserContact, PhoneSpamStats, ReportedUserSpam, SearchEntry, SpamGraphChange
+from users.search_backends import ScanSearchBackend, TrigramIndexSearchBackend, get_search_backend
+from users.phone import InvalidPhoneNumber, normalize_phone_number, phone_key
+from users.throttling import GCRAThrottle
 
-# Create your tests here.
+
+# Tests run against a local in-memory cache so they do not need Redis
+LOCAL_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class PhoneNormalizationTests(APITestCase):
+    def test_formats_of_the_same_number_normalize_alike(self):
+        for raw in ['9876543210', '09876543210', '+91 98765-43210', '0091 98765 43210', '(98765) 432.10', '+919876543210']:
+            self.assertEqual(normalize_phone_number(raw), '+919876543210', raw)
+        self.assertEqual(phone_key('098765 43210'), 919876543210)
+        # Numbers with their own country code are kept as they are
+        self.assertEqual(normalize_phone_number('+1 415-555-0100'), '+14155550100')
+
+    def test_invalid_numbers_are_rejected(self):
+        for raw in ['', 'abc', '98765x3210', '+91', '1234567', '+1234567890123456', '++919876543210']:
+            with self.assertRaises(InvalidPhoneNumber, msg=raw):
+                normalize_phone_number(raw)
+
+    def test_phone_key_follows_the_number_on_save(self):
+        user = CustomUser.objects.create_user(username='normalized', password='password123', phone_number='098765 43210')
+        user.refresh_from_db()
+        self.assertEqual((user.phone_number, user.phone_key), ('+919876543210', 919876543210))
+
+        user.phone_number = '+1 415-555-0100'
+        user.save(update_fields=['phone_number'])
+        user.refresh_from_db()
+        self.assertEqual((user.phone_number, user.phone_key), ('+14155550100', 14155550100))
+
+        contact = RegisteredUserContact.objects.create(contact_name='Broken', phone_number='not a number', contact_of=user)
+        contact.refresh_from_db()
+        self.assertEqual((contact.phone_number, contact.phone_key), ('not a number', None))
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def test_sqlite_keeps_the_rollback_journal_unless_wal_is_asked_for(self):
+        database = database_settings({})['default']
+        self.assertEqual(database['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertIn('PRAGMA journal_mode=DELETE;PRAGMA synchronous=FULL;', database['OPTIONS']['init_command'])
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+        database = database_settings({'DB_SQLITE_JOURNAL_MODE': 'wal', 'DB_SQLITE_MMAP_SIZE': '0', 'DB_CONN_MAX_AGE': '0'})['default']
+        self.assertIn('PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;PRAGMA mmap_size=0;', database['OPTIONS']['init_command'])
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+
+    def test_postgres_uses_persistent_connections_or_a_pool(self):
+        database = database_settings({'DB_ENGINE': 'postgres', 'DB_NAME': 'spam', 'DB_CONN_MAX_AGE': '300'})['default']
+        self.assertEqual((database['ENGINE'], database['NAME']), ('django.db.backends.postgresql', 'spam'))
+        self.assertEqual(database['CONN_MAX_AGE'], 300)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('pool', database['OPTIONS'])
+
+        database = database_settings({'DB_ENGINE': 'postgres', 'DB_POOL_MAX_SIZE': '20'})['default']
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 2, 'max_size': 20, 'timeout': 10})
+
+    def test_database_benchmark_only_runs_on_a_scratch_database(self):
+        with self.assertRaisesMessage(CommandError, "pass --scratch"):
+            call_command('benchmark_database', stdout=StringIO())
+        with mock.patch.dict(connection.settings_dict, NAME=settings.BASE_DIR / 'db.sqlite3'), \
+                self.assertRaisesMessage(CommandError, "Refusing to run on the project database"):
+            call_command('benchmark_database', scratch=True, stdout=StringIO())
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class SearchUserByUserNameViewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.searcher = CustomUser.objects.create_user(
+            username='searcher', password='password123', phone_number='9000000000'
+        )
+        # 'match_XXX' users start with the query, 'xmatch_XXX' only contain it
+        CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f"{'x' if i % 3 == 0 else ''}match_{i:03}",
+                phone_number=f"8{i:09}",
+                phone_key=phone_key(f"8{i:09}"),
+                email=f"match_{i}@example.com",
+            )
+            for i in range(150)
+        ])
+        RegisteredUserContact.objects.bulk_create([
+            RegisteredUserContact(
+                contact_name=f"friend {i}", phone_number=f"8{i:09}", phone_key=phone_key(f"8{i:09}"),
+                contact_of=cls.searcher
+            )
+            for i in range(0, 150, 5)
+        ])
+        # Stats as if every report had just been made by an ordinary reporter
+        fresh_report = scoring.report_score(timezone.now())
+        PhoneSpamStats.objects.bulk_create([
+            PhoneSpamStats(
+                phone_key=phone_key(f"8{i:09}"), phone_number=f"8{i:09}",
+                report_count=i % 12, distinct_reporters=i % 12, epoch_score=(i % 12) * fresh_report,
+            )
+            for i in range(0, 150, 2)
+        ])
+        # The users above were bulk inserted, bypassing the search index signals
+        call_command('rebuild_search_index', stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+        # Counters other tests left pending in this process
+        search_cache.reset_metrics()
+        self.client.force_authenticate(self.searcher)
+
+    def search(self, **params):
+        return self.client.get(reverse('search-user-by-name'), params)
+
+    def test_page_costs_constant_number_of_queries(self):
+        for result_size in (2, 20, 100):
+            cache.clear()
+            # One COUNT query for the paginator and one query for the page
+            with self.assertNumQueries(2):
+                response = self.search(name='match', result_size=result_size)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), result_size)
+            self.assertEqual(response.data['total_results'], 150)
+
+    def test_cursor_pages_walk_all_results_without_counting(self):
+        seen = []
+        params = {'name': 'match', 'result_size': 40, 'pagination': 'cursor'}
+        while True:
+            # A single query per page, no COUNT unless the total is requested
+            with self.assertNumQueries(1):
+                response = self.search(**params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('total_results', response.data)
+            seen.extend(result['username'] for result in response.data['results'])
+            if response.data['next_cursor'] is None:
+                break
+            params['cursor'] = response.data['next_cursor']
+
+        page_mode = self.search(name='match', result_size=150).data['results']
+        self.assertEqual(seen, [result['username'] for result in page_mode])
+
+        response = self.search(name='match', result_size=40, pagination='cursor', include_total='true')
+        self.assertEqual(response.data['total_results'], 150)
+        response = self.search(name='match', pagination='cursor', cursor='tampered')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_prefix_matches_are_ranked_first(self):
+        response = self.search(name='match', result_size=150)
+        usernames = [result['username'] for result in response.data['results']]
+        prefix_matches = [name for name in usernames if name.startswith('match')]
+        self.assertEqual(usernames[:len(prefix_matches)], prefix_matches)
+        self.assertEqual(len(prefix_matches), 100)
+
+    def test_spam_likelihood_and_email_visibility(self):
+        response = self.search(name='match_010', result_size=2)
+        result = response.data['results'][0]
+        self.assertEqual(result['username'], 'match_010')
+        self.assertEqual(result['spam_likelihood'], 1.0)
+        self.assertEqual(result['email'], 'match_10@example.com')
+
+        response = self.search(name='match_011', result_size=2)
+        result = response.data['results'][0]
+        self.assertEqual(result['spam_likelihood'], 0.0)
+        self.assertNotIn('email', result)
+
+    def test_contact_names_are_searched_after_registered_users(self):
+        CustomUser.objects.create_user(username='friendly', password='password123', phone_number='9100000001')
+        response = self.search(name='friend', result_size=100)
+        results = response.data['results']
+
+        self.assertEqual(response.data['total_results'], 31)
+        self.assertEqual(results[0]['username'], 'friendly')
+        self.assertEqual(results[1], {'contact_name': 'friend 0', 'phone_number': '8000000000', 'spam_likelihood': 0.0})
+
+        # Contact entries follow spam reports on their number
+        self.client.post(reverse('mark-spam'), {'phone_number': '8000000005'})
+        cache.clear()
+        result = next(r for r in self.search(name='friend 5', result_size=100).data['results'] if r['contact_name'] == 'friend 5')
+        self.assertEqual(result['spam_likelihood'], 0.1)
+
+    def test_search_index_follows_user_changes(self):
+        user = CustomUser.objects.create_user(username='zephyr', password='password123', phone_number='9100000000')
+        self.assertEqual([r['username'] for r in self.search(name='PHY').data['results']], ['zephyr'])
+
+        user.username = 'quokka'
+        user.save()
+        cache.clear()
+        self.assertEqual(self.search(name='phy').data['results'], [])
+        self.assertEqual([r['username'] for r in self.search(name='okk').data['results']], ['quokka'])
+
+        # Queries shorter than a trigram fall back to a scan
+        self.assertEqual([r['username'] for r in self.search(name='qu').data['results']], ['quokka'])
+
+    def test_spam_report_invalidates_only_affected_entries(self):
+        self.search(name='match_010', result_size=2)
+        self.search(name='match_011', result_size=2)
+
+        # Both searches are served from the cache now
+        with self.assertNumQueries(0):
+            self.search(name='match_010', result_size=2)
+            self.search(name='match_011', result_size=2)
+
+        response = self.client.post(reverse('mark-spam'), {'phone_number': '8000000011'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # The untouched entry is still a hit, the reported number is recomputed
+        with self.assertNumQueries(0):
+            self.search(name='match_010', result_size=2)
+        response = self.search(name='match_011', result_size=2)
+        self.assertEqual(response.data['results'][0]['spam_likelihood'], 0.1)
+
+        metrics = search_cache.metrics()
+        self.assertEqual(metrics['hit'], 3)
+        self.assertEqual(metrics['stale'], 1)
+        self.assertEqual(metrics['invalidation'], 1)
+
+    def test_evicted_tag_versions_make_entries_stale(self):
+        tag = search_cache.phone_tag(918000000011)
+        version_key = f"{search_cache.TAG_VERSION_PREFIX}:{tag}"
+        for data in ['first', 'second']:
+            search_cache.set_entry('entry', data, [tag], timeout=None)
+            self.assertIsNotNone(cache.get(version_key))
+            self.assertEqual(search_cache.get_entry('entry'), data)
+
+            # Neither the first nor a later eviction brings the entry back
+            cache.delete(version_key)
+            self.assertIsNone(search_cache.get_entry('entry'))
+            self.assertIsNone(search_cache.get_entry('entry'))
+
+    def test_entries_are_read_with_their_tag_versions_in_one_round_trip(self):
+        tag = search_cache.phone_tag(918000000013)
+        search_cache.set_entry('entry', 'data', [tag], timeout=None)
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, \
+                mock.patch.object(cache, 'incr', wraps=cache.incr) as incr:
+            for _ in range(3):
+                self.assertEqual(search_cache.get_entry('entry', [tag]), 'data')
+        self.assertEqual(get_many.call_count, 3)
+        # Counters are only added to the shared ones on a flush
+        incr.assert_not_called()
+        self.assertEqual(search_cache.metrics()['hit'], 3)
+
+        with mock.patch.object(search_cache, 'METRICS_FLUSH_INTERVAL', 0):
+            self.assertIsNone(search_cache.get_entry('missing'))
+        self.assertEqual(cache.get(f"{search_cache.METRICS_PREFIX}:miss"), 1)
+
+    def test_search_backend_follows_the_setting(self):
+        self.assertIsInstance(get_search_backend(), TrigramIndexSearchBackend)
+        with override_settings(USER_SEARCH_BACKEND='scan'):
+            self.assertIs(type(get_search_backend()), ScanSearchBackend)
+            self.assertEqual([r['username'] for r in self.search(name='match_010', result_size=2).data['results']], ['match_010'])
+        self.assertIsInstance(get_search_backend(), TrigramIndexSearchBackend)
+
+    async def test_async_entries_are_tagged_with_created_versions(self):
+        tag = search_cache.phone_tag(918000000012)
+        await search_cache.aset_entry('async_entry', 'data', [tag], timeout=None)
+        self.assertEqual(await search_cache.aget_entry('async_entry'), 'data')
+        await cache.adelete(f"{search_cache.TAG_VERSION_PREFIX}:{tag}")
+        self.assertIsNone(await search_cache.aget_entry('async_entry'))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class SearchUserByPhoneNumberViewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.target = CustomUser.objects.create_user(
+            username='target', password='password123', phone_number='7000000000', email='target@example.com'
+        )
+        cls.friend = CustomUser.objects.create_user(
+            username='friend', password='password123', phone_number='7000000001'
+        )
+        cls.stranger = CustomUser.objects.create_user(
+            username='stranger', password='password123', phone_number='7000000002'
+        )
+        RegisteredUserContact.objects.create(
+            contact_name='Target', phone_number='7000000000', contact_of=cls.friend
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, viewer, phone_number):
+        self.client.force_authenticate(viewer)
+        return self.client.get(reverse('search-user-by-phone'), {'phone_number': phone_number})
+
+    def test_email_is_only_shown_to_viewers_in_contact_list(self):
+        response = self.search(self.friend, '7000000000')
+        self.assertEqual(response.data['email'], 'target@example.com')
+
+        # The shared entry is a cache hit, only the stranger's overlay is computed
+        with self.assertNumQueries(1):
+            response = self.search(self.stranger, '7000000000')
+        self.assertNotIn('email', response.data)
+
+        with self.assertNumQueries(0):
+            response = self.search(self.friend, '7000000000')
+        self.assertEqual(response.data['email'], 'target@example.com')
+
+    def test_new_contact_reveals_email(self):
+        self.assertNotIn('email', self.search(self.stranger, '7000000000').data)
+
+        response = self.client.post(reverse('create-contact'), {'contact_name': 'Target', 'phone_number': '7000000000'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(self.search(self.stranger, '7000000000').data['email'], 'target@example.com')
+
+    def test_unknown_number_is_cached_until_a_contact_saves_it(self):
+        self.assertEqual(self.search(self.friend, '7000000009').status_code, status.HTTP_404_NOT_FOUND)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search(self.friend, '7000000009').status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.post(reverse('create-contact'), {'contact_name': 'Plumber', 'phone_number': '7000000009'})
+
+        response = self.search(self.friend, '7000000009')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['contact_name'], 'Plumber')
+
+    def test_user_changes_replace_cached_phone_searches(self):
+        self.assertEqual(self.search(self.friend, '7000000000').data['email'], 'target@example.com')
+        self.assertEqual(self.search(self.friend, '7000000007').status_code, status.HTTP_404_NOT_FOUND)
+
+        self.target.email = 'moved@example.com'
+        self.target.save()
+        self.assertEqual(self.search(self.friend, '7000000000').data['email'], 'moved@example.com')
+
+        # Both the old and the new number are looked up again
+        self.target.phone_number = '7000000007'
+        self.target.save()
+        self.assertEqual(self.search(self.friend, '7000000000').data['results'][0]['contact_name'], 'Target')
+        self.assertEqual(self.search(self.friend, '7000000007').data['username'], 'target')
+
+    def test_unregistered_number_lists_top_contact_names(self):
+        for i, name in enumerate(['City Cabs', 'city  cabs', 'Taxi', 'City Cabs']):
+            saver = CustomUser.objects.create_user(username=f'cab_saver{i}', password='password123', phone_number=f'710000000{i}')
+            contact = RegisteredUserContact.objects.create(contact_name=name, phone_number='7000000008', contact_of=saver)
+        # Renames move the vote, deletes take it back
+        contact.contact_name = 'Taxi'
+        contact.save()
+        RegisteredUserContact.objects.filter(contact_name='city  cabs').delete()
+
+        response = self.search(self.friend, '7000000008')
+        self.assertEqual(response.data['top_names'], [{'name': 'Taxi', 'count': 2}, {'name': 'City Cabs', 'count': 1}])
+        self.assertEqual(response.data['total_results'], 3)
+
+    def test_differently_formatted_numbers_match(self):
+        for phone_number in ('+91 70000 00000', '070000-00000', '0091 7000000000'):
+            response = self.search(self.friend, phone_number)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['username'], 'target')
+            self.assertEqual(response.data['phone_number'], '+917000000000')
+
+    def test_invalid_number_is_rejected(self):
+        response = self.search(self.friend, '12ab')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CONTACT_SYNC_BATCH_SIZE=3)
+class ContactSyncViewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='syncer', password='password123', phone_number='6000000000'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, body, content_type='application/json', **params):
+        url = reverse('sync-contacts')
+        if params:
+            url = f"{url}?{'&'.join(f'{name}={value}' for name, value in params.items())}"
+        return self.client.post(url, body, content_type=content_type)
+
+    def contacts(self):
+        return dict(RegisteredUserContact.objects.filter(contact_of=self.user).values_list('phone_number', 'contact_name'))
+
+    def test_full_sync_deduplicates_and_reports_invalid_entries(self):
+        RegisteredUserContact.objects.create(contact_name='Mom', phone_number='6100000000', contact_of=self.user)
+        body = json.dumps([
+            {'contact_name': 'Mom', 'phone_number': '+91 61000 00000'},
+            {'contact_name': 'Dad', 'phone_number': '6100000001'},
+            {'contact_name': 'Broken', 'phone_number': 'abc'},
+            # Second chunk, updates the contact created by the first one
+            {'contact_name': 'Daddy', 'phone_number': '06100000001'},
+            {'contact_name': 'Work', 'phone_number': '6100000002'},
+        ])
+        response = self.sync(body)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['unchanged'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [2])
+        self.assertEqual(self.contacts(), {
+            '+916100000000': 'Mom', '+916100000001': 'Daddy', '+916100000002': 'Work',
+        })
+        # The rename in the second chunk moved the vote of the contact created by the first
+        self.assertEqual(ContactNameVote.top_names(916100000001), [{'name': 'Daddy', 'count': 1}])
+
+    def test_ndjson_delta_sync_with_token(self):
+        response = self.sync(json.dumps([{'contact_name': 'Mom', 'phone_number': '6100000000'}]))
+        token = response.data['sync_token']
+
+        body = '\n'.join([
+            json.dumps({'op': 'add', 'contact_name': 'Dad', 'phone_number': '6100000001'}),
+            json.dumps({'op': 'remove', 'phone_number': '6100000000'}),
+        ])
+        response = self.sync(body, content_type='application/x-ndjson', mode='delta', sync_token=token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['removed']), (1, 1))
+        self.assertEqual(self.contacts(), {'+916100000001': 'Dad'})
+
+        # The token was consumed, replaying it requires a full sync
+        response = self.sync(body, content_type='application/x-ndjson', mode='delta', sync_token=token)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_full_sync_removes_contacts_missing_from_upload(self):
+        self.sync(json.dumps([
+            {'contact_name': 'Mom', 'phone_number': '6100000000'},
+            {'contact_name': 'Dad', 'phone_number': '6100000001'},
+        ]))
+        response = self.sync(json.dumps([{'contact_name': 'Dad', 'phone_number': '6100000001'}]))
+        self.assertEqual(response.data['removed'], 1)
+        self.assertEqual(self.contacts(), {'+916100000001': 'Dad'})
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class MarkPhoneNumberAsSpamViewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reporters = [
+            CustomUser.objects.create_user(username=f'reporter{i}', password='password123', phone_number=f'500000000{i}')
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def report(self, reporter, phone_number):
+        self.client.force_authenticate(reporter)
+        return self.client.post(reverse('mark-spam'), {'phone_number': phone_number})
+
+    def report_batch(self, reporter, phone_numbers):
+        self.client.force_authenticate(reporter)
+        return self.client.post(reverse('mark-spam-batch'), {'phone_numbers': phone_numbers}, format='json')
+
+    def test_duplicate_report_is_rejected(self):
+        self.assertEqual(self.report(self.reporters[0], '5100000000').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.report(self.reporters[0], '+91 51000 00000').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(PhoneSpamStats.objects.get(phone_key=915100000000).report_count, 1)
+
+    def test_incremental_counters_match_a_rebuild(self):
+        # A number known only from its negative labels gets its first report
+        PhoneSpamStats.add_negative_labels({915100000002: 1})
+        for reporter in self.reporters:
+            for number in ['5100000000', '5100000001', '5100000002']:
+                self.report(reporter, number)
+        self.report(self.reporters[0], '5100000003')
+
+        fields = [
+            'phone_key', 'phone_number', 'report_count', 'distinct_reporters',
+            'first_reported_at', 'last_reported_at', 'negative_labels',
+        ]
+        incremental = list(PhoneSpamStats.objects.order_by('phone_key').values_list(*fields, 'epoch_score'))
+        call_command('rebuild_spam_stats', stdout=StringIO())
+        rebuilt = list(PhoneSpamStats.objects.order_by('phone_key').values_list(*fields, 'epoch_score'))
+
+        self.assertEqual([row[:-1] for row in incremental], [row[:-1] for row in rebuilt])
+        for before, after in zip(incremental, rebuilt):
+            self.assertAlmostEqual(before[-1], after[-1])
+        self.assertEqual([row[2] for row in rebuilt], [2, 2, 2, 1])
+
+    def test_scores_decay_and_prolific_reporters_weigh_less(self):
+        now = timezone.now()
+        half_life_ago = now - timedelta(days=settings.SPAM_SCORE_HALF_LIFE_DAYS)
+        self.assertEqual(scoring.likelihood(scoring.report_score(now), now), 0.1)
+        self.assertEqual(scoring.likelihood(scoring.report_score(half_life_ago), now), 0.05)
+        self.assertEqual(scoring.reporter_weight(settings.SPAM_REPORTER_QUOTA), 1.0)
+        self.assertEqual(scoring.reporter_weight(settings.SPAM_REPORTER_QUOTA * 4), 0.5)
+
+        # The incremental score matches a recomputation from the reports
+        self.report(self.reporters[0], '5100000000')
+        self.report(self.reporters[1], '5100000000')
+        incremental = PhoneSpamStats.objects.get(phone_key=915100000000).epoch_score
+        PhoneSpamStats.refresh_for([915100000000])
+        self.assertAlmostEqual(PhoneSpamStats.objects.get(phone_key=915100000000).epoch_score, incremental)
+        self.assertEqual(PhoneSpamStats.likelihoods_for([915100000000, 915100000001]), {915100000000: 0.2, 915100000001: 0.0})
+
+    @skipUnless(scoring.np, "NumPy is not installed")
+    def test_vectorized_likelihoods_match_the_fallback(self):
+        now = timezone.now()
+        scores = [0.0, 1e-9, *(i * 0.37 for i in range(300)), 1e9]
+        vectorized = scoring.likelihoods(scores, now)
+        with mock.patch.object(scoring, 'np', None):
+            self.assertEqual(vectorized, scoring.likelihoods(scores, now))
+        self.assertEqual(scoring.likelihoods([], now), [])
+
+    def test_data_migrations_keep_their_own_copies(self):
+        backfill = importlib.import_module('users.migrations.0010_backfill_phone_key')
+        epoch_scores = importlib.import_module('users.migrations.0019_epoch_spam_score')
+        # Frozen code, later changes to users.phone and users.scoring do not reach them
+        self.assertEqual(backfill.normalize_phone_number.__module__, backfill.__name__)
+        self.assertEqual(epoch_scores.epoch_scores.__module__, epoch_scores.__name__)
+        self.assertNotIn('scoring', vars(epoch_scores))
+        for raw in ['098765 43210', '+1 415-555-0100', '9876543210']:
+            self.assertEqual(backfill.normalize_phone_number(raw), normalize_phone_number(raw))
+        reported_at = timezone.now()
+        self.assertAlmostEqual(
+            epoch_scores.epoch_scores([(1, 7, reported_at)], {7: 500})[1],
+            scoring.epoch_scores([(1, 7, reported_at)], {7: 500})[1],
+        )
+
+    @skipUnless(recompute_spam_scores.np, "NumPy is not installed")
+    def test_batch_recompute_matches_incremental_scores(self):
+        for reporter in self.reporters:
+            for phone_number in ('5100000000', '5100000001', '5100000002'):
+                self.report(reporter, phone_number)
+        expected = {
+            stats.phone_key: (stats.report_count, stats.epoch_score, stats.first_reported_at, stats.last_reported_at)
+            for stats in PhoneSpamStats.objects.all()
+        }
+        PhoneSpamStats.objects.update(report_count=0, distinct_reporters=0, epoch_score=0.0)
+
+        call_command('recompute_spam_scores', chunk_size=4, batch_size=2, stdout=StringIO())
+        for stats in PhoneSpamStats.objects.all():
+            count, score, first, last = expected[stats.phone_key]
+            self.assertEqual((stats.report_count, stats.first_reported_at, stats.last_reported_at), (count, first, last))
+            self.assertAlmostEqual(stats.epoch_score, score)
+
+    def test_batch_report_is_idempotent(self):
+        self.report(self.reporters[0], '5100000000')
+
+        response = self.report_batch(self.reporters[0], ['5100000000', '5100000001', '05100000001', 'nope'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['reported'], 1)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['already_reported', 'reported', 'already_reported', 'invalid'],
+        )
+
+        # Flushing the same queue again changes nothing
+        response = self.report_batch(self.reporters[0], ['5100000000', '5100000001'])
+        self.assertEqual(response.data['reported'], 0)
+
+        self.report_batch(self.reporters[1], ['5100000000', '5100000001'])
+        stats = dict(PhoneSpamStats.objects.values_list('phone_key', 'report_count'))
+        self.assertEqual(stats, {915100000000: 2, 915100000001: 2})
+
+    def test_batch_status_follows_the_rows_actually_inserted(self):
+        bulk_create = ReportedUserSpam.objects.bulk_create
+
+        def concurrent_bulk_create(reports, **kwargs):
+            # Another flush of the same queue commits 5100000000 first, and
+            # 5100000001 is skipped by the insert
+            ReportedUserSpam.objects.create(phone_number='5100000000', marked_by=self.reporters[0])
+            return bulk_create([report for report in reports if report.phone_key != 915100000001], **kwargs)
+
+        with mock.patch.object(ReportedUserSpam.objects, 'bulk_create', side_effect=concurrent_bulk_create):
+            response = self.report_batch(self.reporters[0], ['+91 51000-00000', '5100000001', '5100000002'])
+        self.assertEqual(response.data['reported'], 2)
+        self.assertEqual(
+            [(result['phone_number'], result['status']) for result in response.data['results']],
+            [('+915100000000', 'reported'), ('+915100000001', 'already_reported'), ('+915100000002', 'reported')],
+        )
+        stats = dict(PhoneSpamStats.objects.values_list('phone_key', 'report_count'))
+        self.assertEqual(stats, {915100000000: 1, 915100000002: 1})
+
+    def test_rebuild_refreshes_the_copies_of_the_scores(self):
+        self.report(self.reporters[0], '5000000001')
+        self.report(self.reporters[1], '5100000000')
+        reported_user = phone_key('5000000001')
+        # Stale copies, and a report deleted behind the aggregate's back
+        SearchEntry.objects.filter(phone_key=reported_user).update(epoch_score=0.0)
+        CallerIdSummary.objects.filter(phone_key=reported_user).update(epoch_score=0.0)
+        ReportedUserSpam.objects.filter(phone_key=915100000000).delete()
+
+        call_command('rebuild_spam_stats', stdout=StringIO())
+        epoch_score = PhoneSpamStats.objects.get(phone_key=reported_user).epoch_score
+        self.assertGreater(epoch_score, 0)
+        self.assertAlmostEqual(SearchEntry.objects.get(source='user', phone_key=reported_user).epoch_score, epoch_score)
+        self.assertAlmostEqual(CallerIdSummary.objects.get(phone_key=reported_user).epoch_score, epoch_score)
+        self.assertFalse(CallerIdSummary.objects.filter(phone_key=915100000000).exists())
+
+    @override_settings(SPAM_REPORT_QUEUE='local', SPAM_REPORT_LOCAL_WORKER=False)
+    def test_write_behind_reports_are_visible_to_their_reporter_until_drained(self):
+        RegisteredUserContact.objects.create(contact_name='Queued caller', phone_number='5100000000', contact_of=self.reporters[0])
+        response = self.report(self.reporters[0], '5100000000')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(response.data['report_id'])
+        self.assertFalse(ReportedUserSpam.objects.exists())
+        # Read-your-writes: the reporter already sees the queued report
+        self.assertEqual(self.report(self.reporters[0], '5100000000').status_code, status.HTTP_400_BAD_REQUEST)
+
+        def spam_likelihoods():
+            return [
+                self.client.get(reverse('caller-id'), {'phone_number': '5100000000'}).data['spam_likelihood'],
+                self.client.get(reverse('search-user-by-phone'), {'phone_number': '5100000000'}).data['results'][0]['spam_likelihood'],
+                self.client.get(reverse('search-user-by-name'), {'name': 'Queued'}).data['results'][0]['spam_likelihood'],
+            ]
+        self.assertEqual(spam_likelihoods(), [0.1, 0.1, 0.1])
+        self.client.force_authenticate(self.reporters[1])
+        # Cached by the reporter's searches, the other user still gets them unreported
+        self.assertEqual(spam_likelihoods(), [0.0, 0.0, 0.0])
+
+        # Batches are queued as well, reports of one number are coalesced
+        # into one insert and one recount
+        response = self.report_batch(self.reporters[1], ['5100000000', '5100000001', '05100000001'])
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual([result['status'] for result in response.data['results']], ['queued', 'queued', 'already_reported'])
+        output = StringIO()
+        call_command('drain_spam_reports', once=True, stdout=output)
+        self.assertIn("Wrote 3 new spam reports of 3 queued", output.getvalue())
+        self.assertEqual(PhoneSpamStats.objects.get(phone_key=915100000000).report_count, 2)
+        self.assertEqual(spam_likelihoods(), [0.2, 0.2, 0.2])
+        self.assertEqual(self.report(self.reporters[1], '5100000000').status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(SPAM_REPORT_QUEUE='local', SPAM_REPORT_LOCAL_WORKER=False)
+    def test_drain_counts_the_reports_actually_inserted(self):
+        self.report_batch(self.reporters[0], ['5100000000', '5100000001'])
+        bulk_create = ReportedUserSpam.objects.bulk_create
+
+        def skipping_bulk_create(reports, **kwargs):
+            # 5100000001 is skipped by the insert
+            return bulk_create([report for report in reports if report.phone_key != 915100000001], **kwargs)
+
+        output = StringIO()
+        with mock.patch.object(ReportedUserSpam.objects, 'bulk_create', side_effect=skipping_bulk_create):
+            call_command('drain_spam_reports', once=True, stdout=output)
+        self.assertIn("Wrote 1 new spam reports of 2 queued", output.getvalue())
+        self.assertEqual(list(PhoneSpamStats.objects.values_list('phone_key', flat=True)), [915100000000])
+
+@override_settings(CACHES=LOCAL_CACHES, SPAM_REPORT_QUEUE='local')
+class LocalReportQueueWorkerTests(APITransactionTestCase):
+    # Committed rows, the worker thread writes through its own connection
+    def stop_worker(self):
+        # Before the flush, which fails while the thread holds the database
+        queue = report_queue.get_queue()
+        queue.stop()
+        if queue.worker is not None:
+            queue.worker.join(5)
+
+    def test_web_process_drains_its_local_queue(self):
+        self.addCleanup(self.stop_worker)
+        reporter = CustomUser.objects.create_user(username='queued_reporter', password='password123', phone_number='5200000000')
+        self.client.force_authenticate(reporter)
+        response = self.client.post(reverse('mark-spam'), {'phone_number': '5200000001'})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        # Entries are acknowledged after their commit. The shared in-memory
+        # test database fails reads that overlap the write instead of waiting
+        queue = report_queue.get_queue()
+        for _ in range(100):
+            if not queue.entries:
+                break
+            time.sleep(0.05)
+        self.stop_worker()
+        self.assertEqual(PhoneSpamStats.objects.get(phone_key=915200000001).report_count, 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class AsyncViewsTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = CustomUser.objects.create_user(
+            username='async_viewer', password='password123', phone_number='4000000000'
+        )
+        cls.target = CustomUser.objects.create_user(
+            username='async_target', password='password123', phone_number='4000000001', email='target@example.com'
+        )
+        RegisteredUserContact.objects.create(
+            contact_name='Target', phone_number='4000000001', contact_of=cls.viewer
+        )
+        cls.token = Token.objects.create(user=cls.viewer)
+
+    def setUp(self):
+        cache.clear()
+
+    def auth_headers(self):
+        return {'Authorization': f"Token {self.token.key}"}
+
+    def get(self, name, params):
+        return self.async_client.get(reverse(name), params, headers=self.auth_headers())
+
+    async def test_async_views_match_sync_responses(self):
+        response = await self.get('async-search-user-by-phone', {'phone_number': '4000000001'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], 'target@example.com')
+
+        response = await self.get('async-search-user-by-name', {'name': 'async_t'})
+        self.assertEqual(response.json()['total_results'], 1)
+        self.assertEqual(response.json()['results'][0]['username'], 'async_target')
+
+        response = await self.async_client.post(
+            reverse('async-mark-spam'), {'phone_number': '4000000001'},
+            content_type='application/json', headers=self.auth_headers(),
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # The report invalidated the cached lookup
+        response = await self.get('async-search-user-by-phone', {'phone_number': '4000000001'})
+        self.assertEqual(response.json()['spam_likelihood'], 0.1)
+
+    async def test_async_views_require_a_valid_token(self):
+        response = await self.async_client.get(reverse('async-search-user-by-name'), {'name': 'async'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.get(
+            reverse('async-search-user-by-name'), {'name': 'async'}, headers={'Authorization': 'Token nope'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(CACHES=LOCAL_CACHES, SPAM_BLOOM_CAPACITY=1000)
+class ReportedNumbersBloomFilterTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reporter = CustomUser.objects.create_user(
+            username='bloom_reporter', password='password123', phone_number='3000000000'
+        )
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(SPAM_BLOOM_PATH=os.path.join(directory.name, 'reported.bloom')))
+        bloom.reset()
+        self.addCleanup(bloom.reset)
+
+    def test_unreported_numbers_skip_the_spam_score_query(self):
+        self.assertIsNotNone(bloom.reported_numbers())
+        with self.assertNumQueries(0):
+            self.assertEqual(PhoneSpamStats.likelihoods_for([913100000000]), {913100000000: 0.0})
+
+        self.client.force_authenticate(self.reporter)
+        self.client.post(reverse('mark-spam'), {'phone_number': '3100000000'})
+        self.assertEqual(PhoneSpamStats.likelihoods_for([913100000000]), {913100000000: 0.1})
+
+    def test_workers_catch_up_with_numbers_added_elsewhere(self):
+        # A number known only from its negative labels, long before the filter opened
+        PhoneSpamStats.add_negative_labels({913100000002: 1})
+        bloom.reported_numbers()
+        # Scored by other hosts, without going through this worker's filter
+        PhoneSpamStats.objects.create(phone_key=913100000001, phone_number='+913100000001', report_count=1, scored_at=timezone.now())
+        PhoneSpamStats.objects.filter(phone_key=913100000002).update(report_count=1, scored_at=timezone.now())
+        self.assertNotIn(913100000001, bloom.reported_numbers())
+
+        # The open filter catches up on its timer, async lookups go through it too
+        with mock.patch.object(bloom, 'CATCH_UP_INTERVAL', 0):
+            self.assertIsNone(bloom.loaded_reported_numbers())
+            self.assertIn(913100000001, bloom.reported_numbers())
+            self.assertIn(913100000002, bloom.reported_numbers())
+
+        # As does the next worker to open the shared file
+        bloom.reset()
+        self.assertIn(913100000001, bloom.reported_numbers())
+
+    def test_workers_open_the_filter_at_startup(self):
+        with mock.patch('users.bloom.open_at_startup') as open_at_startup:
+            importlib.reload(wsgi)
+            importlib.reload(asgi)
+        self.assertEqual(open_at_startup.call_count, 2)
+
+        bloom.open_at_startup()
+        self.assertIsNotNone(bloom.loaded_reported_numbers())
+
+        # A failed startup leaves the filter to the first lookup
+        bloom.reset()
+        with mock.patch.object(bloom.SharedBloomFilter, 'catch_up', side_effect=DatabaseError), \
+                self.assertLogs('users.bloom', 'WARNING'):
+            bloom.open_at_startup()
+        self.assertIsNone(bloom.loaded_reported_numbers())
+        self.assertIsNotNone(bloom.reported_numbers())
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CallerIdViewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.savers = [
+            CustomUser.objects.create_user(username=f'saver{i}', password='password123', phone_number=f'720000000{i}')
+            for i in range(3)
+        ]
+        for saver, name in zip(cls.savers, ['Raj Plumber', 'Plumber', 'Plumber']):
+            RegisteredUserContact.objects.create(contact_name=name, phone_number='7300000000', contact_of=saver)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.savers[0])
+
+    def lookup(self, phone_number):
+        return self.client.get(reverse('caller-id'), {'phone_number': phone_number}).data
+
+    def test_single_lookup_follows_contacts_registration_and_reports(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.lookup('7300000000'), {
+                'phone_number': '+917300000000', 'name': 'Plumber', 'is_registered': False, 'spam_likelihood': 0.0,
+            })
+
+        self.client.post(reverse('mark-spam'), {'phone_number': '7300000000'})
+        self.assertEqual(self.lookup('7300000000')['spam_likelihood'], 0.1)
+
+        # A registered user's own name wins over the names others saved
+        CustomUser.objects.create_user(username='raj', password='password123', phone_number='+91 73000 00000')
+        self.assertEqual(self.lookup('7300000000')['name'], 'raj')
+        self.assertTrue(self.lookup('7300000000')['is_registered'])
+
+        self.assertEqual(self.lookup('7300000009')['name'], None)
+        self.assertEqual(self.client.get(reverse('caller-id'), {'phone_number': '12ab'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_lookup_keeps_order_and_follows_contact_sync(self):
+        # A full sync without the number removes one of the 'Plumber' contacts,
+        # 'Plumber' and 'Raj Plumber' are now tied and the lowest name wins
+        self.client.force_authenticate(self.savers[1])
+        self.client.post(reverse('sync-contacts'), [], format='json')
+
+        response = self.client.post(
+            reverse('caller-id'), {'phone_numbers': ['12ab', '7200000002', '7300000000', '7300000009']}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertIn('error', results[0])
+        self.assertEqual([result.get('name') for result in results], [None, 'saver2', 'Plumber', None])
+        self.assertTrue(results[1]['is_registered'])
+
+        self.client.force_authenticate(self.savers[2])
+        self.client.post(reverse('sync-contacts'), [], format='json')
+        self.assertEqual(self.lookup('7300000000')['name'], 'Raj Plumber')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CachedTokenAuthenticationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='token_user', password='password123', phone_number='7400000000')
+
+    def setUp(self):
+        cache.clear()
+        authentication.tokens.clear_local()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def caller_id(self):
+        return self.client.get(reverse('caller-id'), {'phone_number': '7400000000'})
+
+    def test_token_is_looked_up_once(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.caller_id().status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.caller_id().status_code, status.HTTP_200_OK)
+
+        # Another worker finds the token in the shared cache
+        authentication.tokens.clear_local()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.caller_id().status_code, status.HTTP_200_OK)
+
+    def test_only_the_user_id_and_flags_are_cached(self):
+        self.caller_id()
+        cached = cache.get(authentication.cache_key(self.token.key))
+        self.assertEqual(cached, {'user_id': self.user.id, 'is_active': True})
+
+        # Every request gets its own user, other fields are loaded on access
+        first, second = authentication.tokens.get(self.token.key), authentication.tokens.get(self.token.key)
+        self.assertIsNot(first.user, second.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(first.user.username, 'token_user')
+
+    def test_logout_and_deactivation_revoke_cached_tokens(self):
+        self.caller_id()
+        self.assertEqual(self.client.post(reverse('user-logout')).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.caller_id().status_code, status.HTTP_401_UNAUTHORIZED)
+
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.caller_id()
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.caller_id().status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class GCRAThrottleTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='throttled', password='password123', phone_number='7500000000')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        self.now = 1000.0
+        self.enterContext(mock.patch.object(GCRAThrottle, 'timer', lambda throttle: self.now))
+        self.enterContext(mock.patch.object(GCRAThrottle, 'THROTTLE_RATES', {'user': '2/m', 'caller_id': '3/m'}))
+
+    def statuses(self, url, count):
+        return [self.client.get(url, {'phone_number': '7500000000'}).status_code for _ in range(count)]
+
+    def test_scopes_have_separate_budgets_that_refill(self):
+        ok, throttled = status.HTTP_200_OK, status.HTTP_429_TOO_MANY_REQUESTS
+        self.assertEqual(self.statuses(reverse('caller-id'), 4), [ok, ok, ok, throttled])
+        self.assertEqual(self.statuses(reverse('search-user-by-phone'), 3), [ok, ok, throttled])
+
+        # 2/m allows one more request every 30 seconds
+        response = self.client.get(reverse('search-user-by-phone'), {'phone_number': '7500000000'})
+        self.assertEqual(response['Retry-After'], '30')
+        self.now += 30
+        self.assertEqual(self.statuses(reverse('search-user-by-phone'), 2), [ok, throttled])
+
+    def test_registration_keeps_its_own_budget(self):
+        # Anonymous clients, registration keeps the 20/m it had under UserRateThrottle
+        self.client.force_authenticate(None)
+        rates = dict(settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'])
+        with mock.patch.object(GCRAThrottle, 'THROTTLE_RATES', rates):
+            statuses = [self.client.post(reverse('user-register'), {}).status_code for _ in range(21)]
+            self.assertEqual(statuses, [status.HTTP_400_BAD_REQUEST] * 20 + [status.HTTP_429_TOO_MANY_REQUESTS])
+            self.assertEqual(self.client.post(reverse('user-login'), {}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CACHES=LOCAL_CACHES, PASSWORD_PBKDF2_ITERATIONS=1000)
+class LoginViewTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='login_user', password='password123', phone_number='7600000000')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, name='user-login', password='password123'):
+        return self.client.post(reverse(name), {'username': 'login_user', 'password': password})
+
+    def test_login_reuses_the_token_and_rehashes_on_cost_change(self):
+        # The token is loaded with the user
+        with self.assertNumQueries(1):
+            self.assertEqual(self.login().data['message'], f"token {self.token.key}")
+
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, status.HTTP_201_CREATED)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+        self.assertEqual(self.login(password='wrong-password').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_async_login_hashes_in_the_pool(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            response = await self.async_client.post(
+                reverse('async-user-login'), {'username': 'login_user', 'password': 'password123'},
+                content_type='application/json',
+            )
+        self.assertEqual(response.json()['message'], f"token {self.token.key}")
+        self.assertTrue((await CustomUser.objects.aget(pk=self.user.pk)).password.startswith('pbkdf2_sha256$2000$'))
+
+        response = await self.async_client.post(
+            reverse('async-user-login'), {'username': 'nobody', 'password': 'password123'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(CACHES=LOCAL_CACHES, API_INSTRUMENTATION=True, API_SLOW_REQUEST_MS=0)
+class InstrumentationMiddlewareTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='measured', password='password123', phone_number='7700000000')
+        RegisteredUserContact.objects.create(contact_name='Office', phone_number='7700000001', contact_of=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def search(self):
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('users.instrumentation', 'WARNING') as logs:
+            response = self.client.get(reverse('search-user-by-phone'), {'phone_number': '7700000001'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response['Server-Timing'], len(queries), logs.output[0]
+
+    def test_server_timing_slow_log_and_metrics(self):
+        timing, queries, log = self.search()
+        self.assertIn(f'desc="{queries} queries"', timing)
+        self.assertIn('cache;desc="0 hits, 2 misses"', timing)
+        self.assertRegex(timing, r'serializer;dur=[\d.]+, total;dur=[\d.]+')
+        self.assertIn('SELECT', log)
+
+        timing, _, _ = self.search()
+        self.assertIn('cache;desc="2 hits, 0 misses"', timing)
+
+        with self.assertLogs('users.instrumentation', 'WARNING'):
+            metrics = self.client.get(reverse('internal-metrics'), REMOTE_ADDR='127.0.0.1').content.decode()
+        self.assertIn('api_request_db_queries_count{endpoint="search-user-by-phone"}', metrics)
+        self.assertIn('api_search_cache_lookups_total{endpoint="search-user-by-phone",result="hit"}', metrics)
+        with self.assertLogs('users.instrumentation', 'WARNING'):
+            response = self.client.get(reverse('internal-metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+@override_settings(CACHES=LOCAL_CACHES, PASSWORD_PBKDF2_ITERATIONS=1000)
+class SyntheticBenchmarkTests(APITransactionTestCase):
+    # Committed rows, the async endpoints read them from another thread's connection
+    def test_generated_dataset_serves_every_endpoint(self):
+        call_command(
+            'generate_synthetic_data', users=60, contacts=8, reports=100, hot_numbers=5, hot_share=0.3, scratch=True, stdout=StringIO(),
+        )
+        hot_number = RegisteredUserContact.objects.filter(phone_number='+918000000000')
+        self.assertGreater(hot_number.count(), 5)
+        self.assertEqual(CallerIdSummary.objects.get(phone_number='+918000000000').contact_count, hot_number.count())
+        self.assertTrue(PhoneSpamStats.objects.filter(phone_number='+918000000000', report_count__gt=1).exists())
+
+        output = StringIO()
+        with mock.patch.object(GCRAThrottle, 'THROTTLE_RATES', GCRAThrottle.THROTTLE_RATES):
+            call_command('run_benchmarks', requests=2, warmup=0, scratch=True, stdout=output, stderr=StringIO())
+        endpoints = json.loads(output.getvalue())['endpoints']
+        self.assertEqual(set(endpoints), {pattern.name for pattern in urls.urlpatterns})
+        for name, summary in endpoints.items():
+            self.assertEqual(summary['count'], 2)
+            self.assertTrue(all(int(code) < 500 for code in summary['statuses']), name)
+
+    def test_generated_search_entries_carry_the_spam_scores(self):
+        call_command(
+            'generate_synthetic_data', users=30, contacts=6, reports=40, hot_numbers=3, hot_share=0.5, scratch=True, stdout=StringIO(),
+        )
+        spam_scores = dict(PhoneSpamStats.objects.values_list('phone_key', 'epoch_score'))
+        entries = SearchEntry.objects.filter(phone_key__in=spam_scores)
+        self.assertTrue(entries.exists())
+        for key, epoch_score in entries.values_list('phone_key', 'epoch_score'):
+            self.assertAlmostEqual(epoch_score, spam_scores[key])
+
+    def test_dataset_and_endpoint_benchmarks_only_run_on_a_scratch_database(self):
+        for command in ['generate_synthetic_data', 'run_benchmarks']:
+            with self.assertRaisesMessage(CommandError, "pass --scratch"):
+                call_command(command, stdout=StringIO())
+            with mock.patch.dict(connection.settings_dict, NAME=settings.BASE_DIR / 'db.sqlite3'), \
+                    self.assertRaisesMessage(CommandError, "Refusing to run on the project database"):
+                call_command(command, scratch=True, stdout=StringIO())
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_search_benchmark_only_runs_on_a_scratch_database(self):
+        with self.assertRaisesMessage(CommandError, "pass --scratch"):
+            call_command('benchmark_search', users=10, stdout=StringIO())
+        with mock.patch.dict(connection.settings_dict, NAME=settings.BASE_DIR / 'db.sqlite3'), \
+                self.assertRaisesMessage(CommandError, "Refusing to run on the project database"):
+            call_command('benchmark_search', users=10, scratch=True, stdout=StringIO())
+        self.assertFalse(CustomUser.objects.exists())
+
+        output = StringIO()
+        call_command('benchmark_search', users=50, queries=5, backends=['scan', 'trigram'], scratch=True, stdout=output)
+        self.assertIn('trigram: 5 queries', output.getvalue())
+        self.assertFalse(CustomUser.objects.exists())
+
+
+@skipUnless(graph.sparse is not None, "propagate_spam_scores needs SciPy")
+@override_settings(CACHES=LOCAL_CACHES)
+class SpamPropagationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = [
+            CustomUser.objects.create_user(username=f'graph{i}', password='password123', phone_number=f'720100000{i}')
+            for i in range(10)
+        ]
+        for reporter in users[:3]:
+            ReportedUserSpam.objects.create(phone_number='7100000000', marked_by=reporter)
+        PhoneSpamStats.refresh_for([phone_key('7100000000')])
+        # The reported number shares three phone books with an unreported one
+        for saver in users[3:6]:
+            RegisteredUserContact.objects.create(contact_name='Courier', phone_number='7100000000', contact_of=saver)
+            RegisteredUserContact.objects.create(contact_name='Courier 2', phone_number='7100000001', contact_of=saver)
+        for saver in users[6:9]:
+            RegisteredUserContact.objects.create(contact_name='Spam caller', phone_number='7100000003', contact_of=saver)
+        RegisteredUserContact.objects.create(contact_name='Mom', phone_number='7100000002', contact_of=users[9])
+        cls.user = users[9]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def spam_likelihood(self, phone_number):
+        return self.client.get(reverse('caller-id'), {'phone_number': phone_number}).data['spam_likelihood']
+
+    def test_scores_spread_to_unreported_numbers_and_follow_changes(self):
+        self.assertEqual(self.spam_likelihood('7100000001'), 0.0)
+        call_command('propagate_spam_scores', full=True, stdout=StringIO())
+        self.assertEqual(self.spam_likelihood('7100000000'), 0.3)
+        self.assertEqual(self.spam_likelihood('7100000001'), 0.07)
+        # 3 of 3 saves named like spam, smoothed with 5 pseudo-saves
+        self.assertEqual(self.spam_likelihood('7100000003'), 0.37)
+        self.assertEqual(self.spam_likelihood('7100000002'), 0.0)
+        self.assertFalse(SpamGraphChange.objects.exists())
+
+        # Only the changed number and its phone books are rescored
+        RegisteredUserContact.objects.create(contact_name='FRAUD', phone_number='7100000002', contact_of=self.user)
+        self.assertTrue(SpamGraphChange.objects.filter(phone_key=phone_key('7100000002')).exists())
+        call_command('propagate_spam_scores', stdout=StringIO())
+        self.assertEqual(self.spam_likelihood('7100000002'), 0.14)
+        self.assertEqual(self.spam_likelihood('7100000001'), 0.07)
+
+        # Reports keep the graph part of the score when they are recounted
+        call_command('rebuild_spam_stats', stdout=StringIO())
+        self.assertEqual(PhoneSpamStats.likelihoods_for([phone_key('7100000003')]), {phone_key('7100000003'): 0.37})
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ContactNameLexiconTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='labeller', password='password123', phone_number='7300000000')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def negative_labels(self, phone_number):
+        return PhoneSpamStats.objects.filter(phone_key=phone_key(phone_number)).values_list('negative_labels', flat=True).first()
+
+    def test_matches_whole_words_in_any_language(self):
+        for name in ['Loan SPAM', "Don't   pick", 'फ्रॉड कॉल', 'Estafa banco', 'scam!']:
+            self.assertTrue(lexicon.is_negative(name), name)
+        for name in ['Fakeeha', 'Spamalot tickets', 'Raj Plumber', '']:
+            self.assertFalse(lexicon.is_negative(name), name)
+        with override_settings(SPAM_NAME_LEXICON=['plumber']):
+            self.assertTrue(lexicon.is_negative('Raj Plumber'))
+
+        # The migration that counted the first labels keeps its own copy
+        migration = importlib.import_module('users.migrations.0023_negative_labels')
+        self.assertNotIn('lexicon', vars(migration))
+        for name in ['Loan SPAM', "Don't   pick", 'फ्रॉड कॉल', 'Estafa banco', 'scam!', 'Fakeeha', 'Spamalot tickets']:
+            self.assertEqual(migration.is_negative(lexicon.normalize(name)), lexicon.is_negative(name), name)
+
+    def test_contact_writes_count_negative_labels(self):
+        response = self.client.post(
+            reverse('sync-contacts'),
+            [
+                {'contact_name': 'Loan spam', 'phone_number': '7300000001'},
+                {'contact_name': 'Fraud', 'phone_number': '7300000002'},
+                {'contact_name': 'Mom', 'phone_number': '7300000003'},
+            ],
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        contact = RegisteredUserContact.objects.create(contact_name='Spam', phone_number='7300000001', contact_of=self.user)
+        self.assertEqual(self.negative_labels('7300000001'), 2)
+        self.assertEqual(self.negative_labels('7300000002'), 1)
+        self.assertIsNone(self.negative_labels('7300000003'))
+
+        # Renames and deletes take their labels back
+        contact.contact_name = 'Bank'
+        contact.save()
+        RegisteredUserContact.objects.filter(phone_number='+917300000002').delete()
+        self.assertEqual(self.negative_labels('7300000001'), 1)
+        self.assertEqual(self.negative_labels('7300000002'), 0)
+
+        PhoneSpamStats.objects.update(negative_labels=5)
+        call_command('rebuild_contact_name_votes', stdout=StringIO())
+        self.assertEqual(self.negative_labels('7300000001'), 1)
+        self.assertEqual(self.negative_labels('7300000002'), 0)
@@ -0,0 +1,84 @@
+import threading
+from rest_framework.throttling import SimpleRateThrottle
+
+
+##############################################################################
+# Rate limiting with the generic cell rate algorithm (GCRA)
+# DRF's throttles keep a list of request timestamps per client and rewrite
+# it on every request. GCRA keeps one number per client, the theoretical
+# arrival time of its next request: a rate of N per period allows a burst of
+# N and then one request every period / N, like a sliding window.
+#   - On Redis the check and update is one atomic Lua script (see
+#     users/cache_backends.py), one round trip for sync and async views.
+#   - On local cache backends (tests, development) the same algorithm runs
+#     in-process under a lock.
+# Views pick their budget with 'throttle_scope', a key of
+# DEFAULT_THROTTLE_RATES. Views without one use the 'user' rate for
+# authenticated and the 'anon' rate for anonymous clients.
+##############################################################################
+
+class GCRAThrottle(SimpleRateThrottle):
+    cache_format = 'throttle_gcra_%(scope)s_%(ident)s'
+    local_lock = threading.Lock()
+
+    def __init__(self):
+        # The scope and rate depend on the view, they are resolved per request
+        self.wait_time = None
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def prepare(self, request, view):
+        # The cache key of this request, None when the scope is not limited
+        user = request.user
+        self.scope = getattr(view, 'throttle_scope', None) or ('user' if user and user.is_authenticated else 'anon')
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        if self.rate is None:
+            return None
+        return self.get_cache_key(request, view)
+
+    def limits(self):
+        # Emission interval and burst tolerance of the rate, in seconds
+        interval = self.duration / self.num_requests
+        return interval, self.duration - interval
+
+    def allow_request(self, request, view):
+        key = self.prepare(request, view)
+        if key is None:
+            return True
+        if hasattr(self.cache, 'gcra'):
+            self.wait_time = self.cache.gcra(key, *self.limits())
+        else:
+            self.wait_time = self.local_gcra(key, *self.limits())
+        return self.wait_time == 0
+
+    async def aallow_request(self, request, view):
+        key = self.prepare(request, view)
+        if key is None:
+            return True
+        if hasattr(self.cache, 'agcra'):
+            self.wait_time = await self.cache.agcra(key, *self.limits())
+        else:
+            # Local backends are in memory, the check does not block
+            self.wait_time = self.local_gcra(key, *self.limits())
+        return self.wait_time == 0
+
+    def local_gcra(self, key, interval, tolerance):
+        # Same steps as the Lua script, the lock makes them atomic per process
+        with self.local_lock:
+            now = self.timer()
+            tat = max(self.cache.get(key, now), now)
+            wait = tat - tolerance - now
+            if wait > 0:
+                return wait
+            tat += interval
+            self.cache.set(key, tat, tat - now)
+            return 0
+
+    def wait(self):
+        return self.wait_time
@@ -1,11 +1,24 @@
 from django.urls import path
-from .views import UserRegistrationView, UserLoginView, MarkPhoneNumberAsSpamView, SearchUserByUserNameView, SearchUserByPhoneNumberView, CreateContactView
+from .instrumentation import metrics_view
+from .async_views import AsyncUserLoginView, AsyncMarkPhoneNumberAsSpamView, AsyncSearchUserByUserNameView, AsyncSearchUserByPhoneNumberView
+from .views import UserRegistrationView, UserLoginView, UserLogoutView, MarkPhoneNumberAsSpamView, MarkPhoneNumbersAsSpamBatchView, SearchUserByUserNameView, SearchUserByPhoneNumberView, CreateContactView, ContactSyncView, CallerIdView
 
 urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='user-register'),
     path('login/', UserLoginView.as_view(), name='user-login'),
+    path('logout/', UserLogoutView.as_view(), name='user-logout'),
     path('mark_spam/', MarkPhoneNumberAsSpamView.as_view(), name='mark-spam'),
+    path('mark_spam/batch/', MarkPhoneNumbersAsSpamBatchView.as_view(), name='mark-spam-batch'),
     path('search-name/', SearchUserByUserNameView.as_view(), name='search-user-by-name'),
     path('search-phone/', SearchUserByPhoneNumberView.as_view(), name='search-user-by-phone'),
     path('create-contact/', CreateContactView.as_view(), name='create-contact'),
+    path('sync-contacts/', ContactSyncView.as_view(), name='sync-contacts'),
+    path('caller-id/', CallerIdView.as_view(), name='caller-id'),
+    # Prometheus metrics of the instrumentation middleware, for INTERNAL_IPS only
+    path('internal/metrics/', metrics_view, name='internal-metrics'),
+    # Async variants, meant to be served by the ASGI application
+    path('async/login/', AsyncUserLoginView.as_view(), name='async-user-login'),
+    path('async/mark_spam/', AsyncMarkPhoneNumberAsSpamView.as_view(), name='async-mark-spam'),
+    path('async/search-name/', AsyncSearchUserByUserNameView.as_view(), name='async-search-user-by-name'),
+    path('async/search-phone/', AsyncSearchUserByPhoneNumberView.as_view(), name='async-search-user-by-phone'),
 ]
\ No newline at end of file
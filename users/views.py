@@ -1,3 +1,5 @@
+import hashlib
+from collections.abc import Iterator
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -5,17 +7,31 @@ from rest_framework.permissions import AllowAny
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.throttling import UserRateThrottle
-from django.core.cache import cache
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from django.conf import settings
 from django.core.paginator import Paginator
-from users.serializers import UserRegistrationSerializer, UserLoginSerializer, ReportedUserSpamSerializer, SearchUserSerializer, RegisteredUserContactSerializer
-from users.models import CustomUser, RegisteredUserContact, ReportedUserSpam
+from django.db import IntegrityError, transaction
+from django.db.models import Case, When, Value, F, IntegerField, Exists, OuterRef
+from users import search_cache
+from users.phone import InvalidPhoneNumber, key_to_phone_number, phone_key
+from users.pagination import InvalidCursor, estimated_total, keyset_page
+from users.parsers import NDJSONParser
+from users import caller_id, report_queue, scoring, search_index
+from users.instrumentation import measure_serializer
+from users.search_backends import get_search_backend
+from users.search_index import SOURCE_USER
+from users.throttling import GCRAThrottle
+from users.serializers import UserRegistrationSerializer, UserLoginSerializer, ReportedUserSpamSerializer, SearchUserSerializer, RegisteredUserContactSerializer, ContactSyncItemSerializer, SpamReportBatchSerializer, CallerIdBatchSerializer
+from users.models import CustomUser, RegisteredUserContact, ReportedUserSpam, PhoneSpamStats, ContactSyncState, SearchEntry, CallerIdSummary, ContactNameVote
 
 class UserRegistrationView(APIView):
     # Allow unrestricted access to this endpoint
     permission_classes = [AllowAny]
     # API Throttling applied to limit the number of requests from users
-    throttle_classes = [UserRateThrottle]
+    throttle_classes = [GCRAThrottle]
+    # Clients are anonymous here, without a scope they would get the 'anon' rate
+    throttle_scope = 'registration'
 
     def post(self, request):
         # Deserialize the request data
@@ -36,7 +52,9 @@ class UserLoginView(APIView):
     # Unrestricted access to this endpoint
     permission_classes = [AllowAny]
     # API Throttling applied to limit the number of requests from users
-    throttle_classes = [UserRateThrottle]
+    throttle_classes = [GCRAThrottle]
+    # Logins get a budget of their own, see DEFAULT_THROTTLE_RATES
+    throttle_scope = 'login'
 
     def post(self, request):
         # Deserialize the data
@@ -50,8 +68,11 @@ class UserLoginView(APIView):
         # Authenticate the user using the provided credentials
         user_object = authenticate(username=username, password=password)
         if user_object:
-            # If authentication is successful generate auth token and send the response
-            token, _ = Token.objects.get_or_create(user=user_object)
+            # If authentication is successful reuse the token the backend
+            # loaded with the user, or generate one, and send the response
+            token = getattr(user_object, 'auth_token', None)
+            if token is None:
+                token, _ = Token.objects.get_or_create(user=user_object)
             return Response({"message": f"token {token.key}"}, status=status.HTTP_201_CREATED)
         
         # If authentication fails return a 401 response 
@@ -59,11 +80,63 @@ class UserLoginView(APIView):
 
 
 
-class MarkPhoneNumberAsSpamView(APIView):
+class UserLogoutView(APIView):
     # Allows access only to authenticated users
     permission_classes = [IsAuthenticated]
     # API Throttling applied to limit the number of requests from users
-    throttle_classes = [UserRateThrottle]
+    throttle_classes = [GCRAThrottle]
+
+    def post(self, request):
+        # Deleting the token revokes it, the next login issues a new one.
+        # The post_delete signal drops it from the token caches
+        Token.objects.filter(user=request.user).delete()
+        return Response({"message": "Logged out successfully"}, status=status.HTTP_200_OK)
+
+
+
+class MarkSpamMixin:
+    def record_spam(self, phone_number, user):
+        # Create a new spam entry with the current user who marked it
+        # and update the per-number counters in the same transaction.
+        # The unique constraint rejects numbers the user already marked
+        with transaction.atomic():
+            spam = ReportedUserSpam.objects.create(
+                phone_number=phone_number, 
+                marked_by=user
+            )
+            PhoneSpamStats.record_report(spam)
+            search_index.update_spam_scores([spam.phone_key])
+            caller_id.refresh([spam.phone_key])
+        return spam
+
+    def queue_spam(self, phone_number, user):
+        # Write-behind mode: appends the report to the queue and returns its
+        # id, or None when the user reported the number already, drained or not
+        key = phone_key(phone_number)
+        if report_queue.pending_keys(user, [key]) or ReportedUserSpam.objects.filter(marked_by=user, phone_key=key).exists():
+            return None
+        return report_queue.enqueue(user, {key: phone_number})[key]
+
+    def queued_response_body(self, phone_number, report_id):
+        return {
+            "message": f"The report of {phone_number} as spam has been queued.",
+            "report_id": report_id,
+        }
+
+    def spam_response_body(self, phone_number, spam):
+        spam_serializer = ReportedUserSpamSerializer(spam)
+        return {
+            "message": f"The number {phone_number} has been marked as spam.",
+            "spam": spam_serializer.data 
+        }
+
+
+
+class MarkPhoneNumberAsSpamView(MarkSpamMixin, APIView):
+    # Allows access only to authenticated users
+    permission_classes = [IsAuthenticated]
+    # API Throttling applied to limit the number of requests from users
+    throttle_classes = [GCRAThrottle]
 
     def post(self, request):
         # Deserialize the data
@@ -75,37 +148,265 @@ class MarkPhoneNumberAsSpamView(APIView):
             # Get the currently authenticated user
             user = request.user
 
-            # Check if the user has already marked this number as spam
-            if ReportedUserSpam.objects.filter(phone_number=phone_number, marked_by=user.id).exists():
+            if report_queue.enabled():
+                report_id = self.queue_spam(phone_number, user)
+                if report_id is None:
+                    return Response({
+                        "message": "You have already marked this number as spam."
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                # Recorded by drain_spam_reports, the reporter sees it right away
+                return Response(self.queued_response_body(phone_number, report_id), status=status.HTTP_202_ACCEPTED)
+
+            try:
+                spam = self.record_spam(phone_number, user)
+            except IntegrityError:
                 return Response({
                     "message": "You have already marked this number as spam."
                 }, status=status.HTTP_400_BAD_REQUEST)
 
-            # Create a new spam entry with the current user who marked it
-            spam = ReportedUserSpam.objects.create(
-                phone_number=phone_number, 
-                marked_by=user
-            )
-
-            # Invalidate cache
-            cache.clear()
+            # Invalidate only the cached searches that contain this number
+            search_cache.invalidate([search_cache.phone_tag(spam.phone_key)])
 
-            spam_serializer = ReportedUserSpamSerializer(spam)
             # Return a success response
-            return Response({
-                "message": f"The number {phone_number} has been marked as spam.",
-                "spam": spam_serializer.data 
-            }, status=status.HTTP_201_CREATED)
+            return Response(self.spam_response_body(phone_number, spam), status=status.HTTP_201_CREATED)
         # If the incoming data is invalid, return a 400 response
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 
-class SearchUserByUserNameView(APIView):
+class MarkPhoneNumbersAsSpamBatchView(APIView):
+    # Allows access only to authenticated users
+    permission_classes = [IsAuthenticated]
+    # API Throttling applied to limit the number of requests from users
+    throttle_classes = [GCRAThrottle]
+
+    def post(self, request):
+        # Clients queue reports offline and flush them here, reporting the same
+        # numbers again is harmless and answered per number
+        serializer = SpamReportBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        keys = {}
+        for raw_number in serializer.validated_data['phone_numbers']:
+            try:
+                key = phone_key(raw_number)
+            except InvalidPhoneNumber as error:
+                results.append({"phone_number": raw_number, "status": "invalid", "error": str(error)})
+                continue
+            results.append({"phone_number": key_to_phone_number(key)})
+            keys[key] = key_to_phone_number(key)
+
+        if report_queue.enabled():
+            return self.queue_reports(request.user, keys, results)
+
+        with transaction.atomic():
+            already_reported = set(
+                ReportedUserSpam.objects.filter(marked_by=request.user, phone_key__in=keys)
+                                        .values_list('phone_key', flat=True)
+            )
+            new_keys = [key for key in keys if key not in already_reported]
+            # Concurrent flushes of the same reports are dropped by the unique constraint
+            ReportedUserSpam.objects.bulk_create(
+                [ReportedUserSpam(phone_number=keys[key], phone_key=key, marked_by=request.user) for key in new_keys],
+                ignore_conflicts=True,
+            )
+            # Rows skipped on conflict are unknown, so the status is built from
+            # the reports the user has now and the counters are recounted
+            new_keys = list(
+                ReportedUserSpam.objects.filter(marked_by=request.user, phone_key__in=new_keys)
+                                        .values_list('phone_key', flat=True)
+            )
+            PhoneSpamStats.refresh_for(new_keys)
+            search_index.update_spam_scores(new_keys)
+            caller_id.refresh(new_keys)
+
+        search_cache.invalidate([search_cache.phone_tag(key) for key in new_keys])
+
+        reported = set(new_keys)
+        for result in results:
+            if "status" in result:
+                continue
+            key = phone_key(result["phone_number"])
+            if key in reported:
+                result["status"] = "reported"
+                # Later duplicates within the same batch count as already reported
+                reported.discard(key)
+            else:
+                result["status"] = "already_reported"
+
+        return Response({
+            "reported": len(new_keys),
+            "results": results,
+        }, status=status.HTTP_200_OK)
+
+    def queue_reports(self, user, keys, results):
+        # Write-behind mode: the new reports are queued like single ones, the
+        # numbers the user reported before, drained or not, are answered here
+        already_reported = report_queue.pending_keys(user, keys) | set(
+            ReportedUserSpam.objects.filter(marked_by=user, phone_key__in=keys).values_list('phone_key', flat=True)
+        )
+        new_keys = {key: phone_number for key, phone_number in keys.items() if key not in already_reported}
+        report_ids = report_queue.enqueue(user, new_keys) if new_keys else {}
+        for result in results:
+            if "status" in result:
+                continue
+            key = phone_key(result["phone_number"])
+            if key in report_ids:
+                result["status"] = "queued"
+                # Later duplicates within the same batch count as already reported
+                result["report_id"] = report_ids.pop(key)
+            else:
+                result["status"] = "already_reported"
+
+        return Response({
+            "queued": len(new_keys),
+            "results": results,
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+
+#######################################################################
+# Query parameters and response shapes shared by the sync search views
+# and their async variants in users/async_views.py
+#######################################################################
+def read_page_params(query_params):
+    # A ValueError carries the message returned to the client
+    try:
+        result_size = int(query_params.get('result_size', 2))
+    except ValueError:
+        raise ValueError("'result_size' must be a valid integer.")
+
+    # Ensure that 'result_size' is greater than 0
+    if result_size <= 0:
+        raise ValueError("'result_size' must be greater than 0.")
+
+    # 'page' returns numbered pages with a total count, 'cursor' returns keyset
+    # pages whose cost does not grow with depth and only counts when asked to
+    pagination = query_params.get('pagination', 'page')
+    if pagination not in ('page', 'cursor'):
+        raise ValueError("'pagination' must be either 'page' or 'cursor'.")
+
+    return {
+        "page": query_params.get('page', 1),
+        "result_size": result_size,
+        "pagination": pagination,
+        "cursor": query_params.get('cursor', ''),
+        "include_total": query_params.get('include_total', '').lower() in ('1', 'true'),
+    }
+
+
+def with_queued_reports(viewer, response_body):
+    # Read-your-writes of the write-behind spam reports, applied on top of
+    # the cached pages the viewer's queued reports are not in yet
+    if not report_queue.enabled() or not response_body:
+        return response_body
+    return {**response_body, "results": report_queue.overlay(viewer, response_body["results"])}
+
+
+async def awith_queued_reports(viewer, response_body):
+    if not report_queue.enabled() or not response_body:
+        return response_body
+    return {**response_body, "results": await report_queue.aoverlay(viewer, response_body["results"])}
+
+
+def page_cache_suffix(params):
+    if params['pagination'] == 'cursor':
+        cursor_hash = hashlib.md5(params['cursor'].encode()).hexdigest()
+        return f"cursor_{cursor_hash}_size_{params['result_size']}_total_{params['include_total']}"
+    return f"page_{params['page']}_size_{params['result_size']}"
+
+
+class NameSearchMixin:
+    def search_queryset(self, viewer, search_query):
+        # Search registered usernames and saved contact names through the configured
+        # search backend over the precomputed search table. Names that start with the
+        # query come first and registered users before contacts. Spam likelihood is
+        # stored on the entries and contact membership is a subquery, so a page costs
+        # a constant number of queries
+        return get_search_backend().search(
+            SearchEntry.objects.all(), 'name', search_query
+        ).annotate(
+            rank=F('match_rank') * 2 + Case(
+                When(source=SOURCE_USER, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            ),
+            is_in_my_contacts=Exists(
+                RegisteredUserContact.objects.filter(
+                    contact_of=viewer, phone_key=OuterRef('phone_key')
+                )
+            ),
+        ).order_by('rank', 'id')
+
+    @measure_serializer()
+    def serialize_page(self, entries):
+        # The whole page is scored in one batch call
+        spam_likelihoods = scoring.likelihoods([entry.epoch_score for entry in entries])
+        return [self.serialize_entry(entry, spam_likelihood) for entry, spam_likelihood in zip(entries, spam_likelihoods)]
+
+    def serialize_entry(self, entry, spam_likelihood):
+        if entry.source != SOURCE_USER:
+            return {
+                "contact_name": entry.name,
+                "phone_number": entry.phone_number,
+                "spam_likelihood": spam_likelihood
+            }
+
+        user_data = {
+            "username": entry.name,
+            "phone_number": entry.phone_number,
+            "spam_likelihood": spam_likelihood
+        }
+        # email is displayed if person is a registered user and
+        # user who is searching is in the person’s contact list
+        if entry.is_in_my_contacts:
+            user_data["email"] = entry.email
+
+        # Serialize the user data
+        return SearchUserSerializer(user_data).data
+
+    def cache_tags(self, viewer, entries):
+        # Cached pages are tagged with the numbers they show and the viewer's contact list
+        tags = [search_cache.phone_tag(entry.phone_key) for entry in entries]
+        tags.append(search_cache.contacts_tag(viewer.id))
+        return tags
+
+
+class PhoneSearchMixin:
+    def registered_user_data(self, user, spam_likelihood):
+        if not user:
+            return {"user": None, "email": None}
+        return {
+            "user": {
+                "username": user.username,
+                "phone_number": user.phone_number,
+                "spam_likelihood": spam_likelihood
+            },
+            "email": user.email,
+        }
+
+    @measure_serializer()
+    def serialize_contacts(self, contacts, spam_likelihood):
+        # All contacts share the searched number, so one likelihood covers the page
+        response_data = []
+        for contact in contacts:
+            user_data = {
+                "contact_name": contact.contact_name,
+                "phone_number": contact.phone_number,
+                "spam_likelihood": spam_likelihood
+            }
+            response_data.append(user_data)
+        return response_data
+
+
+
+class SearchUserByUserNameView(NameSearchMixin, APIView):
     # Only authenticated users can access this view
     permission_classes = [IsAuthenticated]
     # API Throttling applied to limit the number of requests from users
-    throttle_classes = [UserRateThrottle]
+    throttle_classes = [GCRAThrottle]
 
     def get(self, request):
         # Get the 'name' query parameter from the URL
@@ -115,76 +416,60 @@ class SearchUserByUserNameView(APIView):
             return Response({"error": "Name query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Get the page number and results per page (default set to 1 and 2 respectively)
-        page_number = request.query_params.get('page', 1)
-        result_size = request.query_params.get('result_size', 2)
-
         try:
-            result_size = int(result_size)
-        except ValueError:
-            return Response({"error": "'result_size' must be a valid integer."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Ensure that 'result_size' is greater than 0
-        if result_size <= 0:
-            return Response({"error": "'result_size' must be greater than 0."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Check cache
-        cache_key = f"user_search_{search_query}_page_{page_number}_size_{result_size}"
-        cached_results = cache.get(cache_key)
-
-        if cached_results:
-            return Response(cached_results, status=status.HTTP_200_OK)
-
-        # Search for usernames that start with the query string
-        results_start = CustomUser.objects.filter(username__istartswith=search_query)
-        # Search for usernames that contain the query string
-        results_contain = CustomUser.objects.filter(
-                                                    username__icontains=search_query
-                                                    ).exclude(username__istartswith=search_query)
-        # Combine both result sets
-        results = list(results_start) + list(results_contain)
-
-        # Add pagination
-        paginator = Paginator(results, result_size) 
-        page_obj = paginator.get_page(page_number)
-
-        response_data = []
-        for user in page_obj:
-            # Calculate spam likelihood based on count
-            spam_count = ReportedUserSpam.objects.filter(phone_number=user.phone_number).count()
-            spam_likelihood = min(1.0, spam_count / 10)  
-            user_data = {
-                "username": user.username,
-                "phone_number": user.phone_number,
-                "spam_likelihood": round(spam_likelihood, 2)
+            params = read_page_params(request.query_params)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        result_size = params['result_size']
+
+        # Check cache, entries are per viewer because email visibility depends
+        # on the viewer's contacts
+        query_hash = hashlib.md5(search_query.lower().encode()).hexdigest()
+        cache_key = f"user_search_{request.user.id}_{query_hash}_{page_cache_suffix(params)}"
+        cached_results = search_cache.get_entry(cache_key, [search_cache.contacts_tag(request.user.id)])
+
+        if cached_results is not None:
+            return Response(with_queued_reports(request.user, cached_results), status=status.HTTP_200_OK)
+
+        results = self.search_queryset(request.user, search_query)
+
+        if params['pagination'] == 'cursor':
+            try:
+                page_obj, next_cursor = keyset_page(results, params['cursor'], result_size, rank_field='rank')
+            except InvalidCursor as error:
+                return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+            response_body = {
+                "results": self.serialize_page(page_obj),
+                "next_cursor": next_cursor,
+                "results_per_page": result_size
+            }
+            if params['include_total']:
+                response_body["total_results"] = estimated_total(f"user_search_total_{query_hash}", results)
+        else:
+            # Add pagination, the page is sliced in the database
+            paginator = Paginator(results, result_size) 
+            page_obj = paginator.get_page(params['page'])
+            response_body = {
+                "results": self.serialize_page(page_obj),
+                "current_page": page_obj.number,
+                "total_pages": paginator.num_pages,
+                "total_results": paginator.count,
+                "results_per_page": result_size
             }
-            # email is displayed if person is a registered user and
-            # user who is searching is in the person’s contact list
-            if RegisteredUserContact.objects.filter(contact_of=request.user, phone_number=user.phone_number).exists():
-                user_data["email"] = user.email
 
-            # Serialize the user data
-            user_serializer = SearchUserSerializer(user_data)
-            response_data.append(user_serializer.data)
-        
         # Cache the response for 100 seconds
-        cache.set(cache_key, response_data, timeout=100)
+        search_cache.set_entry(cache_key, response_body, self.cache_tags(request.user, page_obj), timeout=100)
 
         # Return the paginated search results
-        return Response({
-            "results": response_data,
-            "current_page": page_obj.number,
-            "total_pages": paginator.num_pages,
-            "total_results": paginator.count,
-            "results_per_page": result_size
-        }, status=status.HTTP_200_OK)
+        return Response(with_queued_reports(request.user, response_body), status=status.HTTP_200_OK)
 
 
 
-class SearchUserByPhoneNumberView(APIView):
+class SearchUserByPhoneNumberView(PhoneSearchMixin, APIView):
     # Only authenticated users can access this view
     permission_classes = [IsAuthenticated]
     # API Throttling applied to limit the number of requests from users
-    throttle_classes = [UserRateThrottle]
+    throttle_classes = [GCRAThrottle]
 
     def get(self, request):
         # Get the 'phone_number' query parameter from the request
@@ -193,93 +478,322 @@ class SearchUserByPhoneNumberView(APIView):
         # Return an error response if 'phone_number' is not provided
         if not phone_number:
             return Response({"error": "Phone number query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        page_number = request.query_params.get('page', 1)
-        result_size = request.query_params.get('result_size', 2)
 
+        # All lookups below use the canonical numeric key of the number
         try:
-            result_size = int(result_size)
-        except ValueError:
-            return Response({"error": "'result_size' must be a valid integer."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        if result_size <= 0:
-            return Response({"error": "'result_size' must be greater than 0."}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Check cache for exisiting data
-        cache_key = f"user_phone_search_{phone_number}_page_{page_number}_size_{result_size}"
-        cached_data = cache.get(cache_key)
-
-        # If the results are cached return the cached data directly
-        # if cached_data:
-        #     return Response(cached_data, status=status.HTTP_200_OK)
-        
-        # Search for user with the given phone number in the CustomUser model
-        user = CustomUser.objects.filter(phone_number=phone_number).first()
-
-        if user:
-            # Calculate spam likelihood based on spam count
-            spam_count = ReportedUserSpam.objects.filter(phone_number=user.phone_number).count()
-            spam_likelihood = min(1.0, spam_count / 10)  
-            user_data = {
-                "username": user.username,
-                "phone_number": user.phone_number,
-                "spam_likelihood": round(spam_likelihood, 2)
-            }
+            key = phone_key(phone_number)
+            params = read_page_params(request.query_params)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Viewer independent layer: the registered user behind this number, shared
+        # by every caller. The email is kept aside and only revealed per viewer
+        tags = [search_cache.phone_tag(key)]
+        lookup_key = f"user_phone_search_{key}"
+        lookup = search_cache.get_entry(lookup_key, tags)
+        if lookup is None:
+            lookup = self.lookup_registered_user(key)
+            search_cache.set_entry(lookup_key, lookup, tags, timeout=600)
+
+        if lookup['user'] is not None:
+            user_data = dict(lookup['user'])
             # email is displayed if person is a registered user and
             # user who is searching is in the person’s contact list
-            if RegisteredUserContact.objects.filter(contact_of=request.user, phone_number=user.phone_number).exists():
-                user_data["email"] = user.email
-
-            # Serialize the user data and cache it
-            serializer = SearchUserSerializer(user_data)
-            cache.set(cache_key, serializer.data, timeout=600)
+            if self.is_in_viewer_contacts(request.user, key):
+                user_data["email"] = lookup['email']
 
+            serializer = SearchUserSerializer(report_queue.overlay(request.user, [user_data])[0])
             return Response(serializer.data, status=status.HTTP_200_OK)
 
-        # If the phone number is not in CustomUser search in RegisteredUserContact model
-        contacts = RegisteredUserContact.objects.filter(phone_number=phone_number)
+        # If the phone number is not in CustomUser search in RegisteredUserContact model,
+        # contact pages never expose emails so they are shared by all viewers as well
+        page_key = f"user_phone_search_{key}_{page_cache_suffix(params)}"
+        response_body = search_cache.get_entry(page_key, tags)
+        if response_body is None:
+            try:
+                if params['pagination'] == 'cursor':
+                    response_body = self.contacts_cursor_page(key, params)
+                else:
+                    response_body = self.contacts_page(key, params)
+            except InvalidCursor as error:
+                return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+            search_cache.set_entry(page_key, response_body, tags, timeout=100)
+
         # If no contacts are found, return a 404 response
-        if not contacts:
+        if not response_body:
             return Response({"message": "No results found for this phone number."}, status=status.HTTP_404_NOT_FOUND)
-        
-        # Apply pagination
-        paginator = Paginator(contacts, result_size)
-        page_obj = paginator.get_page(page_number)
 
-        response_data = []
-        for contact in page_obj:
-            spam_count = ReportedUserSpam.objects.filter(phone_number=contact.phone_number).count()
-            spam_likelihood = min(1.0, spam_count / 10)
-            user_data = {
-                "contact_name": contact.contact_name,
-                "phone_number": contact.phone_number,
-                "spam_likelihood": round(spam_likelihood, 2)
-            }
-            response_data.append(user_data)
-        
-        # Cache the results
-        cache.set(cache_key, response_data, timeout=100)
         # Return the paginated results in the response
-        return Response({
-            "results": response_data,
+        return Response(with_queued_reports(request.user, response_body), status=status.HTTP_200_OK)
+
+    def lookup_registered_user(self, key):
+        # Search for user with the given phone number in the CustomUser model
+        user = CustomUser.objects.filter(phone_key=key).first()
+        # Read spam likelihood from the maintained per-number counters
+        spam_likelihood = PhoneSpamStats.likelihoods_for([key])[key] if user else None
+        return self.registered_user_data(user, spam_likelihood)
+
+    def is_in_viewer_contacts(self, viewer, key):
+        # Per viewer overlay, invalidated whenever the viewer adds a contact
+        membership_key = f"contact_membership_{viewer.id}_{key}"
+        tags = [search_cache.contacts_tag(viewer.id)]
+        is_contact = search_cache.get_entry(membership_key, tags)
+        if is_contact is None:
+            is_contact = RegisteredUserContact.objects.filter(contact_of=viewer, phone_key=key).exists()
+            search_cache.set_entry(membership_key, is_contact, tags, timeout=600)
+        return is_contact
+
+    def contacts_page(self, key, params):
+        contacts = RegisteredUserContact.objects.filter(phone_key=key).order_by('id')
+        # Apply pagination
+        paginator = Paginator(contacts, params['result_size'])
+        if paginator.count == 0:
+            return {}
+        page_obj = paginator.get_page(params['page'])
+
+        spam_likelihood = PhoneSpamStats.likelihoods_for([key])[key]
+        return {
+            # The names most people saved this number under, with their counts
+            "top_names": ContactNameVote.top_names(key),
+            "results": self.serialize_contacts(page_obj, spam_likelihood),
             "current_page": page_obj.number,
             "total_pages": paginator.num_pages,
             "total_results": paginator.count,
-            "results_per_page": result_size
-        }, status=status.HTTP_200_OK)
-    
+            "results_per_page": params['result_size']
+        }
+
+    def contacts_cursor_page(self, key, params):
+        contacts = RegisteredUserContact.objects.filter(phone_key=key).order_by('id')
+        page, next_cursor = keyset_page(contacts, params['cursor'], params['result_size'])
+        # Only the first page can tell that nobody saved this number
+        if not page and not params['cursor']:
+            return {}
+
+        spam_likelihood = PhoneSpamStats.likelihoods_for([key])[key]
+        response_body = {
+            "top_names": ContactNameVote.top_names(key),
+            "results": self.serialize_contacts(page, spam_likelihood),
+            "next_cursor": next_cursor,
+            "results_per_page": params['result_size']
+        }
+        if params['include_total']:
+            response_body["total_results"] = estimated_total(f"user_phone_search_total_{key}", contacts)
+        return response_body
+
 
 
 class CreateContactView(APIView):
     permission_classes = [IsAuthenticated]
-    throttle_classes = [UserRateThrottle]
+    throttle_classes = [GCRAThrottle]
 
     def post(self, request):
         data = request.data.copy() 
         data['contact_of'] = request.user.id
         serializer = RegisteredUserContactSerializer(data=data)
         if serializer.is_valid():
-            serializer.save()
+            contact = serializer.save()
+            # New contacts change email visibility for this user and the
+            # contact listing of the saved number
+            search_cache.invalidate([
+                search_cache.contacts_tag(request.user.id),
+                search_cache.phone_tag(contact.phone_key),
+            ])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+
+class ContactSyncView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [GCRAThrottle]
+    # Whole phone book uploads are rare and expensive
+    throttle_scope = 'contact_sync'
+    # Accepts a JSON array or a streamed NDJSON body
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request):
+        # 'full' uploads the whole phone book and replaces the synced contacts,
+        # 'delta' only sends the entries added or removed since 'sync_token'
+        mode = request.query_params.get('mode', 'full')
+        if mode not in ('full', 'delta'):
+            return Response({"error": "'mode' must be either 'full' or 'delta'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        entries = request.data
+        if not isinstance(entries, (list, Iterator)):
+            return Response({"error": "Expected a JSON array or NDJSON body of contacts."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # Lock the sync state so concurrent syncs of one user are applied in order
+            sync_state, _ = ContactSyncState.objects.select_for_update().get_or_create(user=request.user)
+            if mode == 'delta' and not sync_state.matches_token(request.query_params.get('sync_token', '')):
+                return Response({
+                    "error": "The sync token is missing or stale, a full sync is required.",
+                }, status=status.HTTP_409_CONFLICT)
+
+            result, changed_keys = self.apply_entries(request.user, entries, prune=(mode == 'full'))
+            # Bulk writes bypass the signals, the top names may have changed
+            caller_id.refresh(changed_keys)
+
+            sync_state.version += 1
+            sync_state.save()
+
+        # New, edited and removed contacts change the cached searches of these numbers
+        search_cache.invalidate(
+            [search_cache.contacts_tag(request.user.id)]
+            + [search_cache.phone_tag(key) for key in changed_keys]
+        )
+
+        result["sync_token"] = sync_state.sync_token
+        return Response(result, status=status.HTTP_200_OK)
+
+    def apply_entries(self, user, entries, prune):
+        result = {"created": 0, "updated": 0, "removed": 0, "unchanged": 0, "errors": []}
+        changed_keys = set()
+        synced_keys = set()
+
+        # Existing contacts of the user by number, uploaded entries are deduplicated against these
+        existing = {}
+        for contact in RegisteredUserContact.objects.filter(contact_of=user).order_by('id'):
+            existing.setdefault(contact.phone_key, contact)
+
+        for offset, chunk in self.iter_chunks(entries, settings.CONTACT_SYNC_BATCH_SIZE):
+            # Validate the chunk, the last entry for a number wins
+            operations = {}
+            validator = ContactSyncItemSerializer()
+            for index, entry in enumerate(chunk, start=offset):
+                try:
+                    data = validator.run_validation(entry)
+                except ValidationError as error:
+                    result["errors"].append({"index": index, "errors": error.detail})
+                    continue
+                operations[phone_key(data['phone_number'])] = data
+
+            to_create, to_update, to_remove = [], [], []
+            # Removed contacts take their votes back through the post_delete signal
+            votes = {}
+            for key, data in operations.items():
+                if data['op'] == 'remove':
+                    synced_keys.discard(key)
+                    if existing.pop(key, None) is not None:
+                        to_remove.append(key)
+                    continue
+
+                synced_keys.add(key)
+                email = data.get('email') or None
+                contact = existing.get(key)
+                if contact is None:
+                    existing[key] = RegisteredUserContact(
+                        contact_name=data['contact_name'], phone_number=data['phone_number'],
+                        phone_key=key, email=email, contact_of=user,
+                    )
+                    to_create.append(existing[key])
+                    votes[key, data['contact_name']] = votes.get((key, data['contact_name']), 0) + 1
+                elif (contact.contact_name, contact.email) != (data['contact_name'], email):
+                    if contact.contact_name != data['contact_name']:
+                        votes[key, contact.contact_name] = votes.get((key, contact.contact_name), 0) - 1
+                        votes[key, data['contact_name']] = votes.get((key, data['contact_name']), 0) + 1
+                    contact.contact_name, contact.email = data['contact_name'], email
+                    to_update.append(contact)
+                else:
+                    result["unchanged"] += 1
+
+            if to_remove:
+                result["removed"] += RegisteredUserContact.objects.filter(contact_of=user, phone_key__in=to_remove).delete()[0]
+            RegisteredUserContact.objects.bulk_create(to_create)
+            RegisteredUserContact.objects.bulk_update(to_update, ['contact_name', 'email'])
+            # Bulk writes bypass the signals that maintain the name search table and
+            # the name votes, deletes still send post_delete for every row
+            search_index.index_contacts(to_create + to_update)
+            ContactNameVote.apply(votes)
+            result["created"] += len(to_create)
+            result["updated"] += len(to_update)
+            changed_keys.update(to_remove, (contact.phone_key for contact in to_create + to_update))
+
+        if prune:
+            # A full sync mirrors the uploaded phone book, contacts missing from it are removed
+            stale = RegisteredUserContact.objects.filter(contact_of=user).exclude(phone_key__in=synced_keys)
+            changed_keys.update(key for key in stale.values_list('phone_key', flat=True) if key is not None)
+            result["removed"] += stale.delete()[0]
+
+        return result, changed_keys
+
+    def iter_chunks(self, entries, size):
+        chunk = []
+        offset = 0
+        for entry in entries:
+            chunk.append(entry)
+            if len(chunk) == size:
+                yield offset, chunk
+                offset += size
+                chunk = []
+        if chunk:
+            yield offset, chunk
+
+
+
+###########################################################################
+# Caller-ID lookup for incoming calls ("who is this and is it spam?")
+# Answered from the precomputed CallerIdSummary rows only: one unique index
+# lookup, no pagination, no model serializer and no cache round trip.
+# POST identifies a batch of numbers at once to annotate a call log
+###########################################################################
+class CallerIdView(APIView):
+    # Allows access only to authenticated users
+    permission_classes = [IsAuthenticated]
+    # API Throttling applied to limit the number of requests from users
+    throttle_classes = [GCRAThrottle]
+    # Incoming calls and call log annotation need a larger budget
+    throttle_scope = 'caller_id'
+
+    def get(self, request):
+        phone_number = request.query_params.get('phone_number', '').strip()
+        if not phone_number:
+            return Response({"error": "Phone number query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            key = phone_key(phone_number)
+        except InvalidPhoneNumber as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self.identify([key], request.user)[key], status=status.HTTP_200_OK)
+
+    def post(self, request):
+        serializer = CallerIdBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Invalid numbers are answered in place, the rest with one query
+        keys = []
+        for raw_number in serializer.validated_data['phone_numbers']:
+            try:
+                keys.append(phone_key(raw_number))
+            except InvalidPhoneNumber as error:
+                keys.append({"phone_number": raw_number, "error": str(error)})
+        identified = self.identify([key for key in keys if isinstance(key, int)], request.user)
+
+        return Response({
+            "results": [identified[key] if isinstance(key, int) else key for key in keys],
+        }, status=status.HTTP_200_OK)
+
+    def identify(self, keys, viewer):
+        summaries = CallerIdSummary.objects.filter(phone_key__in=set(keys)).values_list(
+            'phone_key', 'username', 'top_contact_name', 'epoch_score'
+        )
+        # Unknown numbers have no name and were never reported
+        rows = dict.fromkeys(keys, (None, None, 0.0))
+        rows.update((key, row) for key, *row in summaries)
+        # The viewer's own reports still waiting in the write-behind queue
+        pending = report_queue.pending_scores(viewer, rows)
+        spam_likelihoods = scoring.likelihoods([
+            epoch_score + pending.get(key, 0.0) for key, (_, _, epoch_score) in rows.items()
+        ])
+        return {
+            key: {
+                "phone_number": key_to_phone_number(key),
+                "name": username or top_contact_name,
+                "is_registered": username is not None,
+                "spam_likelihood": spam_likelihood,
+            }
+            for (key, (username, top_contact_name, _)), spam_likelihood in zip(rows.items(), spam_likelihoods)
+        }